@@ -14,9 +14,25 @@ import traceback
 import paho.mqtt.client as mqtt
 import threading
 import time
-from collections import deque
+import random
 
 from scc_log import Log
+from mqtt_spool import *
+from mqtt_dispatcher import *
+from mqtt_publisher import *
+
+MQTT_STATE_DISCONNECTED = "disconnected"
+MQTT_STATE_CONNECTING = "connecting"
+MQTT_STATE_CONNECTED = "connected"
+MQTT_STATE_CON_ERROR = "con_error"
+
+CONNECT_TIMEOUT = 10
+RECONNECT_BASE_DELAY = 0.25
+RECONNECT_MAX_DELAY = 10
+
+DEFAULT_SPOOL_DRAIN_RATE = 100
+'''time disconnect() spends publishing spooled messages, the rest stays in the spool file'''
+SPOOL_FLUSH_TIMEOUT = 5
 
 
 class MqttClient:
@@ -29,14 +45,37 @@ class MqttClient:
         self.user_name = username
         self.pwd = password
         self.sub_cbak_fn = {}
-        self.pub_msg_queue = deque()
+        self.dispatcher = None
+        self.publisher = None
+        self.max_inflight = None
+        self.on_pub_ack = None
+        self.on_discon_fn = None
+        '''called on the callback thread after every subscribe callback, set before sub'''
+        self.sub_done_fn = None
+        '''MqttPublisher owning this connection, spooled messages are drained through its window'''
+        self.drain_publisher = None
+        self.spool = OutboundSpool()
+        self.spool_drain_rate = DEFAULT_SPOOL_DRAIN_RATE
+        self.spool_drain_th = None
+        self.spool_drain_lock = threading.Lock()
         self.is_connected = False
         self.con_error = False
+        self.con_state = MQTT_STATE_DISCONNECTED
+        self.con_cond = threading.Condition()
+        self.quit_event = threading.Event()
         self.retry = False
         self.thread_started = False
         self.thread_quit = False
         self.th = None
         self.manual_discon = False
+        self.discon_ts = 0.0
+
+        '''connection metrics'''
+        self.connect_count = 0
+        self.reconnect_attempts = 0
+        self.last_connect_duration = 0.0
+        self.last_reconnect_duration = 0.0
+        self.max_reconnect_duration = 0.0
         if Log.logger is None:
             Log()
         self.client = mqtt.Client(clientid, clean_session=True, userdata=None)
@@ -45,37 +84,69 @@ class MqttClient:
     def __del__(self):
         Log.logger.info(f'{self.name}: Destructor is called client_id: {self.client_id}')
 
+    def set_con_state(self, state):
+        with self.con_cond:
+            self.con_state = state
+            self.is_connected = state == MQTT_STATE_CONNECTED
+            self.con_error = state == MQTT_STATE_CON_ERROR
+            self.con_cond.notify_all()
+
+    def wait_con_result(self, timeout=CONNECT_TIMEOUT):
+        '''block until on_con reports the connect result or timeout, returns is_connected'''
+        with self.con_cond:
+            self.con_cond.wait_for(
+                lambda: self.con_state != MQTT_STATE_CONNECTING or self.thread_quit, timeout)
+            return self.is_connected
+
+    def get_reconnect_delay(self, attempt):
+        '''exponential backoff with full jitter'''
+        return random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * (2 ** min(attempt, 16))))
+
+    def get_connection_stats(self):
+        return {"state": self.con_state,
+                "connect_count": self.connect_count,
+                "reconnect_attempts": self.reconnect_attempts,
+                "last_connect_duration": self.last_connect_duration,
+                "last_reconnect_duration": self.last_reconnect_duration,
+                "max_reconnect_duration": self.max_reconnect_duration}
+
     def connect(self):
         try:
             self.setup_pre_con_params()
+            ts_start = time.time()
             self.client.connect(self.broker_ip, self.broker_port, 60)
             self.client.loop_start()
-            while not self.is_connected and not self.con_error:
-                pass
-            if self.is_connected:
-                Log.logger.warning(f'{self.name}: ***** CONNECT MQTT broker : {self.broker_ip}  Success *****')
+            if self.wait_con_result():
+                self.connect_count += 1
+                self.last_connect_duration = time.time() - ts_start
+                Log.logger.warning(f'{self.name}: ***** CONNECT MQTT broker : {self.broker_ip}  Success '
+                                   f'in {self.last_connect_duration:.3f}s *****')
                 self.setup_post_con_params()
                 self.thread_started = False
-            if self.con_error:
+            else:
                 Log.logger.error(f'{self.name}: ***** Unable to CONNECT to  MQTT broker : {self.broker_ip}'
                                  f'Retrying ******')
+                self.discon_ts = time.time()
                 if not self.thread_started:
                     self.start_reconnect_th()
         except:
             Log.logger.error(
                 f'{self.name}: ***** Unable to CONNECT to  MQTT broker : {self.broker_ip} Retrying.  Error: '
                 f'{sys.exc_info()[0]} *****')
+            self.discon_ts = time.time()
             if not self.thread_started:
                 self.start_reconnect_th()
 
     def setup_pre_con_params(self):
         self.client.loop_stop()
-        self.is_connected = False
-        self.con_error = False
+        self.set_con_state(MQTT_STATE_CONNECTING)
         self.manual_discon = False
         self.client.on_connect = self.on_con
         self.client.on_disconnect = self.on_discon
         self.client.on_message = self.on_msg
+        self.client.on_publish = self.on_pub
+        if self.max_inflight is not None:
+            self.client.max_inflight_messages_set(self.max_inflight)
         if self.user_name != '':
             self.client.username_pw_set(self.user_name, self.pwd)
         self.client.will_set(f'WILL_{self.client_id}', 'Client Dead')
@@ -84,28 +155,172 @@ class MqttClient:
         for topic in self.sub_cbak_fn:
             Log.logger.info(f'{self.name}: Post Connection Subscribing: {topic}')
             self.client.subscribe(topic)
-            self.client.message_callback_add(topic, self.sub_cbak_fn[topic])
-        while len(self.pub_msg_queue) > 0:
-            pub_msg = self.pub_msg_queue.popleft()
+            self.client.message_callback_add(topic, self.get_sub_cbak(topic, self.sub_cbak_fn[topic]))
+        if not self.spool.is_empty():
+            Log.logger.info(f'{self.name}: Post Connection - draining spool {self.spool.get_stats()}')
+            self.start_spool_drain()
+
+    def configure_dispatcher(self, dispatcher_cfg):
+        '''run subscribe callbacks on priority class workers instead of the network thread, call before sub'''
+        try:
+            if self.dispatcher is not None:
+                self.dispatcher.stop()
+            self.dispatcher = TopicDispatcher(dispatcher_cfg, self.name)
+            self.dispatcher.start()
+            for topic in self.sub_cbak_fn:
+                Log.logger.info(f'{self.name}: dispatch class {self.dispatcher.get_class(topic)} : topic = {topic}')
+        except Exception as ex:
+            self.dispatcher = None
+            Log.logger.critical(f'{self.name}: configure_dispatcher: exception: {ex}')
+
+    def get_sub_cbak(self, topic, call_back_fn):
+        if self.sub_done_fn is not None:
+            call_back_fn = self.wrap_sub_done(call_back_fn)
+        if self.dispatcher is None:
+            return call_back_fn
+        return self.dispatcher.wrap_callback(topic, call_back_fn)
+
+    def wrap_sub_done(self, call_back_fn):
+        def sub_done_cbak(in_client, user_data, message):
+            try:
+                call_back_fn(in_client, user_data, message)
+            finally:
+                self.sub_done_fn()
+        return sub_done_cbak
+
+    def get_dispatcher_stats(self):
+        if self.dispatcher is None:
+            return {}
+        return self.dispatcher.get_stats()
+
+    def configure_publisher(self, publisher_cfg):
+        '''publish on a dedicated connection through an async queue, call after configure_spool and before connect'''
+        try:
+            pub_client = MqttClient(self.broker_ip, self.broker_port, f'{self.client_id}_pub',
+                                    self.user_name, self.pwd, f'{self.name}-pub')
+            '''spooled messages are published by the publisher connection'''
+            pub_client.spool = self.spool
+            pub_client.spool_drain_rate = self.spool_drain_rate
+            self.spool = OutboundSpool()
+            self.publisher = MqttPublisher(pub_client, publisher_cfg)
+            self.publisher.start()
+            pub_client.connect()
+        except Exception as ex:
+            Log.logger.critical(f'{self.name}: configure_publisher: exception: {ex}')
+
+    def get_publisher_stats(self):
+        if self.publisher is None:
+            return {}
+        return self.publisher.get_stats()
+
+    def configure_spool(self, spool_cfg):
+        '''replace default memory spool, call before connect'''
+        try:
+            topic_policies = {}
+            for topic in spool_cfg.get("LATEST_TOPICS", []):
+                topic_policies[topic] = SPOOL_POLICY_LATEST
+            for topic in spool_cfg.get("KEEP_ALL_TOPICS", []):
+                topic_policies[topic] = SPOOL_POLICY_KEEP_ALL
+            new_spool = OutboundSpool(
+                spool_cfg.get("MAX_MESSAGES", DEFAULT_SPOOL_MAX_MESSAGES),
+                topic_policies,
+                spool_cfg.get("DEFAULT_POLICY", SPOOL_POLICY_KEEP_ALL),
+                spool_cfg.get("SPOOL_FILE", ''),
+                spool_cfg.get("SPOOL_FILE_SIZE", DEFAULT_SPOOL_FILE_SIZE))
+            entry = self.spool.peek()
+            while entry is not None:
+                new_spool.put(entry[1], entry[2], entry[3])
+                self.spool.remove(entry)
+                entry = self.spool.peek()
+            self.spool.close()
+            self.spool = new_spool
+            self.spool_drain_rate = spool_cfg.get("DRAIN_RATE", DEFAULT_SPOOL_DRAIN_RATE)
+        except Exception as ex:
+            Log.logger.critical(f'{self.name}: configure_spool: exception: {ex}')
+
+    def start_spool_drain(self):
+        with self.spool_drain_lock:
+            if self.spool_drain_th is None:
+                self.spool_drain_th = threading.Thread(target=self.drain_spool, args=(), daemon=True)
+                self.spool_drain_th.start()
+
+    def drain_spool(self):
+        '''publish spooled messages at spool_drain_rate messages per second, with the QoS they were spooled with'''
+        drained = 0
+        interval = 1.0 / self.spool_drain_rate if self.spool_drain_rate > 0 else 0
+        while True:
+            entry = None
+            if self.is_connected and not self.manual_discon:
+                entry = self.spool.peek()
+            if entry is None:
+                with self.spool_drain_lock:
+                    '''re-check under lock, pub() may have spooled after peek'''
+                    if not self.is_connected or self.manual_discon or self.spool.is_empty():
+                        self.spool_drain_th = None
+                        break
+                continue
             try:
-                self.client.publish(pub_msg[0], pub_msg[1])
-                Log.logger.info(f'{self.name}: Post Connection - Publish : {pub_msg[0]}')
+                if self.drain_publisher is not None:
+                    published = self.drain_publisher.publish_spooled(entry[1], entry[2], entry[3])
+                else:
+                    published = self.client.publish(entry[1], entry[2], entry[3]).rc == mqtt.MQTT_ERR_SUCCESS
+                if not published:
+                    '''connection lost, the entry stays spooled for the next connection'''
+                    with self.spool_drain_lock:
+                        self.spool_drain_th = None
+                    break
+                self.spool.remove(entry)
+                drained += 1
             except:
-                self.pub_msg_queue.appendleft(pub_msg)
                 Log.logger.error(
                     f'{self.name}: *** Post Connection {self.broker_ip}  Pub Failed {sys.exc_info()[0]} ***')
                 traceback.print_exc(file=sys.stdout)
+                with self.spool_drain_lock:
+                    self.spool_drain_th = None
                 break
+            if interval > 0:
+                time.sleep(interval)
+        Log.logger.info(f'{self.name}: spool drain finished, published {drained} messages')
+
+    def stop_spool_drain(self):
+        '''wait for the drain thread, it stops once manual_discon is set'''
+        with self.spool_drain_lock:
+            drain_th = self.spool_drain_th
+        if drain_th is not None and drain_th is not threading.current_thread():
+            drain_th.join(CONNECT_TIMEOUT)
+
+    def flush_spool(self, timeout=SPOOL_FLUSH_TIMEOUT):
+        '''publish spooled messages before disconnect, an entry is removed once paho reports it published'''
+        deadline = time.time() + timeout
+        flushed = 0
+        entry = self.spool.peek()
+        while entry is not None and time.time() < deadline:
+            try:
+                msg_info = self.client.publish(entry[1], entry[2], entry[3])
+                if msg_info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    break
+                msg_info.wait_for_publish(max(0.0, deadline - time.time()))
+                if not msg_info.is_published():
+                    break
+            except:
+                Log.logger.error(f'{self.name}: spool flush failed : topic = {entry[1]} {sys.exc_info()[0]}')
+                break
+            self.spool.remove(entry)
+            flushed += 1
+            entry = self.spool.peek()
+        self.spool.sync()
+        Log.logger.info(f'{self.name}: spool flushed {flushed} messages, kept {len(self.spool)} messages')
 
     def start_reconnect_th(self):
         self.thread_started = True
         self.thread_quit = False
+        self.quit_event.clear()
         Log.logger.warning(f'{self.name}: *** Starting reconnect Thread Broker: {self.broker_ip}  ***')
         self.client.loop_stop()
         if self.is_connected:
             self.client.disconnect()
             time.sleep(5)
-            self.is_connected = False
+            self.set_con_state(MQTT_STATE_DISCONNECTED)
         self.th = threading.Thread(target=self.reconnect, args=())
         self.th.start()
 
@@ -115,19 +330,33 @@ class MqttClient:
             self.setup_pre_con_params()
         except:
             Log.logger.critical(f'{self.name}: ***** Unable to reinitialize  MQTT broker : {self.broker_ip}  *****')
+        attempt = 0
         while not self.is_connected and not self.thread_quit:
-            time.sleep(10)
+            '''quit_event is set by disconnect, wait returns early in that case'''
+            if self.quit_event.wait(self.get_reconnect_delay(attempt)):
+                break
+            attempt += 1
             try:
                 Log.logger.warning(f'{self.name}: ***** Trying to RECONNECT to  MQTT broker : {self.broker_ip}  *****')
+                self.reconnect_attempts += 1
+                self.set_con_state(MQTT_STATE_CONNECTING)
+                ts_start = time.time()
                 self.client.connect(self.broker_ip, self.broker_port, 60)
                 self.client.loop_start()
-                while not self.is_connected and not self.con_error and not self.thread_quit:
-                    pass
-                if self.is_connected:
-                    Log.logger.warning(f'{self.name}: ***** RECONNECT MQTT broker : {self.broker_ip}  Success *****')
+                if self.wait_con_result():
+                    self.connect_count += 1
+                    self.last_connect_duration = time.time() - ts_start
+                    self.last_reconnect_duration = time.time() - self.discon_ts
+                    if self.last_reconnect_duration > self.max_reconnect_duration:
+                        self.max_reconnect_duration = self.last_reconnect_duration
+                    Log.logger.warning(f'{self.name}: ***** RECONNECT MQTT broker : {self.broker_ip}  Success '
+                                       f'after {attempt} attempts, outage {self.last_reconnect_duration:.3f}s *****')
                     self.setup_post_con_params()
                     self.thread_started = False
+                else:
+                    self.client.loop_stop()
             except:
+                self.set_con_state(MQTT_STATE_CON_ERROR)
                 Log.logger.error(f'{self.name}: ***** Unable to RECONNECT to  MQTT broker : {self.broker_ip} '
                                  f'{sys.exc_info()[0]} *****')
         Log.logger.info(
@@ -136,22 +365,35 @@ class MqttClient:
     def disconnect(self):
         Log.logger.info(f'{self.name}: In disconnect fn loop stop')
         self.manual_discon = True
+        self.stop_spool_drain()
+        if self.is_connected:
+            self.flush_spool()
         self.client.loop_stop()
         if self.is_connected:
             Log.logger.info(f'{self.name}: In disconnect fn calling disconnect')
             self.client.disconnect()
             Log.logger.info(f'{self.name}: In disconnect fn After disconnect')
             time.sleep(5)
-            self.is_connected = False
+            self.set_con_state(MQTT_STATE_DISCONNECTED)
             Log.logger.info(f'{self.name}: Disconnected  MQTT broker : {self.broker_ip} client_id: {self.client_id}')
         else:
             if self.thread_started:
                 # exit the thread
                 self.thread_quit = True
+                self.quit_event.set()
+                with self.con_cond:
+                    self.con_cond.notify_all()
             Log.logger.info(
                 f'{self.name}: Already Disconnected  MQTT broker : {self.broker_ip} client_id: {self.client_id}')
         self.sub_cbak_fn = {}
-        self.pub_msg_queue = deque()
+        '''messages not published stay in the spool, a spool file keeps them for the next start'''
+        self.spool.sync()
+        if self.publisher is not None:
+            self.publisher.stop()
+            self.publisher.join(CONNECT_TIMEOUT)
+            self.publisher.spool_queued()
+            self.publisher.pub_client.disconnect()
+            self.publisher = None
 
     def on_con(self, client, user_data, flags, rc):
         if rc == 0:
@@ -170,16 +412,17 @@ class MqttClient:
             errtext = "Connection refused: Unknown reason"
         if rc == 0:
             Log.logger.info(f'{self.name}: Broker: {self.broker_ip} Connect Result: {errtext}')
-            self.is_connected = True
-            self.con_error = False
+            self.set_con_state(MQTT_STATE_CONNECTED)
         else:
             Log.logger.error(f'{self.name}: Broker: {self.broker_ip} Connect Result: {errtext}')
-            self.is_connected = False
-            self.con_error = True
+            self.set_con_state(MQTT_STATE_CON_ERROR)
 
     def on_discon(self, client, user_data, rc):
+        if self.on_discon_fn is not None:
+            self.on_discon_fn()
         if not self.manual_discon:
-            self.is_connected = False
+            self.discon_ts = time.time()
+            self.set_con_state(MQTT_STATE_DISCONNECTED)
             Log.logger.critical(
                 f'{self.name}: ***** Unexpectedly DISCONNECTED - MQTT broker : {self.broker_ip} Retrying *****')
             if not self.thread_started:
@@ -193,24 +436,37 @@ class MqttClient:
         Log.logger.info(f'\n{self.name}: topic: {message.topic} \nmessage: {message.payload}\nQoS: {message.qos}'
                         f'\nUser data : {user_data}')
 
-    def pub(self, topic, msg):
-        self.pub_msg_queue.append((topic, msg))
+    def on_pub(self, client, user_data, mid):
+        if self.on_pub_ack is not None:
+            self.on_pub_ack(mid)
+
+    def pub(self, topic, msg, qos=0):
+        if self.publisher is not None:
+            self.publisher.pub(topic, msg)
+            return
         if self.is_connected:
-            while len(self.pub_msg_queue) > 0:
-                pub_msg = self.pub_msg_queue.popleft()
+            '''publish directly unless older messages of the same order are still spooled'''
+            direct = self.spool.is_empty() or self.spool.get_policy(topic) == SPOOL_POLICY_LATEST
+            if direct:
                 try:
-                    self.client.publish(pub_msg[0], pub_msg[1])
-                    Log.logger.info(f'Publish : {pub_msg[0]}')
+                    self.client.publish(topic, msg, qos)
+                    self.spool.discard_latest(topic)
+                    Log.logger.debug(f'Publish : {topic}')
+                    return
                 except:
-                    self.pub_msg_queue.appendleft(pub_msg)
-                    break
-        else:
-            Log.logger.warning(f'{self.name}: Broker not connected - Queuing Publish : topic = {topic} Message = {msg}')
+                    Log.logger.error(f'{self.name}: Publish failed : topic = {topic} {sys.exc_info()[0]}')
+
+        was_empty = self.spool.is_empty()
+        self.spool.put(topic, msg, qos)
+        if self.is_connected:
+            self.start_spool_drain()
+        elif was_empty:
+            Log.logger.warning(f'{self.name}: Broker not connected - spooling publish, first topic = {topic}')
 
     def sub(self, topic, call_back_fn):
         if self.is_connected:
             self.client.subscribe(topic)
-            self.client.message_callback_add(topic, call_back_fn)
+            self.client.message_callback_add(topic, self.get_sub_cbak(topic, call_back_fn))
             Log.logger.info(f'{self.name}: Subscribe : topic = {topic} Success')
         else:
             Log.logger.info(f'{self.name}: Broker not connected - Unable to Subscribe : topic = {topic}')
@@ -0,0 +1,235 @@
+'''
+*****************************************************************************
+*File : mqtt_dispatcher.py
+*Module : common
+*Purpose : Priority topic dispatcher, runs subscribe callbacks on per class worker threads
+*Author : Dhanaseelan Thangavel
+*Copyright : Copyright 2020, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import threading
+import time
+import zlib
+from collections import deque
+
+from scc_log import Log
+
+'''priority classes, highest first'''
+PRIORITY_CRITICAL = "critical"
+PRIORITY_ALERT = "alert"
+PRIORITY_TELEMETRY = "telemetry"
+PRIORITY_CLASS_LIST = [PRIORITY_CRITICAL, PRIORITY_ALERT, PRIORITY_TELEMETRY]
+
+DEFAULT_CLASS_WORKERS = 1
+'''max queued messages per class worker, 0 = unbounded (never drop)'''
+DEFAULT_CLASS_MAX_QUEUE = {PRIORITY_CRITICAL: 0, PRIORITY_ALERT: 0, PRIORITY_TELEMETRY: 1000}
+'''lower class workers wait at most this long for higher class work to finish'''
+DEFAULT_PREEMPT_MAX_WAIT = 0.1
+STATS_LOG_INTERVAL = 60
+
+
+class DispatchWorker(threading.Thread):
+    '''one worker thread of a priority class with its own FIFO'''
+
+    def __init__(self, dispatcher, class_idx, max_queue, name):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.dispatcher = dispatcher
+        self.class_idx = class_idx
+        self.max_queue = max_queue
+        self.msg_queue = deque()
+        self.cond = threading.Condition()
+        self.thread_quit = False
+
+    def put(self, item):
+        '''returns number of dropped messages (0 or 1)'''
+        dropped = 0
+        with self.cond:
+            if self.max_queue > 0 and len(self.msg_queue) >= self.max_queue:
+                self.msg_queue.popleft()
+                dropped = 1
+            self.msg_queue.append(item)
+            self.cond.notify()
+        return dropped
+
+    def depth(self):
+        with self.cond:
+            return len(self.msg_queue)
+
+    def run(self):
+        while not self.thread_quit:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.msg_queue) > 0 or self.thread_quit, 1.0)
+                if self.thread_quit or len(self.msg_queue) == 0:
+                    continue
+                item = self.msg_queue.popleft()
+            self.dispatcher.run_item(self.class_idx, item)
+
+    def stop(self):
+        with self.cond:
+            self.thread_quit = True
+            self.cond.notify_all()
+
+
+class ClassStats:
+    '''handler latency of one priority class, wait = time in queue, exec = handler run time'''
+
+    def __init__(self):
+        self.dispatched_count = 0
+        self.handled_count = 0
+        self.dropped_count = 0
+        self.error_count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_exec = 0.0
+        self.max_exec = 0.0
+
+    def to_dict(self):
+        handled = self.handled_count if self.handled_count > 0 else 1
+        return {"dispatched": self.dispatched_count,
+                "handled": self.handled_count,
+                "dropped": self.dropped_count,
+                "errors": self.error_count,
+                "avg_wait": self.total_wait / handled,
+                "max_wait": self.max_wait,
+                "avg_exec": self.total_exec / handled,
+                "max_exec": self.max_exec}
+
+
+class TopicDispatcher:
+    '''Map subscribed topics to priority classes, each class runs callbacks on dedicated workers.
+
+    Messages of one topic always go to the same worker of its class, so per topic order is kept.
+    Python threads cannot be preempted, so a worker waits before starting a handler while any
+    higher class has queued or running work (at most preempt_max_wait), which lets critical
+    commands and alerts run ahead of a telemetry burst.
+
+    dispatcher_cfg:
+        {"DEFAULT_CLASS": "telemetry",
+         "PREEMPT_MAX_WAIT": 0.1,
+         "CLASSES": {"telemetry": {"WORKERS": 1, "MAX_QUEUE": 1000}, ...},
+         "TOPICS": {"cwsm/section_reset": "critical", ...}}
+    '''
+
+    def __init__(self, dispatcher_cfg=None, name='MQTT'):
+        if dispatcher_cfg is None:
+            dispatcher_cfg = {}
+        self.name = name
+        self.topic_classes = {}
+        for topic, class_name in dispatcher_cfg.get("TOPICS", {}).items():
+            if class_name in PRIORITY_CLASS_LIST:
+                self.topic_classes[topic] = PRIORITY_CLASS_LIST.index(class_name)
+            else:
+                Log.logger.warning(f'{self.name}: dispatcher: unknown class {class_name} for topic {topic}')
+
+        default_class = dispatcher_cfg.get("DEFAULT_CLASS", PRIORITY_TELEMETRY)
+        if default_class not in PRIORITY_CLASS_LIST:
+            Log.logger.warning(f'{self.name}: dispatcher: unknown default class {default_class}, '
+                               f'using {PRIORITY_TELEMETRY}')
+            default_class = PRIORITY_TELEMETRY
+        self.default_class_idx = PRIORITY_CLASS_LIST.index(default_class)
+        self.preempt_max_wait = dispatcher_cfg.get("PREEMPT_MAX_WAIT", DEFAULT_PREEMPT_MAX_WAIT)
+
+        '''pending = queued + running messages per class'''
+        self.cond = threading.Condition()
+        self.pending = [0] * len(PRIORITY_CLASS_LIST)
+        self.class_stats = [ClassStats() for class_name in PRIORITY_CLASS_LIST]
+        self.last_stats_ts = time.time()
+
+        self.workers = []
+        classes_cfg = dispatcher_cfg.get("CLASSES", {})
+        for class_name in PRIORITY_CLASS_LIST:
+            class_cfg = classes_cfg.get(class_name, {})
+            worker_count = max(1, class_cfg.get("WORKERS", DEFAULT_CLASS_WORKERS))
+            max_queue = class_cfg.get("MAX_QUEUE", DEFAULT_CLASS_MAX_QUEUE[class_name])
+            class_idx = PRIORITY_CLASS_LIST.index(class_name)
+            self.workers.append([DispatchWorker(self, class_idx, max_queue, f'{name}-{class_name}-{idx}')
+                                 for idx in range(worker_count)])
+
+    def start(self):
+        for class_workers in self.workers:
+            for worker in class_workers:
+                if not worker.is_alive():
+                    worker.start()
+
+    def stop(self):
+        for class_workers in self.workers:
+            for worker in class_workers:
+                worker.stop()
+        with self.cond:
+            self.cond.notify_all()
+
+    def get_class(self, topic):
+        return PRIORITY_CLASS_LIST[self.topic_classes.get(topic, self.default_class_idx)]
+
+    def wrap_callback(self, topic, call_back_fn):
+        '''paho callback which hands the message to the worker of the topic class'''
+        def dispatch_cbak(in_client, user_data, message):
+            self.dispatch(topic, call_back_fn, in_client, user_data, message)
+        return dispatch_cbak
+
+    def dispatch(self, topic, call_back_fn, in_client, user_data, message):
+        '''called on the paho network thread, only enqueues'''
+        class_idx = self.topic_classes.get(topic, self.default_class_idx)
+        class_workers = self.workers[class_idx]
+        worker = class_workers[zlib.crc32(topic.encode()) % len(class_workers)]
+        with self.cond:
+            self.pending[class_idx] += 1
+            self.class_stats[class_idx].dispatched_count += 1
+        if worker.put((time.time(), call_back_fn, in_client, user_data, message)) > 0:
+            with self.cond:
+                self.pending[class_idx] -= 1
+                self.class_stats[class_idx].dropped_count += 1
+
+    def higher_class_busy(self, class_idx):
+        for idx in range(class_idx):
+            if self.pending[idx] > 0:
+                return True
+        return False
+
+    def run_item(self, class_idx, item):
+        recv_ts, call_back_fn, in_client, user_data, message = item
+        if class_idx > 0:
+            with self.cond:
+                self.cond.wait_for(lambda: not self.higher_class_busy(class_idx), self.preempt_max_wait)
+
+        ts_start = time.time()
+        error = False
+        try:
+            call_back_fn(in_client, user_data, message)
+        except Exception as ex:
+            error = True
+            Log.logger.critical(f'{self.name}: dispatcher: {message.topic} handler exception: {ex}')
+        ts_end = time.time()
+
+        with self.cond:
+            self.pending[class_idx] -= 1
+            stats = self.class_stats[class_idx]
+            stats.handled_count += 1
+            if error:
+                stats.error_count += 1
+            wait = ts_start - recv_ts
+            stats.total_wait += wait
+            if wait > stats.max_wait:
+                stats.max_wait = wait
+            exec_ts = ts_end - ts_start
+            stats.total_exec += exec_ts
+            if exec_ts > stats.max_exec:
+                stats.max_exec = exec_ts
+            self.cond.notify_all()
+
+            log_stats = ts_end - self.last_stats_ts >= STATS_LOG_INTERVAL
+            if log_stats:
+                self.last_stats_ts = ts_end
+        if log_stats:
+            Log.logger.info(f'{self.name}: dispatcher stats: {self.get_stats()}')
+
+    def get_stats(self):
+        stats = {}
+        with self.cond:
+            for class_idx, class_name in enumerate(PRIORITY_CLASS_LIST):
+                stats[class_name] = self.class_stats[class_idx].to_dict()
+                stats[class_name]["pending"] = self.pending[class_idx]
+        for class_idx, class_name in enumerate(PRIORITY_CLASS_LIST):
+            stats[class_name]["depth"] = sum(worker.depth() for worker in self.workers[class_idx])
+        return stats
@@ -0,0 +1,235 @@
+'''
+*****************************************************************************
+*File : mqtt_publisher.py
+*Module : common
+*Purpose : Asynchronous publisher on a dedicated MQTT connection with in-flight window
+*Author : Dhanaseelan Thangavel
+*Copyright : Copyright 2020, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import sys
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+from scc_log import Log
+
+DEFAULT_PUB_QUEUE_SIZE = 1000
+DEFAULT_PUB_QOS = 0
+DEFAULT_MAX_INFLIGHT = 20
+'''in-flight messages not acked within this time are given up (counted as unacked)'''
+DEFAULT_ACK_TIMEOUT = 30
+STATS_LOG_INTERVAL = 60
+
+
+class MqttPublisher(threading.Thread):
+    '''Publish queue drained by one thread on its own MqttClient connection.
+
+    pub() only enqueues, so callers and the subscriber network thread never block on outbound
+    traffic. QoS>0 publishes are limited to max_inflight outstanding messages, ack latency is
+    publish() to PUBACK/PUBCOMP; for QoS 0 it is publish() to socket write. Messages spooled
+    while the broker was down keep their QoS and are drained through the same window.
+
+    publisher_cfg:
+        {"QUEUE_SIZE": 1000, "QOS": 0, "TOPIC_QOS": {"scc/trail_through": 1},
+         "MAX_INFLIGHT": 20, "ACK_TIMEOUT": 30}
+    '''
+
+    def __init__(self, pub_client, publisher_cfg=None):
+        threading.Thread.__init__(self, name=f'{pub_client.name}-publisher', daemon=True)
+        if publisher_cfg is None:
+            publisher_cfg = {}
+        self.pub_client = pub_client
+        self.queue_size = publisher_cfg.get("QUEUE_SIZE", DEFAULT_PUB_QUEUE_SIZE)
+        self.default_qos = publisher_cfg.get("QOS", DEFAULT_PUB_QOS)
+        self.topic_qos = publisher_cfg.get("TOPIC_QOS", {})
+        self.max_inflight = max(1, publisher_cfg.get("MAX_INFLIGHT", DEFAULT_MAX_INFLIGHT))
+        self.ack_timeout = publisher_cfg.get("ACK_TIMEOUT", DEFAULT_ACK_TIMEOUT)
+
+        self.cond = threading.Condition()
+        self.pub_queue = deque()
+        '''mid -> (publish ts, qos) of publishes waiting for on_publish'''
+        self.inflight = {}
+        '''on_publish may run before publish() returns the mid'''
+        self.early_acks = {}
+        self.thread_quit = False
+
+        self.pub_client.max_inflight = self.max_inflight
+        self.pub_client.on_pub_ack = self.on_pub_ack
+        self.pub_client.on_discon_fn = self.on_discon
+        self.pub_client.drain_publisher = self
+
+        '''counters'''
+        self.queued_count = 0
+        self.published_count = 0
+        self.acked_count = 0
+        self.unacked_count = 0
+        self.dropped_count = 0
+        self.spooled_count = 0
+        self.window_full_count = 0
+        self.max_queue_depth = 0
+        self.total_ack_latency = 0.0
+        self.max_ack_latency = 0.0
+        self.last_stats_ts = time.time()
+
+    def get_qos(self, topic):
+        return self.topic_qos.get(topic, self.default_qos)
+
+    def pub(self, topic, msg):
+        '''enqueue publish, oldest queued message is dropped when queue is full'''
+        with self.cond:
+            if len(self.pub_queue) >= self.queue_size:
+                dropped_topic, dropped_msg = self.pub_queue.popleft()
+                self.dropped_count += 1
+                if self.dropped_count == 1 or self.dropped_count % 100 == 0:
+                    Log.logger.warning(f'{self.name}: publish queue full, dropped {self.dropped_count} messages '
+                                       f'(last topic = {dropped_topic})')
+            self.pub_queue.append((topic, msg))
+            self.queued_count += 1
+            if len(self.pub_queue) > self.max_queue_depth:
+                self.max_queue_depth = len(self.pub_queue)
+            self.cond.notify_all()
+
+    def inflight_qos_count(self):
+        count = 0
+        for pub_ts, qos in self.inflight.values():
+            if qos > 0:
+                count += 1
+        return count
+
+    def expire_inflight(self, now):
+        for mid in [mid for mid, (pub_ts, qos) in self.inflight.items() if now - pub_ts > self.ack_timeout]:
+            del self.inflight[mid]
+            self.unacked_count += 1
+        '''acks never claimed by a publish'''
+        for mid in [mid for mid, ack_ts in self.early_acks.items() if now - ack_ts > self.ack_timeout]:
+            del self.early_acks[mid]
+
+    def run(self):
+        Log.logger.info(f'{self.name}: publisher started')
+        while not self.thread_quit:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.pub_queue) > 0 or self.thread_quit, 1.0)
+                if self.thread_quit:
+                    break
+                self.expire_inflight(time.time())
+                if len(self.pub_queue) == 0:
+                    continue
+                topic, msg = self.pub_queue[0]
+                qos = self.get_qos(topic)
+                if qos > 0 and self.pub_client.is_connected and self.inflight_qos_count() >= self.max_inflight:
+                    '''window full, wait for an ack (or disconnect) and try again'''
+                    self.window_full_count += 1
+                    self.cond.wait(0.1)
+                    continue
+                self.pub_queue.popleft()
+
+            self.publish(topic, msg, qos)
+
+            if time.time() - self.last_stats_ts >= STATS_LOG_INTERVAL:
+                self.last_stats_ts = time.time()
+                Log.logger.info(f'{self.name}: {self.get_stats()}')
+        Log.logger.info(f'{self.name}: publisher stopped')
+
+    def publish(self, topic, msg, qos):
+        if not self.pub_client.is_connected or not self.pub_client.spool.is_empty():
+            '''broker down or older messages still spooled, keep order through the spool'''
+            self.pub_client.pub(topic, msg, qos)
+            self.spooled_count += 1
+            return
+        try:
+            pub_ts = time.time()
+            msg_info = self.pub_client.client.publish(topic, msg, qos)
+            if msg_info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.pub_client.pub(topic, msg, qos)
+                self.spooled_count += 1
+                return
+            self.track_publish(msg_info, pub_ts, qos)
+        except:
+            Log.logger.error(f'{self.name}: Publish failed : topic = {topic} {sys.exc_info()[0]}')
+            self.pub_client.pub(topic, msg, qos)
+            self.spooled_count += 1
+
+    def publish_spooled(self, topic, msg, qos):
+        '''spool drain publish of pub_client, waits for room in the window, False when not published'''
+        with self.cond:
+            while qos > 0 and self.inflight_qos_count() >= self.max_inflight:
+                if self.thread_quit or not self.pub_client.is_connected:
+                    return False
+                self.window_full_count += 1
+                self.expire_inflight(time.time())
+                self.cond.wait(0.1)
+        pub_ts = time.time()
+        msg_info = self.pub_client.client.publish(topic, msg, qos)
+        if msg_info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        self.track_publish(msg_info, pub_ts, qos)
+        return True
+
+    def track_publish(self, msg_info, pub_ts, qos):
+        '''published message waits in the window for its ack'''
+        with self.cond:
+            self.published_count += 1
+            ack_ts = self.early_acks.pop(msg_info.mid, None)
+            if ack_ts is not None:
+                self.record_ack(ack_ts - pub_ts)
+            else:
+                self.inflight[msg_info.mid] = (pub_ts, qos)
+
+    def record_ack(self, latency):
+        self.acked_count += 1
+        self.total_ack_latency += latency
+        if latency > self.max_ack_latency:
+            self.max_ack_latency = latency
+
+    def on_pub_ack(self, mid):
+        '''called by MqttClient.on_pub on the network thread'''
+        ack_ts = time.time()
+        with self.cond:
+            inflight = self.inflight.pop(mid, None)
+            if inflight is None:
+                self.early_acks[mid] = ack_ts
+            else:
+                self.record_ack(ack_ts - inflight[0])
+            self.cond.notify_all()
+
+    def on_discon(self):
+        '''clean session, outstanding publishes will never be acked'''
+        with self.cond:
+            self.unacked_count += len(self.inflight)
+            self.inflight.clear()
+            self.early_acks.clear()
+            self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.thread_quit = True
+            self.cond.notify_all()
+
+    def spool_queued(self):
+        '''move messages still queued to the spool of pub_client, called once the thread stopped'''
+        with self.cond:
+            queued = list(self.pub_queue)
+            self.pub_queue.clear()
+        for topic, msg in queued:
+            self.pub_client.spool.put(topic, msg, self.get_qos(topic))
+        self.spooled_count += len(queued)
+
+    def get_stats(self):
+        with self.cond:
+            acked = self.acked_count if self.acked_count > 0 else 1
+            return {"depth": len(self.pub_queue),
+                    "max_depth": self.max_queue_depth,
+                    "queued": self.queued_count,
+                    "published": self.published_count,
+                    "spooled": self.spooled_count,
+                    "dropped": self.dropped_count,
+                    "inflight": len(self.inflight),
+                    "window_full": self.window_full_count,
+                    "acked": self.acked_count,
+                    "unacked": self.unacked_count,
+                    "avg_ack_latency": self.total_ack_latency / acked,
+                    "max_ack_latency": self.max_ack_latency}
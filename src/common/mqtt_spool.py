@@ -0,0 +1,271 @@
+'''
+*****************************************************************************
+*File : mqtt_spool.py
+*Module : common
+*Purpose : Bounded outbound spool for MQTT publish while broker is down
+*Author : Dhanaseelan Thangavel
+*Copyright : Copyright 2020, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import os
+import mmap
+import struct
+import threading
+import zlib
+from collections import deque, OrderedDict
+
+from scc_log import Log
+
+SPOOL_POLICY_LATEST = "latest"
+SPOOL_POLICY_KEEP_ALL = "keep_all"
+
+DEFAULT_SPOOL_MAX_MESSAGES = 1000
+DEFAULT_SPOOL_FILE_SIZE = 1024 * 1024
+
+'''spool file layout: header (magic, read offset, write offset) followed by records'''
+SPOOL_FILE_MAGIC = b'SCCSPL02'
+SPOOL_FILE_HEADER = struct.Struct('<8sQQ')
+'''record: data length, crc32 of data, topic length, qos; data = topic + message'''
+SPOOL_RECORD_HEADER = struct.Struct('<IIHB')
+
+
+class SpoolFile:
+    '''Append-only memory mapped record file, records are consumed from the head'''
+
+    def __init__(self, file_name, file_size=DEFAULT_SPOOL_FILE_SIZE):
+        self.file_name = file_name
+        dir_name = os.path.dirname(file_name)
+        if dir_name != '':
+            os.makedirs(dir_name, exist_ok=True)
+
+        self.fd = open(file_name, 'a+b')
+        if os.path.getsize(file_name) < file_size:
+            self.fd.truncate(file_size)
+        self.mm = mmap.mmap(self.fd.fileno(), 0)
+        self.file_size = len(self.mm)
+
+        magic, self.read_offset, self.write_offset = SPOOL_FILE_HEADER.unpack_from(self.mm, 0)
+        if magic != SPOOL_FILE_MAGIC or \
+                not (SPOOL_FILE_HEADER.size <= self.read_offset <= self.write_offset <= self.file_size):
+            Log.logger.warning(f'spool file {file_name}: no valid header, starting empty')
+            self.reset()
+
+    def write_header(self):
+        SPOOL_FILE_HEADER.pack_into(self.mm, 0, SPOOL_FILE_MAGIC, self.read_offset, self.write_offset)
+
+    def reset(self):
+        self.read_offset = SPOOL_FILE_HEADER.size
+        self.write_offset = SPOOL_FILE_HEADER.size
+        self.write_header()
+        self.mm.flush()
+
+    def load(self):
+        '''return [(topic, msg, qos, record length)] of pending records, stop at first corrupt record'''
+        records = []
+        offset = self.read_offset
+        while offset + SPOOL_RECORD_HEADER.size <= self.write_offset:
+            data_len, crc, topic_len, qos = SPOOL_RECORD_HEADER.unpack_from(self.mm, offset)
+            data_start = offset + SPOOL_RECORD_HEADER.size
+            data_end = data_start + data_len
+            if data_end > self.write_offset or topic_len > data_len:
+                break
+            data = self.mm[data_start:data_end]
+            if zlib.crc32(data) != crc:
+                break
+            records.append((data[:topic_len].decode(), data[topic_len:], qos, data_end - offset))
+            offset = data_end
+
+        if offset != self.write_offset:
+            Log.logger.warning(
+                f'spool file {self.file_name}: corrupt record at {offset}, {self.write_offset - offset} bytes discarded')
+            self.write_offset = offset
+            self.write_header()
+        return records
+
+    def free_space(self):
+        return self.file_size - self.write_offset
+
+    def compact(self):
+        '''move pending records to the start of the file'''
+        pending = self.write_offset - self.read_offset
+        if self.read_offset > SPOOL_FILE_HEADER.size:
+            if pending > 0:
+                self.mm.move(SPOOL_FILE_HEADER.size, self.read_offset, pending)
+            self.read_offset = SPOOL_FILE_HEADER.size
+            self.write_offset = SPOOL_FILE_HEADER.size + pending
+            self.write_header()
+
+    def append(self, topic, msg, qos=0):
+        '''append one record, returns record length or 0 if it does not fit'''
+        topic_bytes = topic.encode()
+        msg_bytes = msg.encode() if isinstance(msg, str) else bytes(msg)
+        data = topic_bytes + msg_bytes
+        record_len = SPOOL_RECORD_HEADER.size + len(data)
+
+        if record_len > self.free_space():
+            self.compact()
+            if record_len > self.free_space():
+                return 0
+
+        SPOOL_RECORD_HEADER.pack_into(self.mm, self.write_offset, len(data), zlib.crc32(data), len(topic_bytes), qos)
+        start = self.write_offset + SPOOL_RECORD_HEADER.size
+        self.mm[start:start + len(data)] = data
+        self.write_offset += record_len
+        self.write_header()
+        self.mm.flush()
+        return record_len
+
+    def consume(self, record_len):
+        '''drop record_len bytes from the head'''
+        self.read_offset += record_len
+        if self.read_offset >= self.write_offset:
+            self.read_offset = SPOOL_FILE_HEADER.size
+            self.write_offset = SPOOL_FILE_HEADER.size
+        self.write_header()
+
+    def sync(self):
+        self.mm.flush()
+
+    def close(self):
+        try:
+            self.mm.flush()
+            self.mm.close()
+            self.fd.close()
+        except Exception as ex:
+            Log.logger.error(f'spool file {self.file_name}: close exception: {ex}')
+
+
+class OutboundSpool:
+    '''Bounded outbound spool with per topic policy.
+
+    latest   : state topics, only the latest message per topic is kept (memory only)
+    keep_all : event topics, every message is kept in order, optionally persisted in a SpoolFile
+    The QoS of the publish is kept with every message and used when the spool is drained.
+    '''
+
+    def __init__(self, max_messages=DEFAULT_SPOOL_MAX_MESSAGES, topic_policies=None,
+                 default_policy=SPOOL_POLICY_KEEP_ALL, spool_file_name='', spool_file_size=DEFAULT_SPOOL_FILE_SIZE):
+        self.lock = threading.Lock()
+        self.max_messages = max_messages
+        self.topic_policies = topic_policies if topic_policies is not None else {}
+        self.default_policy = default_policy
+        self.latest_msgs = OrderedDict()
+        self.events = deque()
+        self.spool_file = None
+
+        '''counters'''
+        self.spooled_count = 0
+        self.coalesced_count = 0
+        self.dropped_count = 0
+
+        if spool_file_name:
+            try:
+                self.spool_file = SpoolFile(spool_file_name, spool_file_size)
+                for topic, msg, qos, record_len in self.spool_file.load():
+                    self.events.append((topic, msg, qos, record_len))
+                if len(self.events) > 0:
+                    Log.logger.warning(f'spool file {spool_file_name}: restored {len(self.events)} messages')
+            except Exception as ex:
+                Log.logger.critical(f'spool file {spool_file_name}: exception: {ex}, using memory spool')
+                self.spool_file = None
+
+    def get_policy(self, topic):
+        return self.topic_policies.get(topic, self.default_policy)
+
+    def is_empty(self):
+        with self.lock:
+            return len(self.events) == 0 and len(self.latest_msgs) == 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.events) + len(self.latest_msgs)
+
+    def drop_oldest_event(self):
+        topic, msg, qos, record_len = self.events.popleft()
+        if self.spool_file is not None and record_len > 0:
+            self.spool_file.consume(record_len)
+        self.dropped_count += 1
+
+    def put(self, topic, msg, qos=0):
+        with self.lock:
+            self.spooled_count += 1
+            if self.get_policy(topic) == SPOOL_POLICY_LATEST:
+                if topic in self.latest_msgs:
+                    self.coalesced_count += 1
+                self.latest_msgs[topic] = (msg, qos)
+                return True
+
+            while len(self.events) >= self.max_messages:
+                self.drop_oldest_event()
+
+            record_len = 0
+            if self.spool_file is not None:
+                record_len = self.spool_file.append(topic, msg, qos)
+                while record_len == 0 and len(self.events) > 0:
+                    self.drop_oldest_event()
+                    record_len = self.spool_file.append(topic, msg, qos)
+                if record_len == 0:
+                    self.dropped_count += 1
+                    Log.logger.error(f'spool: message on {topic} larger than spool file, dropped')
+                    return False
+            self.events.append((topic, msg, qos, record_len))
+            return True
+
+    def peek(self):
+        '''oldest entry (policy, topic, msg, qos), events first then latest state per topic'''
+        with self.lock:
+            if len(self.events) > 0:
+                topic, msg, qos, record_len = self.events[0]
+                return (SPOOL_POLICY_KEEP_ALL, topic, msg, qos)
+            if len(self.latest_msgs) > 0:
+                topic = next(iter(self.latest_msgs))
+                msg, qos = self.latest_msgs[topic]
+                return (SPOOL_POLICY_LATEST, topic, msg, qos)
+            return None
+
+    def remove(self, entry):
+        '''remove entry returned by peek once it is published'''
+        policy, topic, msg, qos = entry
+        with self.lock:
+            if policy == SPOOL_POLICY_KEEP_ALL:
+                if len(self.events) > 0 and self.events[0][0] == topic and self.events[0][1] is msg:
+                    topic, msg, qos, record_len = self.events.popleft()
+                    if self.spool_file is not None and record_len > 0:
+                        self.spool_file.consume(record_len)
+            elif topic in self.latest_msgs and self.latest_msgs[topic][0] is msg:
+                del self.latest_msgs[topic]
+
+    def discard_latest(self, topic):
+        '''a newer state was published directly, spooled state is stale'''
+        with self.lock:
+            self.latest_msgs.pop(topic, None)
+
+    def clear(self):
+        with self.lock:
+            self.latest_msgs.clear()
+            self.events.clear()
+            if self.spool_file is not None:
+                self.spool_file.reset()
+
+    def sync(self):
+        '''write the spool file to disk'''
+        with self.lock:
+            try:
+                if self.spool_file is not None:
+                    self.spool_file.sync()
+            except Exception as ex:
+                Log.logger.error(f'spool file {self.spool_file.file_name}: sync exception: {ex}')
+
+    def close(self):
+        if self.spool_file is not None:
+            self.spool_file.close()
+
+    def get_stats(self):
+        with self.lock:
+            return {"events": len(self.events),
+                    "latest": len(self.latest_msgs),
+                    "spooled": self.spooled_count,
+                    "coalesced": self.coalesced_count,
+                    "dropped": self.dropped_count,
+                    "persistent": self.spool_file is not None}
@@ -0,0 +1,312 @@
+'''
+*****************************************************************************
+*File : scc_codec.py
+*Module : common
+*Purpose : Pluggable wire codecs (JSON and compact binary) selected per topic
+*Author : Dhanaseelan Thangavel
+*Copyright : Copyright 2020, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import sys
+import json
+import struct
+import time
+
+from scc_log import Log
+
+CODEC_JSON = "json"
+CODEC_BINARY = "binary"
+
+'''binary messages start with BINARY_MAGIC, anything else is decoded as JSON'''
+BINARY_MAGIC = 0xB5
+MSG_TYPE_SECTION_INFO = 1
+MSG_TYPE_POINT_INFO = 2
+FLAG_SECTION_ID_INDEX = 0x01
+SECTION_ID_INLINE = 0xFFFF
+
+SECTION_STATUS_ENUM = ["none", "cleared", "occupied"]
+DIRECTION_ENUM = ["none", "in", "out"]
+TORPEDO_STATUS_ENUM = ["none", "loaded", "unloaded"]
+FIRST_AXLE_ENUM = ["none", "torpedo", "engine"]
+POINT_STATUS_ENUM = ["none", "normal", "reverse", "fault"]
+POINT_MODE_ENUM = ["none", "auto", "manual"]
+
+SECTION_MSG_KEYS = {"ts", "sections"}
+SECTION_KEYS = {"section_id", "section_status", "engine_axle_count", "torpedo_axle_count",
+                "direction", "speed", "torpedo_status", "first_axle", "error_code"}
+POINT_MSG_KEYS = {"ts", "point_id", "point_status", "point_mode", "error_code"}
+
+'''magic, msg type, flags, ts, section count'''
+SECTION_MSG_HEADER = struct.Struct('<BBBdH')
+'''status, engine axle count, torpedo axle count, direction, speed, torpedo status, first axle, error code'''
+SECTION_RECORD = struct.Struct('<BhhBdBBi')
+'''magic, msg type, ts, point status, point mode, error code'''
+POINT_MSG_HEADER = struct.Struct('<BBdBBi')
+SECTION_ID_INDEX = struct.Struct('<H')
+SECTION_MSG_FIELD_COUNT = 5
+SECTION_RECORD_FIELD_COUNT = 9
+
+
+class CodecFallback(Exception):
+    '''message does not fit the binary layout, it is sent as JSON'''
+    pass
+
+
+def enum_encode(enum_list, value):
+    try:
+        return enum_list.index(value)
+    except ValueError:
+        raise CodecFallback(value)
+
+
+def check_int(value):
+    if type(value) is not int:
+        raise CodecFallback(value)
+    return value
+
+
+def pack_str(value):
+    data = value.encode()
+    if len(data) > 255:
+        raise CodecFallback(value)
+    return bytes([len(data)]) + data
+
+
+class JsonCodec:
+    name = CODEC_JSON
+
+    def encode(self, msg):
+        return json.dumps(msg)
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+
+class BinaryCodec:
+    '''Struct packed section_info / point_info with dictionary coded enums.
+
+    section_ids is the section id index shared by both ends (from yard configuration),
+    without it section ids are sent inline. Messages which do not fit the layout
+    (unknown enum value, extra keys, non integer counts) are sent as JSON, decode
+    accepts both.
+    '''
+    name = CODEC_BINARY
+
+    def __init__(self, section_ids=None):
+        self.section_ids = list(section_ids) if section_ids is not None else []
+        self.section_id_idx = {}
+        for idx, section_id in enumerate(self.section_ids):
+            self.section_id_idx[section_id] = idx
+        self.json_codec = JsonCodec()
+        self.fallback_count = 0
+        self.section_structs = {}
+
+    def get_section_struct(self, count):
+        '''one Struct for header and all indexed section records, cached per section count'''
+        section_struct = self.section_structs.get(count)
+        if section_struct is None:
+            section_struct = struct.Struct(SECTION_MSG_HEADER.format + ('H' + SECTION_RECORD.format[1:]) * count)
+            self.section_structs[count] = section_struct
+        return section_struct
+
+    def encode(self, msg):
+        try:
+            if msg.keys() == SECTION_MSG_KEYS:
+                return self.encode_section_info(msg)
+            if msg.keys() == POINT_MSG_KEYS:
+                return self.encode_point_info(msg)
+            raise CodecFallback(list(msg.keys()))
+        except (CodecFallback, struct.error, AttributeError, TypeError):
+            self.fallback_count += 1
+            return self.json_codec.encode(msg)
+
+    def decode(self, payload):
+        if len(payload) == 0 or payload[0] != BINARY_MAGIC:
+            return self.json_codec.decode(payload)
+        if payload[1] == MSG_TYPE_SECTION_INFO:
+            return self.decode_section_info(payload)
+        if payload[1] == MSG_TYPE_POINT_INFO:
+            return self.decode_point_info(payload)
+        raise ValueError(f'unknown binary message type {payload[1]}')
+
+    def encode_section_info(self, msg):
+        flags = FLAG_SECTION_ID_INDEX if len(self.section_ids) > 0 else 0
+        sections = msg["sections"]
+        if flags & FLAG_SECTION_ID_INDEX:
+            try:
+                return self.encode_indexed_section_info(msg["ts"], sections)
+            except KeyError:
+                '''section id not in index, encode record by record'''
+                pass
+        parts = [SECTION_MSG_HEADER.pack(BINARY_MAGIC, MSG_TYPE_SECTION_INFO, flags, msg["ts"], len(sections))]
+        for section in sections:
+            if section.keys() != SECTION_KEYS:
+                raise CodecFallback(list(section.keys()))
+            if flags & FLAG_SECTION_ID_INDEX:
+                idx = self.section_id_idx.get(section["section_id"])
+                if idx is None:
+                    parts.append(SECTION_ID_INDEX.pack(SECTION_ID_INLINE))
+                    parts.append(pack_str(section["section_id"]))
+                else:
+                    parts.append(SECTION_ID_INDEX.pack(idx))
+            else:
+                parts.append(pack_str(section["section_id"]))
+            parts.append(SECTION_RECORD.pack(
+                enum_encode(SECTION_STATUS_ENUM, section["section_status"]),
+                check_int(section["engine_axle_count"]),
+                check_int(section["torpedo_axle_count"]),
+                enum_encode(DIRECTION_ENUM, section["direction"]),
+                section["speed"],
+                enum_encode(TORPEDO_STATUS_ENUM, section["torpedo_status"]),
+                enum_encode(FIRST_AXLE_ENUM, section["first_axle"]),
+                check_int(section["error_code"])))
+        return b''.join(parts)
+
+    def encode_indexed_section_info(self, ts, sections):
+        values = [BINARY_MAGIC, MSG_TYPE_SECTION_INFO, FLAG_SECTION_ID_INDEX, ts, len(sections)]
+        for section in sections:
+            if section.keys() != SECTION_KEYS:
+                raise CodecFallback(list(section.keys()))
+            values.extend((
+                self.section_id_idx[section["section_id"]],
+                enum_encode(SECTION_STATUS_ENUM, section["section_status"]),
+                check_int(section["engine_axle_count"]),
+                check_int(section["torpedo_axle_count"]),
+                enum_encode(DIRECTION_ENUM, section["direction"]),
+                section["speed"],
+                enum_encode(TORPEDO_STATUS_ENUM, section["torpedo_status"]),
+                enum_encode(FIRST_AXLE_ENUM, section["first_axle"]),
+                check_int(section["error_code"])))
+        return self.get_section_struct(len(sections)).pack(*values)
+
+    def decode_indexed_section_info(self, payload, count):
+        values = self.get_section_struct(count).unpack(payload)
+        sections = []
+        for offset in range(SECTION_MSG_FIELD_COUNT, len(values), SECTION_RECORD_FIELD_COUNT):
+            idx, status, engine_ac, torpedo_ac, direction, speed, torpedo_status, first_axle, error_code = \
+                values[offset:offset + SECTION_RECORD_FIELD_COUNT]
+            sections.append({
+                "section_id": self.section_ids[idx],
+                "section_status": SECTION_STATUS_ENUM[status],
+                "engine_axle_count": engine_ac,
+                "torpedo_axle_count": torpedo_ac,
+                "direction": DIRECTION_ENUM[direction],
+                "speed": speed,
+                "torpedo_status": TORPEDO_STATUS_ENUM[torpedo_status],
+                "first_axle": FIRST_AXLE_ENUM[first_axle],
+                "error_code": error_code})
+        return {"ts": values[3], "sections": sections}
+
+    def decode_section_info(self, payload):
+        magic, msg_type, flags, ts, count = SECTION_MSG_HEADER.unpack_from(payload, 0)
+        if flags & FLAG_SECTION_ID_INDEX and len(payload) == self.get_section_struct(count).size:
+            return self.decode_indexed_section_info(payload, count)
+        offset = SECTION_MSG_HEADER.size
+        sections = []
+        for i in range(count):
+            section_id = None
+            if flags & FLAG_SECTION_ID_INDEX:
+                idx, = SECTION_ID_INDEX.unpack_from(payload, offset)
+                offset += SECTION_ID_INDEX.size
+                if idx != SECTION_ID_INLINE:
+                    section_id = self.section_ids[idx]
+            if section_id is None:
+                length = payload[offset]
+                section_id = bytes(payload[offset + 1:offset + 1 + length]).decode()
+                offset += 1 + length
+            status, engine_ac, torpedo_ac, direction, speed, torpedo_status, first_axle, error_code = \
+                SECTION_RECORD.unpack_from(payload, offset)
+            offset += SECTION_RECORD.size
+            sections.append({
+                "section_id": section_id,
+                "section_status": SECTION_STATUS_ENUM[status],
+                "engine_axle_count": engine_ac,
+                "torpedo_axle_count": torpedo_ac,
+                "direction": DIRECTION_ENUM[direction],
+                "speed": speed,
+                "torpedo_status": TORPEDO_STATUS_ENUM[torpedo_status],
+                "first_axle": FIRST_AXLE_ENUM[first_axle],
+                "error_code": error_code})
+        return {"ts": ts, "sections": sections}
+
+    def encode_point_info(self, msg):
+        return POINT_MSG_HEADER.pack(
+            BINARY_MAGIC, MSG_TYPE_POINT_INFO, msg["ts"],
+            enum_encode(POINT_STATUS_ENUM, msg["point_status"]),
+            enum_encode(POINT_MODE_ENUM, msg["point_mode"]),
+            check_int(msg["error_code"])) + pack_str(msg["point_id"])
+
+    def decode_point_info(self, payload):
+        magic, msg_type, ts, point_status, point_mode, error_code = POINT_MSG_HEADER.unpack_from(payload, 0)
+        offset = POINT_MSG_HEADER.size
+        length = payload[offset]
+        point_id = bytes(payload[offset + 1:offset + 1 + length]).decode()
+        return {"ts": ts, "point_id": point_id, "point_status": POINT_STATUS_ENUM[point_status],
+                "point_mode": POINT_MODE_ENUM[point_mode], "error_code": error_code}
+
+
+class CodecRegistry:
+    '''topic -> codec mapping, topics not configured use the default codec (JSON)'''
+
+    def __init__(self, codec_cfg=None, section_ids=None):
+        if codec_cfg is None:
+            codec_cfg = {}
+        self.codecs = {CODEC_JSON: JsonCodec(), CODEC_BINARY: BinaryCodec(section_ids)}
+        default_name = codec_cfg.get("DEFAULT", CODEC_JSON)
+        if default_name not in self.codecs:
+            Log.logger.warning(f'codec: unknown default codec {default_name}, using {CODEC_JSON}')
+            default_name = CODEC_JSON
+        self.default_codec = self.codecs[default_name]
+        self.topic_codecs = {}
+        for topic, codec_name in codec_cfg.get("TOPICS", {}).items():
+            if codec_name in self.codecs:
+                self.topic_codecs[topic] = self.codecs[codec_name]
+            else:
+                Log.logger.warning(f'codec: unknown codec {codec_name} for topic {topic}, using default')
+
+    def get_codec(self, topic):
+        return self.topic_codecs.get(topic, self.default_codec)
+
+    def encode(self, topic, msg):
+        return self.get_codec(topic).encode(msg)
+
+    def decode(self, topic, payload):
+        return self.get_codec(topic).decode(payload)
+
+
+def benchmark(section_count=14, iterations=20000):
+    '''encode/decode throughput of json.dumps/json.loads against BinaryCodec'''
+    section_ids = ["S" + str(idx + 1) for idx in range(section_count)]
+    msg = {"ts": time.time(), "sections": [
+        {"section_id": section_id, "section_status": "occupied", "engine_axle_count": 4,
+         "torpedo_axle_count": 16, "direction": "in", "speed": 12.5, "torpedo_status": "loaded",
+         "first_axle": "torpedo", "error_code": 0} for section_id in section_ids]}
+
+    codec_list = [("json", JsonCodec()),
+                  ("binary inline id", BinaryCodec()),
+                  ("binary indexed id", BinaryCodec(section_ids))]
+    for codec_name, codec in codec_list:
+        payload = codec.encode(msg)
+        if codec.decode(payload) != msg:
+            Log.logger.critical(f'codec benchmark: {codec_name} round trip mismatch')
+
+        ts_start = time.perf_counter()
+        for i in range(iterations):
+            codec.encode(msg)
+        encode_ts = time.perf_counter() - ts_start
+
+        ts_start = time.perf_counter()
+        for i in range(iterations):
+            codec.decode(payload)
+        decode_ts = time.perf_counter() - ts_start
+
+        Log.logger.info(f'{codec_name:18} sections: {section_count:4} size: {len(payload):6} bytes '
+                        f'encode: {iterations / encode_ts:10.0f} msg/s decode: {iterations / decode_ts:10.0f} msg/s')
+
+
+if __name__ == '__main__':
+    my_log = Log()
+    for section_count in [14, 100, 500]:
+        benchmark(section_count, 200000 // section_count)
+    sys.exit(0)
@@ -12,9 +12,17 @@ from scc_dlm_conf import *
 from scc_dlm_model import *
 from scc_dlm_api import *
 from common.mqtt_client import *
+from common.scc_codec import *
 from common.scc_log import *
 #from scc_trail_through import *
 from trail_through import *
+from scc_ingest import *
+from scc_section_snapshot import *
+from scc_section_delta import *
+from scc_partition import *
+from scc_registry import *
+from scc_yard_state import *
+from scc_config_cache import *
 
 import pandas as pd
 import sys
@@ -88,29 +96,31 @@ class Yard:
         self.section_name = "none"
 
 
-class Section:
-    def __init__(self):
+class Section(YardStateView):
+    '''section state and topology are columns of the shared yard state table'''
+    section_status = EnumStateField("section_status")
+    direction = EnumStateField("direction")
+    speed = StateField("speed")
+    engine_axle_count = StateField("engine_axle_count")
+    torpedo_axle_count = StateField("torpedo_axle_count")
+    torpedo_status = EnumStateField("torpedo_status")
+    first_axle = EnumStateField("first_axle")
+    error_code = StateField("error_code")
+    left_normal_section_id = StateField("left_normal")
+    right_normal_section_id = StateField("right_normal")
+    left_reverse_section_id = StateField("left_reverse")
+    right_reverse_section_id = StateField("right_reverse")
+    torpedo_id = StateField("torpedo_id")
+    engine_id = StateField("engine_id")
+
+    def __init__(self, table, section_id):
+        YardStateView.__init__(self, table, section_id)
         self.yard_id = 0
         self.yard_name = "none"
         self.dpu_id = "none"
         self.dpu_name = "none"
-        self.section_id = "none"
         self.section_name = "none"
-        self.section_status = "cleared"
-        self.direction = "none"
-        self.speed = 10
-        self.engine_axle_count = 0
-        self.torpedo_axle_count = 0
-        self.torpedo_status = "loaded"
-        self.first_axle = "torpedo"
-        self.left_normal_section_id = "none"
-        self.right_normal_section_id = "none"
-        self.left_reverse_section_id = "none"
-        self.right_reverse_section_id = "none"
-        self.torpedo_id = 0
-        self.engine_id = 0
         self.prev_axle_count = 0
-        self.error_code = 0
         self.my_idx = 0
         self.left_normal_section_status = "none"
         self.right_normal_section_status = "none"
@@ -119,29 +129,78 @@ class Section:
         self.dp_id = []
 
 class Sccserver:
-    def __init__(self, mqtt_client):
+    def __init__(self, mqtt_client, ingest_cfg=None, section_publish_cfg=None, codec_cfg=None,
+                 trail_through_cfg=None, role_cache_cfg=None):
         try:
             self.scc_api = SccAPI()
-            
-            self.scc_tt = Trailthrough(mqtt_client)
+            '''user roles of cwsm reset commands are cached, invalidated on cwsm/user_roles_invalidate'''
+            self.scc_api.configure_role_cache(role_cache_cfg)
+
+            '''sections, dlm api and trail through share one yard state table'''
+            self.yard_state = yard_state
+
+            '''trail through rules, reference per section loop or the vectorized numpy engine for large yards'''
+            if trail_through_cfg is None:
+                trail_through_cfg = {}
+            self.scc_tt = Trailthrough(mqtt_client, self.yard_state,
+                                       trail_through_cfg.get("ENGINE", TRAIL_THROUGH_ENGINE_REFERENCE))
             self.scc_tt.init_trail_through_info()
 
             self.mqtt_client = mqtt_client
+
+            '''sem/section_info is only queued on the MQTT thread and evaluated by the worker'''
+            if ingest_cfg is None:
+                ingest_cfg = {}
+            self.ingest_queue = IngestQueue(
+                ingest_cfg.get("MAX_SIZE", DEFAULT_QUEUE_MAX_SIZE),
+                ingest_cfg.get("OVERFLOW_POLICY", OVERFLOW_POLICY_DROP_OLDEST))
+            '''the pooled db connection of the worker is returned after every message'''
+            self.evaluator_worker = EvaluatorWorker(
+                self.ingest_queue, self.evaluate_section_info, done_fn=db_manager.release)
+
+            '''occ/section_info publish mode, delta mode sends only changed sections between keyframes'''
+            if section_publish_cfg is None:
+                section_publish_cfg = {}
+            self.delta_publisher = None
+            if section_publish_cfg.get("MODE", SECTION_PUBLISH_MODE_FULL) == SECTION_PUBLISH_MODE_DELTA:
+                self.delta_publisher = SectionDeltaPublisher(
+                    mqtt_client, section_publish_cfg.get("KEYFRAME_INTERVAL", DEFAULT_KEYFRAME_INTERVAL))
+
+            '''wire codec per topic, section id index is added once yard configuration is loaded'''
+            self.codec_cfg = codec_cfg
+            self.codecs = CodecRegistry(codec_cfg)
             Log.logger.info("SCC Server initialised!!")
 
             self.yard_obj_list = []
-            self.section_obj_list = []
-            self.point_obj_list = []
+            '''dict index by id, section_obj_list / point_obj_list are the dense list views'''
+            self.section_registry = SectionRegistry()
+            self.point_registry = PointRegistry()
+            self.section_obj_list = self.section_registry.sections
+            self.point_obj_list = self.point_registry.points
+            '''version of the yard configuration snapshot the registries were built from'''
+            self.yard_config_version = 0
         except Exception as ex:
             Log.logger.critical(f'init exception: {ex}')
 
-    def init_section_info(self):
-        for section_idx in range(TOTAL_SECTION):
-            self.section_obj_list.append(Section())
+    def start_evaluator_worker(self):
+        '''start evaluator worker thread which drains the ingest queue'''
+        try:
+            if not self.evaluator_worker.is_alive():
+                self.evaluator_worker.start()
+        except Exception as ex:
+            Log.logger.critical(f'start_evaluator_worker: exception: {ex}')
+
+    def stop_evaluator_worker(self):
+        try:
+            self.evaluator_worker.stop()
+            Log.logger.info(f'evaluator stats: {self.evaluator_worker.get_stats()}')
+        except Exception as ex:
+            Log.logger.critical(f'stop_evaluator_worker: exception: {ex}')
 
+    def init_section_info(self):
         for section_idx in range(TOTAL_SECTION):
-            self.section_obj_list[section_idx].section_id = "S" + \
-                str(section_idx + 1)
+            section = Section(self.yard_state, "S" + str(section_idx + 1))
+            self.section_registry.add(section)
 
     def cwsm_section_reset_sub_fn(self, in_client, user_data, message):
         '''cwsm section reset subscribe function'''
@@ -224,12 +283,7 @@ class Sccserver:
 
     def get_dp_list_of_section(self, section_id):
         try:
-            for sec_idx in range(len(self.section_obj_list)):
-                if self.section_obj_list[sec_idx].section_id == section_id:
-                    return self.section_obj_list[sec_idx].dp_id
-                else:
-                    pass
-            return []
+            return self.section_registry.get_dp_list(section_id)
         except Exception as ex:
             Log.logger.critical(f'get_dp_list_of_section: exception: {ex}')
 
@@ -244,28 +298,35 @@ class Sccserver:
         except Exception as ex:
             Log.logger.critical(f'dp_reset_pub_fn: exception: {ex}')
 
+    def build_section_registry(self, snapshot):
+        '''sections of the yard_config records of snapshot, state stays in the yard state table rows'''
+        section_registry = SectionRegistry()
+        for section_idx in snapshot.yard_config:
+            Log.logger.info(
+                f'{section_idx.yard_id}, {section_idx.yard_name},'
+                f'{section_idx.dpu_id}, {section_idx.dpu_name},'
+                f'{section_idx.section_id}, {section_idx.section_name}, {section_idx.dp_id}')
+
+            new_section_config_obj = Section(self.yard_state, section_idx.section_id)
+            new_section_config_obj.yard_id = section_idx.yard_id
+            new_section_config_obj.yard_name = section_idx.yard_name
+            new_section_config_obj.dpu_id = section_idx.dpu_id
+            new_section_config_obj.dpu_name = section_idx.dpu_name
+            new_section_config_obj.section_name = section_idx.section_name
+            new_section_config_obj.dp_id = list(section_idx.dp_id) if section_idx.dp_id is not None else None
+
+            section_registry.add(new_section_config_obj)
+        return section_registry
+
     def fill_yard_config_info_from_db(self):
-        ''' Fill yard configuration information from yard_config db table'''
+        ''' Fill yard configuration information from the yard configuration snapshot (yard_config db table)'''
         try:
-            db_yard_config_list = self.scc_api.read_yard_config_info()
-
-            if len(db_yard_config_list) > 0:
-                for section_idx in db_yard_config_list:
-                    Log.logger.info(
-                        f'{section_idx.yard_id}, {section_idx.yard_name},'
-                        f'{section_idx.dpu_id}, {section_idx.dpu_name},'
-                        f'{section_idx.section_id}, {section_idx.section_name}, {section_idx.dp_id}')
-
-                    new_section_config_obj = Section()
-                    new_section_config_obj.yard_id = section_idx.yard_id
-                    new_section_config_obj.yard_name = section_idx.yard_name
-                    new_section_config_obj.dpu_id = section_idx.dpu_id
-                    new_section_config_obj.dpu_name = section_idx.dpu_name
-                    new_section_config_obj.section_id = section_idx.section_id
-                    new_section_config_obj.section_name = section_idx.section_name
-                    new_section_config_obj.dp_id = section_idx.dp_id
-
-                    self.section_obj_list.append(new_section_config_obj)
+            snapshot = yard_config_cache.get_snapshot()
+
+            if snapshot is not None and len(snapshot.yard_config) > 0:
+                self.section_registry = self.build_section_registry(snapshot)
+                self.section_obj_list = self.section_registry.sections
+                self.yard_config_version = snapshot.version
 
             else:
                 pass
@@ -276,23 +337,26 @@ class Sccserver:
             Log.logger.critical(
                 f'fill_yard_config_info_from_db: exception: {ex}')
 
+    def configure_codecs(self):
+        '''rebuild codecs with section id index of yard configuration'''
+        try:
+            section_ids = self.section_registry.ids()
+            self.codecs = CodecRegistry(self.codec_cfg, section_ids)
+        except Exception as ex:
+            Log.logger.critical(f'configure_codecs: exception: {ex}')
+
     def fill_section_connections_info_from_db(self):
+        '''neighbour ids of the sections are filled in the yard state table by the yard topology'''
         try:
-            db_section_connections_list = self.scc_api.read_section_connections_info()
-
-            if len(db_section_connections_list) > 0:
-                for db_section_idx in db_section_connections_list:
-                    Log.logger.info(
-                        f'{db_section_idx.section_id}, {db_section_idx.left_normal}, {db_section_idx.right_normal}, {db_section_idx.left_reverse}, {db_section_idx.right_reverse}')
-
-                    for section_obj_idx in range(len(self.section_obj_list)):
-                        if self.section_obj_list[section_obj_idx].section_id == db_section_idx.section_id:
-                            self.section_obj_list[section_obj_idx].left_normal_section_id = db_section_idx.left_normal
-                            self.section_obj_list[section_obj_idx].right_normal_section_id = db_section_idx.right_normal
-                            self.section_obj_list[section_obj_idx].left_reverse_section_id = db_section_idx.left_reverse
-                            self.section_obj_list[section_obj_idx].right_reverse_section_id = db_section_idx.right_reverse
-                        else:
-                            pass
+            topology = self.scc_api.init_yard_topology()
+
+            if topology is not None and len(topology.section_ids) > 0:
+                for section_id in topology.section_ids:
+                    section = self.section_registry.get(section_id)
+                    if section is not None:
+                        Log.logger.info(
+                            f'{section_id}, {section.left_normal_section_id}, {section.right_normal_section_id}, '
+                            f'{section.left_reverse_section_id}, {section.right_reverse_section_id}')
             else:
                 pass
                 Log.logger.warning(f'section connection table found empty')
@@ -304,12 +368,7 @@ class Sccserver:
 
     def get_section_status(self, section_id):
         try:
-            for section_obj_idx in range(len(self.section_obj_list)):
-                if self.section_obj_list[section_obj_idx].section_id == section_id:
-                    return self.section_obj_list[section_obj_idx].section_status
-                else:
-                    pass
-            return "none"
+            return self.section_registry.get_status(section_id)
         except Exception as ex:
             Log.logger.critical("fill section idx: exception: {ex}")
 
@@ -327,10 +386,9 @@ class Sccserver:
         except Exception as ex:
             Log.logger.info(f'print_section_info: exception: {ex}')
 
-    def construct_section_json_msg(self):
+    def construct_section_msg_list(self):
         try:
             section_msg_list = []
-            json_scc_msg = ""
             for i in range(len(self.section_obj_list)):
                 section_msg = {
                     "section_id": self.section_obj_list[i].section_id,
@@ -343,52 +401,111 @@ class Sccserver:
                     "first_axle": self.section_obj_list[i].first_axle,
                     "error_code": self.section_obj_list[i].error_code}
                 section_msg_list.append(section_msg)
+            return section_msg_list
+        except Exception as e:
+            Log.logger.critical(f'construct_section_msg_list: exception : {e}')
 
-            scc_msg = {"ts": time.time(), "sections": section_msg_list}
+    def construct_section_json_msg(self):
+        try:
+            json_scc_msg = ""
+            scc_msg = {"ts": time.time(), "sections": self.construct_section_msg_list()}
             json_scc_msg = json.dumps(scc_msg, indent=0)
             return json_scc_msg
         except Exception as e:
             Log.logger.critical(f'construct_section_json_msg: exception : {e}')
 
+    def publish_occ_section_info(self, snapshot):
+        '''publish occ/section_info, full message or keyframe/delta depending on publish mode'''
+        try:
+            if self.delta_publisher is not None:
+                self.delta_publisher.publish(snapshot.ts, snapshot.raw_sections())
+            elif self.codecs.get_codec(SECTION_INFO_TOPIC).name == snapshot.codec_name():
+                '''original payload is forwarded unchanged'''
+                self.mqtt_client.pub(SECTION_INFO_TOPIC, snapshot.payload)
+            else:
+                self.mqtt_client.pub(SECTION_INFO_TOPIC, self.codecs.encode(SECTION_INFO_TOPIC, snapshot.msg))
+        except Exception as ex:
+            Log.logger.critical(f'publish_occ_section_info: exception: {ex}')
+
     def publish_section_info(self, mqtt_client, scc_api):
         try:
             while True:
                 json_msg = self.construct_section_json_msg()
+                snapshot = SectionSnapshot.from_payload(json_msg)
                 ''' insert section_info in database first before publish'''
-                scc_api.insert_section_info(json_msg)
-                scc_api.insert_section_playback_info(json_msg)
+                scc_api.insert_section_info(snapshot)
+                scc_api.insert_section_playback_info(snapshot)
                 # dlm_api.insert_train_trace_info(json_msg)
                 # dlm_api.yard_performance(json_msg)
 
                 ''' publish section_info '''
-                mqtt_client.pub("occ/section_info", json_msg)
+                self.publish_occ_section_info(snapshot)
+                db_manager.release()
                 time.sleep(1)
         except Exception as e:
             Log.logger.critical(f'publish_section_info: exception: {e}')
 
     def evaluator_section_info_sub_fn(self, in_client, user_data, message):
-        '''subscribe sem/section_info receive from acp dpu'''
+        '''subscribe sem/section_info receive from acp dpu, only enqueue on MQTT thread'''
+        try:
+            if not self.ingest_queue.put(message.payload):
+                Log.logger.warning(f'sem/section_info dropped, ingest queue full')
+        except Exception as ex:
+            Log.logger.critical(f'evaluator_section_info_sub_fn: exception: {ex}')
+
+    def apply_yard_config(self):
+        '''switch to a reloaded yard configuration snapshot, runs on the evaluator worker thread'''
+        try:
+            snapshot = yard_config_cache.snapshot
+            if snapshot is None or snapshot.version == self.yard_config_version:
+                return None
+            section_registry = self.build_section_registry(snapshot)
+            point_registry = self.build_point_registry(snapshot, self.point_registry)
+
+            '''readers on other threads keep the registry they got, the new one is swapped in by reference'''
+            self.section_registry = section_registry
+            self.section_obj_list = section_registry.sections
+            self.point_registry = point_registry
+            self.point_obj_list = point_registry.points
+            self.configure_codecs()
+
+            self.scc_api.apply_yard_config(snapshot)
+            self.scc_tt.apply_yard_config(snapshot)
+            self.yard_config_version = snapshot.version
+            Log.logger.info(f'yard configuration {snapshot.version} applied: {len(section_registry)} sections, '
+                            f'{len(point_registry)} points')
+            return snapshot
+        except Exception as ex:
+            Log.logger.critical(f'apply_yard_config: exception: {ex}')
+            return None
+
+    def evaluate_section_info(self, payload, recv_ts):
+        '''evaluate sem/section_info on the evaluator worker thread'''
         try:
             ts_start = time.time()
 
-            Log.logger.info(f'sem/section_info received time: {ts_start}')
-            recv_msg = json.loads(message.payload)
-            recv_json_msg = json.dumps(recv_msg, indent=0)
-            
-            json_msg = recv_json_msg
+            '''yard configuration reloaded in the background is picked up between messages'''
+            self.apply_yard_config()
+
+            Log.logger.info(f'sem/section_info received time: {recv_ts}, lag: {ts_start - recv_ts}')
+            '''parse once, the snapshot is handed to every consumer'''
+            snapshot = SectionSnapshot.from_payload(payload, self.codecs.get_codec("sem/section_info"))
+            self.yard_state.update_from_snapshot(snapshot)
+
             '''get torpedo status of middle sections'''
-            #json_msg = self.scc_tt.find_torpedo_status(recv_json_msg)  #NOT REQUIRED IN HSM1 SCENARIO
+            #json_msg = self.scc_tt.find_torpedo_status(snapshot)  #NOT REQUIRED IN HSM1 SCENARIO
 
             ''' insert section_info in database first before publish'''
-            scc_api.insert_section_info(json_msg)
-            scc_api.insert_section_playback_info(json_msg)
-            scc_api.insert_train_trace_info(json_msg)
-            #scc_api.yard_performance(json_msg)
-            #scc_api.torpedo_performance(json_msg)
+            scc_api.insert_section_info(snapshot)
+            scc_api.insert_section_playback_info(snapshot)
+            scc_api.insert_train_trace_info(snapshot)
+            scc_api.update_section_rollup(snapshot)
+            #scc_api.yard_performance(snapshot)
+            #scc_api.torpedo_performance(snapshot)
 
             '''trail through early warning detection'''
             tt_sec_list = self.scc_tt.detect_trail_through(
-                json_msg, self.point_obj_list)
+                snapshot, self.point_registry)
 
             if len(tt_sec_list) != 0:
                 for sec_idx in range(len(tt_sec_list)):
@@ -399,24 +516,35 @@ class Sccserver:
                 pass
 
             ''' publish section_info '''
-            mqtt_client.pub("occ/section_info", json_msg)
+            self.publish_occ_section_info(snapshot)
 
             ts_end = time.time()
             total_ts = ts_end - ts_start
             Log.logger.info(f'scc evaluator function execution time {total_ts}')
 
         except Exception as ex:
-            Log.logger.critical(f'evaluator_section_info_sub_fn: exception: {ex}')
+            Log.logger.critical(f'evaluate_section_info: exception: {ex}')
+
+    def build_point_registry(self, snapshot, prev_point_registry=None):
+        '''points of the pms_config records of snapshot, status of a known point is kept'''
+        point_registry = PointRegistry()
+        for point_idx in snapshot.point_config:
+            point = Point()
+            point.point_id = point_idx.point_id
+            point.section_id = point_idx.section_id
+            prev_point = prev_point_registry.get(point.point_id) if prev_point_registry is not None else None
+            if prev_point is not None:
+                point.point_status = prev_point.point_status
+                point.point_mode = prev_point.point_mode
+                point.error_code = prev_point.error_code
+            point_registry.add(point)
+        return point_registry
 
     def load_point_config(self):
-        '''load point configuration from pms_config table'''
+        '''load point configuration from the yard configuration snapshot (pms_config table)'''
         try:
-            point_config_obj = self.scc_tt.get_point_config()
-
-            for point_idx in point_config_obj:
-                self.point_obj_list.append(Point())
-                self.point_obj_list[-1].point_id = point_idx.point_id
-                self.point_obj_list[-1].section_id = point_idx.section_id
+            self.point_registry = self.build_point_registry(yard_config_cache.get_snapshot())
+            self.point_obj_list = self.point_registry.points
 
             for point_idx in range(len(self.point_obj_list)):
                 Log.logger.info(
@@ -428,16 +556,9 @@ class Sccserver:
     def point_info_sub_fn(self, in_client, user_data, message):
         '''subscribe pms/point_info receive from pms'''
         try:
-            msg_payload = json.loads(message.payload)
+            msg_payload = self.codecs.decode("pms/point_info", message.payload)
             #Log.logger.info(f'Point Info : {message.payload}')
-            for point_idx in range(len(self.point_obj_list)):
-                if self.point_obj_list[point_idx].point_id == msg_payload["point_id"]:
-                    self.point_obj_list[point_idx].point_status = msg_payload["point_status"]
-                    self.point_obj_list[point_idx].point_mode = msg_payload["point_mode"]
-                    self.point_obj_list[point_idx].error_code = msg_payload["error_code"]
-                    self.point_obj_list[point_idx].ts = msg_payload["ts"]
-                else:
-                    pass
+            self.point_registry.update_status(msg_payload)
             # self.print_point_info()
         except Exception as ex:
             Log.logger.critical(f'point_info_sub_fn: exception: {ex}')
@@ -482,17 +603,34 @@ if __name__ == '__main__':
     scc_api = SccAPI()
     psql_db = scc_api.connect_database(scc_cfg)
 
-    '''Create database model'''
+    '''Create database model, telemetry tables are created partitioned by day when enabled'''
+    partition_manager = None
     if psql_db:
-        psql_db.create_tables([SectionInfo, DpInfo, SectionConfigInfo])
+        if scc_cfg.partitioning.get("ENABLE", False):
+            partition_manager = PartitionManager(scc_cfg.partitioning)
+            partition_manager.create_tables()
+        psql_db.create_tables([SectionInfo, DpInfo, SectionConfigInfo, SectionPlaybackInfo, SectionPlaybackDelta,
+                               SectionRollupHourly, SectionRollupDaily])
+        scc_api.trip_cache.ensure_indexes([YardPerformanceInfo, TorpedoPerformanceInfo])
+        if partition_manager is not None:
+            partition_manager.start()
     else:
         pass
 
+    '''yard configuration snapshot, reloaded on cwsm/yard_config_reload or postgres NOTIFY'''
+    yard_config_cache.configure(scc_cfg.yard_config_cache)
+
     '''Read simulator configuration'''
     section_config = SectionConfig()
 
     scc_api.init_section_connections_info()
     scc_api.init_train_trace_info()
+
+    '''section, section_playback and train_trace rows are journaled and group committed by the db writer'''
+    scc_api.configure_playback(scc_cfg.section_playback)
+    scc_api.start_db_writer(scc_cfg.db_writer, scc_cfg.db_journal)
+    if scc_cfg.rollup.get("ENABLE", False):
+        scc_api.start_section_rollup(scc_cfg.rollup)
     
     '''start MQTT client connection'''
     try:
@@ -504,23 +642,45 @@ if __name__ == '__main__':
             scc_cfg.lmb["PASSWORD"],
             scc_cfg.scc_id)
 
+        '''subscribe callbacks return their pooled db connection when they finish'''
+        mqtt_client.sub_done_fn = db_manager.release
+
+        '''bounded outbound spool used while broker is not connected'''
+        mqtt_client.configure_spool(scc_cfg.mqtt_spool)
+        if scc_cfg.mqtt_dispatcher:
+            mqtt_client.configure_dispatcher(scc_cfg.mqtt_dispatcher)
+        if scc_cfg.mqtt_publisher.get("ENABLE", False):
+            mqtt_client.configure_publisher(scc_cfg.mqtt_publisher)
         mqtt_client.connect()
     except Exception as ex:
         Log.logger.critical(f'mqtt exception: {ex}')
 
     '''scc server'''
-    scc_server = Sccserver(mqtt_client)
+    scc_server = Sccserver(mqtt_client, scc_cfg.ingest_queue, scc_cfg.section_publish, scc_cfg.codec,
+                           scc_cfg.trail_through, scc_cfg.role_cache)
     scc_server.fill_yard_config_info_from_db()
+    scc_server.configure_codecs()
     scc_server.fill_section_connections_info_from_db()
 
     '''point configuration'''
     scc_server.load_point_config()
 
+    '''start evaluator worker before sem/section_info is subscribed'''
+    scc_server.start_evaluator_worker()
+
+    '''background yard configuration reload'''
+    yard_config_cache.start()
+    mqtt_client.sub(YARD_CONFIG_RELOAD_TOPIC, yard_config_cache.reload_sub_fn)
+
     '''subscribe cwsm/section_reset mqtt topic'''
     mqtt_client.sub("cwsm/section_reset", scc_server.cwsm_section_reset_sub_fn)
 
     '''subscribe cwsm/reset_dp mqtt topic'''
     mqtt_client.sub("cwsm/dp_reset", scc_server.cwsm_dp_reset_sub_fn)
+
+    '''subscribe cwsm/user_roles_invalidate mqtt topic, admin drops cached user roles'''
+    mqtt_client.sub(USER_ROLES_INVALIDATE_TOPIC,
+                    scc_server.scc_api.role_cache.invalidate_sub_fn)
     
     '''subscribe sem/section_info mqtt topic'''
     mqtt_client.sub("sem/section_info",
@@ -540,6 +700,11 @@ if __name__ == '__main__':
     '''subscribe sem/section_info mqtt topic'''
     mqtt_client.sub("cwsm/tt_clear",
                     scc_server.tt_clear_sub_fn)
+
+    '''subscribe occ/section_info keyframe request when delta publish mode is enabled'''
+    if scc_server.delta_publisher is not None:
+        mqtt_client.sub(SECTION_INFO_KEYFRAME_REQ_TOPIC,
+                        scc_server.delta_publisher.keyframe_req_sub_fn)
     # while True:
     #     pass
     # removing the infinite loop and calling the mqtt_client loop
@@ -0,0 +1,324 @@
+'''
+*****************************************************************************
+*File : scc_async_ingest.py
+*Module : SCC
+*Purpose : asyncio database writer (asyncpg, pipelined prepared inserts, several batches in flight)
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import json
+import time
+import asyncio
+import threading
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+WRITER_ENGINE_THREADED = "threaded"
+WRITER_ENGINE_ASYNCIO = "asyncio"
+
+DEFAULT_ASYNC_POOL_SIZE = 2
+DEFAULT_ASYNC_MAX_INFLIGHT = 4
+DEFAULT_ASYNC_CONNECT_RETRY = 5
+DEFAULT_DB_PORT = 5432
+
+'''peewee field_type of the columns bound as text'''
+TEXT_FIELD_TYPES = ["VARCHAR", "TEXT"]
+
+
+def async_ingest_available():
+    return asyncpg is not None
+
+
+class AsyncDbWriter(threading.Thread):
+    '''Drop-in alternative to SccDbWriter (submit / stop / get_stats) running on its own asyncio loop.
+
+    Rows are batched like SccDbWriter, each batch is written in one transaction with
+    executemany of a prepared INSERT per table, asyncpg pipelines the binds of a batch
+    without a round trip per row. Up to max_inflight batches are written concurrently on
+    a pool of pool_size connections, a connection runs one batch at a time. There is no
+    journal and no retry, a failed batch is counted in failed_rows and dropped, so the
+    threaded writer is used instead when DB_JOURNAL is enabled.
+    '''
+
+    def __init__(self, db_cfg, batch_size, flush_interval, max_pending_rows,
+                 pool_size=DEFAULT_ASYNC_POOL_SIZE, max_inflight=DEFAULT_ASYNC_MAX_INFLIGHT):
+        threading.Thread.__init__(self, name="scc-async-db-writer", daemon=True)
+        self.db_cfg = db_cfg
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending_rows = max_pending_rows
+        self.pool_size = pool_size
+        self.max_inflight = max_inflight
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_rows = 0
+        self.thread_quit = False
+        self.loop = None
+        self.wake_event = None
+        self.insert_plans = {}
+
+        '''statistics'''
+        self.submitted_rows = 0
+        self.written_rows = 0
+        self.dropped_rows = 0
+        self.failed_rows = 0
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.inflight_batches = 0
+        self.max_inflight_batches = 0
+
+    def submit(self, model, fields, rows):
+        '''queue rows for model, never blocks on the database'''
+        if len(rows) == 0:
+            return True
+        with self.lock:
+            if self.pending_rows + len(rows) > self.max_pending_rows:
+                self.dropped_rows += len(rows)
+                Log.logger.critical(
+                    f'scc_async_ingest: db writer backlog full, dropped {len(rows)} {model._meta.table_name} rows')
+                return False
+            self.pending.append((model, fields, rows))
+            self.pending_rows += len(rows)
+            self.submitted_rows += len(rows)
+            wake = self.pending_rows >= self.batch_size
+        if wake:
+            self.wake()
+        return True
+
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wake_event.set)
+
+    def take_pending(self):
+        '''next batch of about batch_size rows, a backlog is split into several batches'''
+        with self.lock:
+            batch_rows = 0
+            entry_count = 0
+            for model, fields, rows in self.pending:
+                batch_rows += len(rows)
+                entry_count += 1
+                if batch_rows >= self.batch_size:
+                    break
+            batch = self.pending[:entry_count]
+            del self.pending[:entry_count]
+            self.pending_rows -= batch_rows
+            return batch, batch_rows
+
+    def get_insert_plan(self, model, fields):
+        '''(INSERT statement, indexes of text columns) for model/fields'''
+        key = (model, tuple(fields))
+        plan = self.insert_plans.get(key)
+        if plan is None:
+            columns = ', '.join(f'"{field.column_name}"' for field in fields)
+            params = ', '.join(f'${idx + 1}' for idx in range(len(fields)))
+            sql = f'INSERT INTO "{model._meta.table_name}" ({columns}) VALUES ({params})'
+            text_idx = [idx for idx, field in enumerate(fields) if field.field_type in TEXT_FIELD_TYPES]
+            plan = (sql, text_idx)
+            self.insert_plans[key] = plan
+        return plan
+
+    def cast_rows(self, text_idx, rows):
+        '''asyncpg binds no int to a text parameter, text column values are converted with str()'''
+        cast_rows = []
+        for row in rows:
+            row = list(row)
+            for idx in text_idx:
+                value = row[idx]
+                if value is not None and not isinstance(value, str):
+                    row[idx] = str(value)
+            cast_rows.append(row)
+        return cast_rows
+
+    async def init_connection(self, conn):
+        '''JSONField values are python objects'''
+        for type_name in ["json", "jsonb"]:
+            await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+    async def create_pool(self):
+        '''connect, retry until the database is reachable or the writer stops'''
+        while not self.thread_quit:
+            try:
+                return await asyncpg.create_pool(
+                    database=self.db_cfg["DB_NAME"],
+                    user=self.db_cfg["USER"],
+                    password=self.db_cfg["PASSWORD"],
+                    host=self.db_cfg["HOST"],
+                    port=self.db_cfg.get("PORT", DEFAULT_DB_PORT),
+                    min_size=self.pool_size,
+                    max_size=self.pool_size,
+                    init=self.init_connection)
+            except Exception as ex:
+                Log.logger.critical(f'scc_async_ingest: connect failed, retry in {DEFAULT_ASYNC_CONNECT_RETRY}s: {ex}')
+                await asyncio.sleep(DEFAULT_ASYNC_CONNECT_RETRY)
+        return None
+
+    async def flush(self, pool, batch, batch_rows, inflight):
+        '''write one batch in a single transaction, rows are grouped per table'''
+        ts_start = time.time()
+        try:
+            grouped = {}
+            for model, fields, rows in batch:
+                key = (model, tuple(fields))
+                if key not in grouped:
+                    grouped[key] = []
+                grouped[key].extend(rows)
+
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    for (model, fields), rows in grouped.items():
+                        sql, text_idx = self.get_insert_plan(model, fields)
+                        if len(text_idx) > 0:
+                            rows = self.cast_rows(text_idx, rows)
+                        await conn.executemany(sql, rows)
+            self.written_rows += batch_rows
+        except Exception as ex:
+            self.failed_rows += batch_rows
+            Log.logger.critical(f'scc_async_ingest: db writer flush of {batch_rows} rows failed: {ex}')
+        finally:
+            self.inflight_batches -= 1
+            inflight.release()
+
+        latency = time.time() - ts_start
+        self.flush_count += 1
+        self.last_flush_latency = latency
+        self.total_flush_latency += latency
+        if latency > self.max_flush_latency:
+            self.max_flush_latency = latency
+        self.last_batch_size = batch_rows
+        if batch_rows > self.max_batch_size:
+            self.max_batch_size = batch_rows
+
+    async def main(self):
+        self.wake_event = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        inflight = asyncio.Semaphore(self.max_inflight)
+        tasks = set()
+        pool = await self.create_pool()
+        if pool is None:
+            return
+        while True:
+            try:
+                await asyncio.wait_for(self.wake_event.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake_event.clear()
+            quit_flag = self.thread_quit
+            while True:
+                batch, batch_rows = self.take_pending()
+                if batch_rows == 0:
+                    break
+                await inflight.acquire()
+                self.inflight_batches += 1
+                if self.inflight_batches > self.max_inflight_batches:
+                    self.max_inflight_batches = self.inflight_batches
+                task = asyncio.ensure_future(self.flush(pool, batch, batch_rows, inflight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if batch_rows < self.batch_size:
+                    break
+            if quit_flag:
+                break
+        if len(tasks) > 0:
+            await asyncio.wait(tasks)
+        await pool.close()
+
+    def run(self):
+        Log.logger.info(f'scc_async_ingest: async db writer started, batch size: {self.batch_size}, '
+                        f'flush interval: {self.flush_interval}, pool size: {self.pool_size}, '
+                        f'max inflight: {self.max_inflight}')
+        try:
+            asyncio.run(self.main())
+        except Exception as ex:
+            Log.logger.critical(f'scc_async_ingest: async db writer: exception: {ex}')
+        Log.logger.info(f'scc_async_ingest: async db writer stopped, {self.get_stats()}')
+
+    def stop(self):
+        '''flush pending rows and stop the writer thread'''
+        self.thread_quit = True
+        self.wake()
+
+    def get_stats(self):
+        with self.lock:
+            pending_rows = self.pending_rows
+        stats = {"engine": WRITER_ENGINE_ASYNCIO,
+                 "pending_rows": pending_rows,
+                 "submitted_rows": self.submitted_rows,
+                 "written_rows": self.written_rows,
+                 "dropped_rows": self.dropped_rows,
+                 "failed_rows": self.failed_rows,
+                 "flush_count": self.flush_count,
+                 "last_flush_latency": self.last_flush_latency,
+                 "max_flush_latency": self.max_flush_latency,
+                 "last_batch_size": self.last_batch_size,
+                 "max_batch_size": self.max_batch_size,
+                 "inflight_batches": self.inflight_batches,
+                 "max_inflight_batches": self.max_inflight_batches}
+        if self.flush_count > 0:
+            stats["avg_flush_latency"] = self.total_flush_latency / self.flush_count
+            stats["avg_batch_size"] = self.written_rows / self.flush_count
+        else:
+            stats["avg_flush_latency"] = 0.0
+            stats["avg_batch_size"] = 0.0
+        return stats
+
+
+def run_synthetic_load(scc_api, msg_count=2000, msg_rate=100, section_count=14):
+    '''sem/section_info like load through the SccAPI insert methods, returns submit latency and write rate'''
+    from scc_section_snapshot import SectionSnapshot
+    submit_latency = []
+    ts_start = time.time()
+    for msg_idx in range(msg_count):
+        msg = {"ts": time.time(), "sections": [
+            {"section_id": "S" + str(i + 1), "section_status": "occupied", "engine_axle_count": 4,
+             "torpedo_axle_count": 16, "direction": "in", "speed": 12.5, "torpedo_status": "loaded",
+             "first_axle": "torpedo"} for i in range(section_count)]}
+        snapshot = SectionSnapshot.from_payload(json.dumps(msg))
+        ts_submit = time.perf_counter()
+        scc_api.insert_section_info(snapshot)
+        scc_api.insert_section_playback_info(snapshot)
+        submit_latency.append(time.perf_counter() - ts_submit)
+        delay = ts_start + (msg_idx + 1) / msg_rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    db_writer = scc_api.db_writer
+    scc_api.stop_db_writer()
+    elapsed = time.time() - ts_start
+    submit_latency.sort()
+    return {"writer": db_writer.get_stats() if db_writer is not None else {},
+            "messages": msg_count,
+            "elapsed": elapsed,
+            "submit_p50": submit_latency[len(submit_latency) // 2],
+            "submit_p99": submit_latency[int(len(submit_latency) * 0.99)],
+            "submit_max": submit_latency[-1]}
+
+
+if __name__ == '__main__':
+    if Log.logger is None:
+        my_log = Log()
+
+    from scc_dlm_api import *
+
+    '''same synthetic load through the threaded peewee writer and the asyncio writer'''
+    for engine in [WRITER_ENGINE_THREADED, WRITER_ENGINE_ASYNCIO]:
+        scc_api = SccAPI()
+        if not scc_api.connect_database(cfg):
+            sys.exit(1)
+        writer_cfg = dict(cfg.db_writer, ENGINE=engine)
+        scc_api.start_db_writer(writer_cfg)
+        result = run_synthetic_load(scc_api)
+        Log.logger.info(f'{engine:8} load: {result}')
+    sys.exit(0)
@@ -0,0 +1,51 @@
+'''
+*****************************************************************************
+*File : scc_change_detector.py
+*Module : SCC
+*Purpose : Changed sections of each sem/section_info snapshot, rules run only for changed sections
+*          and their topology neighbours
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+
+class SectionChangeDetector:
+    '''Changed sections of the snapshot last applied to the yard state.
+
+    YardStateTable.update_from_snapshot compares every section of the message with the
+    values stored for its row and records the changed rows and the rows whose
+    torpedo_axle_count changed; the detector only reads those sets, it keeps no copy
+    of the previous message, so every rule sees the same changes. affected_rows()
+    adds the topology neighbours, rules evaluate only those rows instead of the whole yard.
+    '''
+
+    def __init__(self, table, topology):
+        self.table = table
+        self.topology = topology
+
+    @property
+    def changed_rows(self):
+        return self.table.changed_rows
+
+    @property
+    def axle_count_changed_rows(self):
+        return self.table.axle_count_changed_rows
+
+    def axle_count_changed(self, section_id):
+        '''torpedo_axle_count of section_id changed in the last snapshot'''
+        return self.table.row_of(section_id) in self.table.axle_count_changed_rows
+
+    def affected_rows(self, rows):
+        '''rows, their neighbours and the rows having one of them as neighbour'''
+        affected = set(rows)
+        for row in rows:
+            affected.update(self.topology.neighbours(row))
+            affected.update(self.topology.dependents(row))
+        return affected
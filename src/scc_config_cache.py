@@ -0,0 +1,306 @@
+'''
+*****************************************************************************
+*File : scc_config_cache.py
+*Module : SCC
+*Purpose : Immutable yard configuration snapshot (yard_config, layout_section_connections, pms_config)
+*          with background reload on MQTT admin command or postgres NOTIFY
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import time
+import select
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+except ImportError:
+    psycopg2 = None
+
+sys.path.insert(1, "./common")
+from scc_log import *
+from scc_db_manager import *
+from scc_dlm_model import *
+from scc_layout_model import *
+
+DEFAULT_RELOAD_DEBOUNCE = 1
+DEFAULT_NOTIFY_CHANNEL = "scc_yard_config"
+DEFAULT_NOTIFY_RETRY_INTERVAL = 5
+NOTIFY_POLL_INTERVAL = 1
+
+'''admin topic, any message reloads yard configuration'''
+YARD_CONFIG_RELOAD_TOPIC = "cwsm/yard_config_reload"
+
+'''tables of the snapshot, a change of any of them triggers NOTIFY when triggers are installed'''
+YARD_CONFIG_TABLES = ["yard_config", "layout_section_connections", "pms_config"]
+
+YardConfigRecord = namedtuple("YardConfigRecord", [
+    "yard_id", "yard_name", "dpu_id", "dpu_name", "section_id", "section_name", "dp_id"])
+SectionConnectionsRecord = namedtuple("SectionConnectionsRecord", [
+    "section_id", "left_normal", "right_normal", "left_reverse", "right_reverse"])
+PointConfigRecord = namedtuple("PointConfigRecord", ["section_id", "point_id"])
+
+
+class YardConfigSnapshot:
+    '''yard configuration tables at one point in time, never modified after construction.
+
+    Records are namedtuples with the attribute names of the peewee rows, so the yard
+    topology and registries are built from a snapshot exactly as from a select().
+    '''
+    __slots__ = ("version", "loaded_ts", "yard_config", "section_connections", "point_config", "section_idx")
+
+    def __init__(self, version, yard_config, section_connections, point_config):
+        self.version = version
+        self.loaded_ts = time.time()
+        self.yard_config = tuple(yard_config)
+        self.section_connections = tuple(section_connections)
+        self.point_config = tuple(point_config)
+        self.section_idx = MappingProxyType({record.section_id: record for record in self.yard_config})
+
+    def get_section(self, section_id):
+        '''yard_config record of section_id, None when unknown'''
+        return self.section_idx.get(section_id)
+
+    def get_dpu_id(self, section_id):
+        record = self.section_idx.get(section_id)
+        return record.dpu_id if record is not None else None
+
+    def get_stats(self):
+        return {"version": self.version,
+                "loaded_ts": self.loaded_ts,
+                "yard_config": len(self.yard_config),
+                "section_connections": len(self.section_connections),
+                "point_config": len(self.point_config)}
+
+
+def read_yard_config_snapshot(version):
+    '''read the three configuration tables into a new snapshot'''
+    yard_config = [YardConfigRecord(record.yard_id, record.yard_name, record.dpu_id, record.dpu_name,
+                                    record.section_id, record.section_name,
+                                    tuple(record.dp_id) if record.dp_id is not None else None)
+                   for record in YardConfigInfo.select()]
+    section_connections = [SectionConnectionsRecord(record.section_id, record.left_normal, record.right_normal,
+                                                    record.left_reverse, record.right_reverse)
+                           for record in LayoutSectionConnectionsInfo.select()]
+    try:
+        point_config = [PointConfigRecord(record.section_id, record.point_id) for record in PointConfig.select()]
+    except Exception as ex:
+        Log.logger.critical(f'scc_config_cache: read pms_config: exception: {ex}')
+        point_config = []
+    return YardConfigSnapshot(version, yard_config, section_connections, point_config)
+
+
+class YardConfigCache(threading.Thread):
+    '''Current YardConfigSnapshot of the process.
+
+    Readers take self.snapshot (one attribute read, no lock) and keep using the
+    snapshot they got. A reload, requested by the admin MQTT topic or by a postgres
+    NOTIFY on the configuration tables, builds a new snapshot on this thread and
+    replaces the reference; a snapshot with an empty yard_config or
+    layout_section_connections table is rejected and the current one is kept.
+    Consumers compare snapshot.version with the version they applied last.
+
+    cache_cfg:
+        {"RELOAD_DEBOUNCE": 1, "NOTIFY_ENABLE": true, "NOTIFY_CHANNEL": "scc_yard_config",
+         "CREATE_TRIGGERS": true, "NOTIFY_RETRY_INTERVAL": 5}
+    '''
+
+    def __init__(self, read_snapshot=read_yard_config_snapshot):
+        threading.Thread.__init__(self, name="scc-yard-config-cache", daemon=True)
+        self.read_snapshot = read_snapshot
+        self.snapshot = None
+        '''serialises loads, readers never take it'''
+        self.load_lock = threading.Lock()
+        self.reload_event = threading.Event()
+        self.quit_event = threading.Event()
+        self.reload_debounce = DEFAULT_RELOAD_DEBOUNCE
+        self.notify_listener = None
+
+        '''statistics'''
+        self.reload_count = 0
+        self.reload_request_count = 0
+        self.rejected_count = 0
+        self.error_count = 0
+
+    def configure(self, cache_cfg=None):
+        if cache_cfg is None:
+            cache_cfg = {}
+        self.reload_debounce = cache_cfg.get("RELOAD_DEBOUNCE", DEFAULT_RELOAD_DEBOUNCE)
+        if cache_cfg.get("NOTIFY_ENABLE", False):
+            channel = cache_cfg.get("NOTIFY_CHANNEL", DEFAULT_NOTIFY_CHANNEL)
+            if cache_cfg.get("CREATE_TRIGGERS", False):
+                create_notify_triggers(channel)
+            self.notify_listener = ConfigNotifyListener(
+                self, channel, cache_cfg.get("NOTIFY_RETRY_INTERVAL", DEFAULT_NOTIFY_RETRY_INTERVAL))
+
+    def get_snapshot(self):
+        '''current snapshot, loaded synchronously on first use'''
+        snapshot = self.snapshot
+        if snapshot is None:
+            self.load(first_load=True)
+            snapshot = self.snapshot
+        return snapshot
+
+    def load(self, first_load=False):
+        '''build a new snapshot and swap it in, True when swapped'''
+        with self.load_lock:
+            if first_load and self.snapshot is not None:
+                return False
+            try:
+                version = self.snapshot.version + 1 if self.snapshot is not None else 1
+                snapshot = self.read_snapshot(version)
+                if len(snapshot.yard_config) == 0 or len(snapshot.section_connections) == 0:
+                    self.rejected_count += 1
+                    Log.logger.warning(f'scc_config_cache: yard configuration rejected, empty table: '
+                                       f'{snapshot.get_stats()}')
+                    if self.snapshot is None:
+                        '''first load, an empty configuration is still the configuration'''
+                        self.snapshot = snapshot
+                    return False
+                self.snapshot = snapshot
+                self.reload_count += 1
+                Log.logger.info(f'scc_config_cache: yard configuration loaded: {snapshot.get_stats()}')
+                return True
+            except Exception as ex:
+                self.error_count += 1
+                Log.logger.critical(f'scc_config_cache: load: exception: {ex}')
+                return False
+
+    def request_reload(self, reason):
+        '''reload on the cache thread, requests within the debounce interval are merged'''
+        self.reload_request_count += 1
+        Log.logger.info(f'scc_config_cache: reload requested: {reason}')
+        self.reload_event.set()
+
+    def reload_sub_fn(self, in_client, user_data, message):
+        '''cwsm/yard_config_reload subscribe function'''
+        try:
+            self.request_reload(f'{YARD_CONFIG_RELOAD_TOPIC} {message.payload}')
+        except Exception as ex:
+            Log.logger.critical(f'scc_config_cache: reload_sub_fn: exception: {ex}')
+
+    def start(self):
+        threading.Thread.start(self)
+        if self.notify_listener is not None:
+            self.notify_listener.start()
+
+    def run(self):
+        Log.logger.info(f'scc_config_cache: yard config cache started')
+        while True:
+            self.reload_event.wait()
+            if self.quit_event.wait(self.reload_debounce):
+                break
+            self.reload_event.clear()
+            self.load()
+            '''return the connection to the pool between reloads'''
+            db_manager.release()
+        Log.logger.info(f'scc_config_cache: yard config cache stopped, {self.get_stats()}')
+
+    def stop(self):
+        self.quit_event.set()
+        self.reload_event.set()
+        if self.notify_listener is not None:
+            self.notify_listener.stop()
+
+    def get_stats(self):
+        snapshot = self.snapshot
+        return {"version": snapshot.version if snapshot is not None else 0,
+                "reloads": self.reload_count,
+                "reload_requests": self.reload_request_count,
+                "rejected": self.rejected_count,
+                "errors": self.error_count,
+                "notifications": self.notify_listener.notify_count if self.notify_listener is not None else 0}
+
+
+def create_notify_triggers(channel):
+    '''statement triggers on the configuration tables sending NOTIFY channel, table name'''
+    try:
+        database = db_manager.database
+        if database is None:
+            return False
+        database.execute_sql(
+            "CREATE OR REPLACE FUNCTION scc_notify_yard_config() RETURNS trigger AS $$ "
+            "BEGIN PERFORM pg_notify('" + channel + "', TG_TABLE_NAME); RETURN NULL; END; "
+            "$$ LANGUAGE plpgsql")
+        for table_name in YARD_CONFIG_TABLES:
+            database.execute_sql(f'DROP TRIGGER IF EXISTS scc_yard_config_changed ON {table_name}')
+            database.execute_sql(
+                f'CREATE TRIGGER scc_yard_config_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE '
+                f'ON {table_name} FOR EACH STATEMENT EXECUTE PROCEDURE scc_notify_yard_config()')
+        Log.logger.info(f'scc_config_cache: notify triggers created on {YARD_CONFIG_TABLES}, channel: {channel}')
+        return True
+    except Exception as ex:
+        Log.logger.critical(f'scc_config_cache: create_notify_triggers: exception: {ex}')
+        return False
+
+
+class ConfigNotifyListener(threading.Thread):
+    '''LISTEN channel on a dedicated connection (outside the pool), every NOTIFY requests a reload'''
+
+    def __init__(self, cache, channel=DEFAULT_NOTIFY_CHANNEL, retry_interval=DEFAULT_NOTIFY_RETRY_INTERVAL):
+        threading.Thread.__init__(self, name="scc-yard-config-notify", daemon=True)
+        self.cache = cache
+        self.channel = channel
+        self.retry_interval = retry_interval
+        self.quit_event = threading.Event()
+        self.conn = None
+
+        '''statistics'''
+        self.notify_count = 0
+        self.reconnect_count = 0
+
+    def connect(self):
+        database = db_manager.database
+        self.conn = psycopg2.connect(database=database.database, **database.connect_params)
+        self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with self.conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel}')
+        Log.logger.info(f'scc_config_cache: listening on {self.channel}')
+
+    def close(self):
+        try:
+            if self.conn is not None:
+                self.conn.close()
+        except Exception as ex:
+            Log.logger.warning(f'scc_config_cache: notify connection close: {ex}')
+        self.conn = None
+
+    def run(self):
+        if psycopg2 is None or db_manager.database is None:
+            Log.logger.warning(f'scc_config_cache: psycopg2 or database not available, notify listener not started')
+            return
+        while not self.quit_event.is_set():
+            try:
+                if self.conn is None:
+                    self.connect()
+                    '''changes made while not listening are picked up by one reload'''
+                    if self.reconnect_count > 0:
+                        self.cache.request_reload(f'{self.channel} reconnected')
+                if select.select([self.conn], [], [], NOTIFY_POLL_INTERVAL) == ([], [], []):
+                    continue
+                self.conn.poll()
+                tables = set()
+                while self.conn.notifies:
+                    tables.add(self.conn.notifies.pop(0).payload)
+                if len(tables) != 0:
+                    self.notify_count += 1
+                    self.cache.request_reload(f'{self.channel} {sorted(tables)}')
+            except Exception as ex:
+                Log.logger.critical(f'scc_config_cache: notify listener: exception: {ex}')
+                self.close()
+                self.reconnect_count += 1
+                self.quit_event.wait(self.retry_interval)
+        self.close()
+
+    def stop(self):
+        self.quit_event.set()
+
+
+'''yard configuration of the process'''
+yard_config_cache = YardConfigCache()
@@ -0,0 +1,289 @@
+'''
+*****************************************************************************
+*File : scc_copy_ingest.py
+*Module : SCC
+*Purpose : PostgreSQL COPY (binary protocol) bulk ingest with insert_many fallback
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import io
+import json
+import struct
+import time
+
+from peewee import *
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+INGEST_METHOD_COPY = "copy"
+INGEST_METHOD_INSERT_MANY = "insert_many"
+
+'''COPY binary format: signature, flags, header extension length ... rows ... trailer'''
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_BINARY_TRAILER = struct.pack('>h', -1)
+COPY_FIELD_COUNT = struct.Struct('>h')
+COPY_FIELD_NULL = struct.pack('>i', -1)
+COPY_FIELD_LENGTH = struct.Struct('>i')
+COPY_FLOAT8 = struct.Struct('>id')
+COPY_FLOAT4 = struct.Struct('>if')
+COPY_INT4 = struct.Struct('>ii')
+COPY_INT8 = struct.Struct('>iq')
+COPY_BOOL = struct.Struct('>i?')
+JSONB_VERSION = b'\x01'
+
+
+def encode_float8(buf, value):
+    buf.write(COPY_FLOAT8.pack(8, value))
+
+
+def encode_float4(buf, value):
+    buf.write(COPY_FLOAT4.pack(4, value))
+
+
+def encode_int4(buf, value):
+    buf.write(COPY_INT4.pack(4, value))
+
+
+def encode_int8(buf, value):
+    buf.write(COPY_INT8.pack(8, value))
+
+
+def encode_bool(buf, value):
+    buf.write(COPY_BOOL.pack(1, value))
+
+
+def encode_text(buf, value):
+    '''ids of the yard state are int, the column is text'''
+    data = str(value).encode()
+    buf.write(COPY_FIELD_LENGTH.pack(len(data)))
+    buf.write(data)
+
+
+def encode_json(buf, value):
+    encode_text(buf, json.dumps(value))
+
+
+def encode_jsonb(buf, value):
+    data = JSONB_VERSION + json.dumps(value).encode()
+    buf.write(COPY_FIELD_LENGTH.pack(len(data)))
+    buf.write(data)
+
+
+'''peewee field_type -> binary encoder, models with other types always use insert_many'''
+COPY_FIELD_ENCODERS = {
+    "DOUBLE": encode_float8,
+    "FLOAT": encode_float4,
+    "INT": encode_int4,
+    "BIGINT": encode_int8,
+    "BOOL": encode_bool,
+    "VARCHAR": encode_text,
+    "TEXT": encode_text,
+    "JSON": encode_json,
+    "JSONB": encode_jsonb}
+
+
+'''peewee field_type -> decoder of one binary field value, round trip check of the encoders'''
+COPY_FIELD_DECODERS = {
+    "DOUBLE": lambda data: struct.unpack('>d', data)[0],
+    "FLOAT": lambda data: struct.unpack('>f', data)[0],
+    "INT": lambda data: struct.unpack('>i', data)[0],
+    "BIGINT": lambda data: struct.unpack('>q', data)[0],
+    "BOOL": lambda data: struct.unpack('>?', data)[0],
+    "VARCHAR": lambda data: data.decode(),
+    "TEXT": lambda data: data.decode(),
+    "JSON": lambda data: json.loads(data),
+    "JSONB": lambda data: json.loads(data[len(JSONB_VERSION):])}
+
+
+def decode_rows(buf, fields):
+    '''rows of a COPY binary stream of fields, as postgres reads them'''
+    data = buf.getvalue()
+    if not data.startswith(COPY_BINARY_HEADER):
+        raise ValueError("COPY binary header missing")
+    decoders = [COPY_FIELD_DECODERS[field.field_type] for field in fields]
+    offset = len(COPY_BINARY_HEADER)
+    rows = []
+    while True:
+        field_count = COPY_FIELD_COUNT.unpack_from(data, offset)[0]
+        offset += COPY_FIELD_COUNT.size
+        if field_count == -1:
+            break
+        if field_count != len(decoders):
+            raise ValueError(f'COPY row has {field_count} fields, expected {len(decoders)}')
+        row = []
+        for decoder in decoders:
+            length = COPY_FIELD_LENGTH.unpack_from(data, offset)[0]
+            offset += COPY_FIELD_LENGTH.size
+            if length == -1:
+                row.append(None)
+            else:
+                row.append(decoder(data[offset:offset + length]))
+                offset += length
+        rows.append(tuple(row))
+    return rows
+
+
+class CopyIngest:
+    '''Write rows with COPY ... FROM STDIN (FORMAT binary) from one reusable in-memory buffer.
+
+    Every COPY runs in a savepoint, on any error (no psycopg2 connection, value not matching
+    the column type) the rows are written with insert_many instead, and after
+    max_copy_errors failures of a table COPY is no longer tried for it.
+    '''
+
+    def __init__(self, method=INGEST_METHOD_COPY, max_copy_errors=3):
+        self.method = method
+        self.max_copy_errors = max_copy_errors
+        self.buffer = io.BytesIO()
+        self.copy_plans = {}
+        self.copy_errors = {}
+
+        '''statistics'''
+        self.copy_rows = 0
+        self.copy_count = 0
+        self.fallback_rows = 0
+        self.fallback_count = 0
+
+    def get_copy_plan(self, model, fields):
+        '''(COPY statement, encoder list) for model/fields, None if a field type has no encoder'''
+        key = (model, tuple(fields))
+        if key in self.copy_plans:
+            return self.copy_plans[key]
+        plan = None
+        encoders = []
+        for field in fields:
+            encoder = COPY_FIELD_ENCODERS.get(field.field_type)
+            if encoder is None:
+                break
+            encoders.append(encoder)
+        else:
+            columns = ', '.join(f'"{field.column_name}"' for field in fields)
+            sql = f'COPY "{model._meta.table_name}" ({columns}) FROM STDIN WITH (FORMAT binary)'
+            plan = (sql, encoders)
+        self.copy_plans[key] = plan
+        return plan
+
+    def encode_rows(self, encoders, rows):
+        '''fill the reusable buffer with the COPY binary stream of rows'''
+        buf = self.buffer
+        buf.seek(0)
+        buf.truncate()
+        buf.write(COPY_BINARY_HEADER)
+        field_count = COPY_FIELD_COUNT.pack(len(encoders))
+        for row in rows:
+            buf.write(field_count)
+            for encoder, value in zip(encoders, row):
+                if value is None:
+                    buf.write(COPY_FIELD_NULL)
+                else:
+                    encoder(buf, value)
+        buf.write(COPY_BINARY_TRAILER)
+        buf.seek(0)
+        return buf
+
+    def copy(self, model, fields, rows):
+        '''COPY rows into model table, False when COPY is not possible and nothing was written'''
+        if self.method != INGEST_METHOD_COPY or self.copy_errors.get(model, 0) >= self.max_copy_errors:
+            return False
+        plan = self.get_copy_plan(model, fields)
+        if plan is None:
+            return False
+        sql, encoders = plan
+        try:
+            buf = self.encode_rows(encoders, rows)
+            database = model._meta.database
+            with database.atomic():
+                cursor = database.cursor()
+                cursor.copy_expert(sql, buf)
+        except Exception as ex:
+            self.copy_errors[model] = self.copy_errors.get(model, 0) + 1
+            Log.logger.error(f'scc_copy_ingest: COPY into {model._meta.table_name} failed '
+                             f'({self.copy_errors[model]}/{self.max_copy_errors}), using insert_many: {ex}')
+            return False
+        self.copy_count += 1
+        self.copy_rows += len(rows)
+        return True
+
+    def write(self, model, fields, rows):
+        '''write rows with COPY, fall back to insert_many'''
+        if len(rows) == 0:
+            return
+        if not self.copy(model, fields, rows):
+            model.insert_many(rows, fields=fields).execute()
+            self.fallback_count += 1
+            self.fallback_rows += len(rows)
+
+    def get_stats(self):
+        return {"method": self.method,
+                "copy_count": self.copy_count,
+                "copy_rows": self.copy_rows,
+                "fallback_count": self.fallback_count,
+                "fallback_rows": self.fallback_rows,
+                "copy_errors": {model._meta.table_name: count for model, count in self.copy_errors.items()}}
+
+
+def benchmark(model, fields, rows, iterations=10):
+    '''rows per second of insert_many and COPY, every run is rolled back'''
+    database = model._meta.database
+    results = {}
+    for method in [INGEST_METHOD_INSERT_MANY, INGEST_METHOD_COPY]:
+        copy_ingest = CopyIngest(method)
+        ts_total = 0.0
+        for i in range(iterations):
+            with database.atomic() as txn:
+                ts_start = time.perf_counter()
+                copy_ingest.write(model, fields, rows)
+                ts_total += time.perf_counter() - ts_start
+                txn.rollback()
+        results[method] = len(rows) * iterations / ts_total
+        Log.logger.info(f'{method:12} table: {model._meta.table_name} rows: {len(rows)} x {iterations} '
+                        f'{results[method]:10.0f} rows/s {copy_ingest.get_stats()}')
+    return results
+
+
+if __name__ == '__main__':
+    if Log.logger is None:
+        my_log = Log()
+
+    from scc_dlm_model import *
+    from scc_dlm_api import SccAPI, SECTION_INFO_FIELDS, TRAIN_TRACE_INFO_FIELDS
+    from scc_section_snapshot import SectionSnapshot
+
+    '''section rows as written for sem/section_info'''
+    ts = time.time()
+    section_rows = []
+    for msg_idx in range(100):
+        for section_idx in range(14):
+            section_rows.append((ts + msg_idx, "S" + str(section_idx + 1), "occupied", 4, 16,
+                                 "in", 12.5, "loaded", "torpedo"))
+
+    ts_start = time.perf_counter()
+    copy_ingest = CopyIngest()
+    for i in range(100):
+        copy_ingest.encode_rows(copy_ingest.get_copy_plan(SectionInfo, SECTION_INFO_FIELDS)[1], section_rows)
+    Log.logger.info(f'COPY binary encode: {len(section_rows) * 100 / (time.perf_counter() - ts_start):.0f} rows/s')
+
+    '''round trip of train_trace rows as built by SccAPI, torpedo_id / engine_id of the yard state are int'''
+    snapshot = SectionSnapshot.from_payload(json.dumps({"ts": ts, "sections": [
+        {"section_id": "S1", "section_status": "occupied", "engine_axle_count": 4, "torpedo_axle_count": 16,
+         "direction": "in", "speed": 12.5, "torpedo_status": "loaded", "first_axle": "torpedo"}]}))
+    train_trace_rows = [SccAPI().new_train_trace_row(ts, snapshot.get("S1"), 3, 1),
+                        SccAPI().new_train_trace_row(ts, snapshot.get("S1"), None, None)]
+    buf = copy_ingest.encode_rows(copy_ingest.get_copy_plan(TrainTraceInfo, TRAIN_TRACE_INFO_FIELDS)[1],
+                                  train_trace_rows)
+    decoded_rows = decode_rows(buf, TRAIN_TRACE_INFO_FIELDS)
+    expected_rows = [tuple(field.db_value(value) for field, value in zip(TRAIN_TRACE_INFO_FIELDS, row))
+                     for row in train_trace_rows]
+    if decoded_rows != expected_rows:
+        Log.logger.critical(f'COPY binary round trip failed: {decoded_rows} != {expected_rows}')
+        sys.exit(1)
+    Log.logger.info(f'COPY binary round trip of train_trace rows: ok')
+
+    if db_manager.connect():
+        benchmark(SectionInfo, SECTION_INFO_FIELDS, section_rows)
+    sys.exit(0)
@@ -0,0 +1,219 @@
+'''
+*****************************************************************************
+*File : scc_db_manager.py
+*Module : SCC
+*Purpose : Process wide pooled postgresql database shared by all SCC modules
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+from peewee import *
+from playhouse.pool import MaxConnectionsExceeded
+try:
+    from playhouse.pool import PooledPostgresqlExtDatabase
+except ImportError:
+    from playhouse.postgres_ext import PooledPostgresqlExtDatabase
+
+sys.path.insert(1, "./common")
+from scc_log import *
+from scc_dlm_conf import *
+
+DEFAULT_DB_PORT = 5432
+DEFAULT_POOL_MAX_CONNECTIONS = 16
+'''idle connections older than this are closed on checkout/checkin'''
+DEFAULT_POOL_STALE_TIMEOUT = 300
+'''seconds a checkout waits for a free connection when the pool is full'''
+DEFAULT_POOL_WAIT_TIMEOUT = 10
+STATS_LOG_INTERVAL = 60
+
+'''all SCC models use this proxy, SccDbManager initialises it with the pooled database'''
+scc_db = DatabaseProxy()
+
+
+class SccPooledPostgresqlDatabase(PooledPostgresqlExtDatabase):
+    '''pooled postgresql database (ext: server side cursors) with checkout statistics.
+
+    Connections are thread local (peewee default), every thread checks out its own
+    connection from the shared pool on first query and returns it on close().
+    '''
+
+    def __init__(self, database, **kwargs):
+        super(SccPooledPostgresqlDatabase, self).__init__(database, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.wait_state = threading.local()
+        self.checkout_count = 0
+        self.total_checkout_latency = 0.0
+        self.max_checkout_latency = 0.0
+        self.wait_count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeout_count = 0
+        self.max_in_use = 0
+        self.last_stats_ts = time.time()
+
+    def connect(self, reuse_if_open=False):
+        ts_start = time.time()
+        self.wait_state.first_exceeded_ts = None
+        try:
+            result = super(SccPooledPostgresqlDatabase, self).connect(reuse_if_open)
+        except MaxConnectionsExceeded:
+            with self.stats_lock:
+                self.timeout_count += 1
+            raise
+        ts_end = time.time()
+
+        with self.stats_lock:
+            latency = ts_end - ts_start
+            self.checkout_count += 1
+            self.total_checkout_latency += latency
+            if latency > self.max_checkout_latency:
+                self.max_checkout_latency = latency
+            if self.wait_state.first_exceeded_ts is not None:
+                wait = ts_end - self.wait_state.first_exceeded_ts
+                self.wait_count += 1
+                self.total_wait += wait
+                if wait > self.max_wait:
+                    self.max_wait = wait
+            log_stats = ts_end - self.last_stats_ts >= STATS_LOG_INTERVAL
+            if log_stats:
+                self.last_stats_ts = ts_end
+        if log_stats:
+            Log.logger.info(f'scc_db_manager: pool stats: {self.get_pool_stats()}')
+        return result
+
+    def _connect(self):
+        try:
+            conn = super(SccPooledPostgresqlDatabase, self)._connect()
+        except MaxConnectionsExceeded:
+            '''pool full, connect() waits for a connection to be returned'''
+            if self.wait_state.first_exceeded_ts is None:
+                self.wait_state.first_exceeded_ts = time.time()
+            raise
+        with self.stats_lock:
+            if len(self._in_use) > self.max_in_use:
+                self.max_in_use = len(self._in_use)
+        return conn
+
+    def get_pool_stats(self):
+        with self._pool_lock:
+            in_use = len(self._in_use)
+            idle = len(self._connections)
+        with self.stats_lock:
+            checkouts = self.checkout_count if self.checkout_count > 0 else 1
+            waits = self.wait_count if self.wait_count > 0 else 1
+            stats = {"max_connections": self._max_connections,
+                     "in_use": in_use,
+                     "idle": idle,
+                     "max_in_use": self.max_in_use,
+                     "checkouts": self.checkout_count,
+                     "avg_checkout_latency": self.total_checkout_latency / checkouts,
+                     "max_checkout_latency": self.max_checkout_latency,
+                     "waits": self.wait_count,
+                     "avg_wait": self.total_wait / waits,
+                     "max_wait": self.max_wait,
+                     "wait_timeouts": self.timeout_count}
+        if self._max_connections:
+            stats["utilisation"] = in_use / self._max_connections
+        return stats
+
+
+class SccDbManager:
+    '''one pooled database per process, configured from SccDlmConfRead (DATABASE and DB_POOL sections)'''
+
+    def __init__(self):
+        self.database = None
+        self.lock = threading.Lock()
+
+    def init_database(self, config):
+        '''create the pooled database on first call, later calls return the same database'''
+        with self.lock:
+            if self.database is not None:
+                return self.database
+            try:
+                db_cfg = config.json_data["DATABASE"]
+                pool_cfg = config.db_pool
+                if len(db_cfg["DB_NAME"]) == 0:
+                    Log.logger.critical("scc_db_manager: init_database: database name missing")
+                    return None
+                self.database = SccPooledPostgresqlDatabase(
+                    db_cfg["DB_NAME"],
+                    user=db_cfg["USER"],
+                    password=db_cfg["PASSWORD"],
+                    host=db_cfg["HOST"],
+                    port=db_cfg.get("PORT", DEFAULT_DB_PORT),
+                    max_connections=pool_cfg.get("MAX_CONNECTIONS", DEFAULT_POOL_MAX_CONNECTIONS),
+                    stale_timeout=pool_cfg.get("STALE_TIMEOUT", DEFAULT_POOL_STALE_TIMEOUT),
+                    timeout=pool_cfg.get("WAIT_TIMEOUT", DEFAULT_POOL_WAIT_TIMEOUT))
+                scc_db.initialize(self.database)
+                Log.logger.info(f'scc_db_manager: pooled database {db_cfg["DB_NAME"]} initialised, '
+                                f'max connections: {self.database._max_connections}')
+            except Exception as ex:
+                Log.logger.critical(f'scc_db_manager: init_database: exception: {ex}')
+            return self.database
+
+    def connect(self):
+        '''check out a connection for the calling thread, True on success'''
+        try:
+            if self.database is None:
+                return False
+            self.database.connect(reuse_if_open=True)
+            return True
+        except Exception as ex:
+            Log.logger.critical(f'scc_db_manager: connect: exception: {ex}')
+            return False
+
+    def release(self):
+        '''return the calling thread's connection to the pool'''
+        try:
+            if self.database is not None and not self.database.is_closed():
+                self.database.close()
+        except Exception as ex:
+            Log.logger.critical(f'scc_db_manager: release: exception: {ex}')
+
+    @contextmanager
+    def checkout(self):
+        '''connection for one unit of work, returned to the pool at the end unless the thread already held one'''
+        opened = self.database is not None and self.database.is_closed()
+        try:
+            yield self.database
+        finally:
+            if opened:
+                self.release()
+
+    def close_idle(self):
+        if self.database is not None:
+            self.database.close_idle()
+
+    def get_stats(self):
+        if self.database is None:
+            return {}
+        return self.database.get_pool_stats()
+
+
+db_manager = SccDbManager()
+
+
+def init_db_manager(config=None):
+    '''initialise the process wide database, reads ../config/scc.conf when config is not given'''
+    if config is None:
+        config = SccDlmConfRead()
+        config.read_cfg('../config/scc.conf')
+    return db_manager.init_database(config)
+
+
+if __name__ == '__main__':
+    if Log.logger is None:
+        my_log = Log()
+
+    database = init_db_manager()
+    if db_manager.connect():
+        database.execute_sql('SELECT 1')
+        db_manager.release()
+    Log.logger.info(f'pool stats: {db_manager.get_stats()}')
@@ -15,10 +15,23 @@ from scc_dlm_conf import *
 from scc_log import *
 import sys
 import json
+import time
+import threading
 from peewee import *
 from datetime import datetime, timedelta
 from scc_dlm_model import *
 from scc_layout_model import *
+from scc_section_snapshot import *
+from scc_copy_ingest import *
+from scc_async_ingest import *
+from scc_trip_cache import *
+from scc_journal import *
+from scc_playback import *
+from scc_rollup import *
+from scc_yard_state import *
+from scc_topology import *
+from scc_role_cache import *
+from scc_config_cache import *
 sys.path.insert(1, "./common")
 
 
@@ -38,6 +51,53 @@ MIDDLE_SECTION_LIST = [
     "S10",
     "S11"]
 
+SECTION_INFO_FIELDS = [
+    SectionInfo.ts,
+    SectionInfo.section_id,
+    SectionInfo.section_status,
+    SectionInfo.engine_axle_count,
+    SectionInfo.torpedo_axle_count,
+    SectionInfo.direction,
+    SectionInfo.speed,
+    SectionInfo.torpedo_status,
+    SectionInfo.first_axle]
+
+SECTION_PLAYBACK_INFO_FIELDS = [
+    SectionPlaybackInfo.ts,
+    SectionPlaybackInfo.sections]
+
+TRAIN_TRACE_INFO_FIELDS = [
+    TrainTraceInfo.ts,
+    TrainTraceInfo.section_id,
+    TrainTraceInfo.section_status,
+    TrainTraceInfo.torpedo_axle_count,
+    TrainTraceInfo.engine_axle_count,
+    TrainTraceInfo.direction,
+    TrainTraceInfo.speed,
+    TrainTraceInfo.torpedo_status,
+    TrainTraceInfo.first_axle,
+    TrainTraceInfo.torpedo_id,
+    TrainTraceInfo.engine_id]
+
+DP_INFO_FIELDS = [
+    DpInfo.ts,
+    DpInfo.dpu_id,
+    DpInfo.dp_id,
+    DpInfo.axle_count,
+    DpInfo.axle_type,
+    DpInfo.direction,
+    DpInfo.speed]
+
+DEFAULT_WRITER_BATCH_SIZE = 500
+DEFAULT_WRITER_FLUSH_INTERVAL = 0.5
+DEFAULT_WRITER_MAX_PENDING_ROWS = 100000
+DEFAULT_JOURNAL_RETRY_INTERVAL = 1.0
+DEFAULT_JOURNAL_MAX_RETRY_INTERVAL = 30.0
+
+'''tables written through the db writer, journal records refer to them by table name'''
+JOURNAL_MODELS = {model._meta.table_name: model for model in
+                  [SectionInfo, SectionPlaybackInfo, SectionPlaybackDelta, TrainTraceInfo, DpInfo]}
+
 
 class TrainEntryExitTrace():
     def __init__(self):
@@ -54,85 +114,479 @@ class TrainEntryExitTrace():
         self.engine_id = 0
 
 
-class SectionConnections:
-    def __init__(self):
-        self.section_id = "none"
-        self.left_normal = "none"
-        self.right_normal = "none"
-        self.left_reverse = "none"
-        self.right_reverse = "none"
-        self.torpedo_id = 0
-        self.engine_id = 0
-        self.in_torpedo_axle_count = 0
-        self.out_torpedo_axle_count = 0
-        self.entry_time = 0
-        self.exit_time = 0
-        self.torpedo_detected = False
-        self.unloaded_entry_time = 0
-        self.unloaded_exit_time = 0
-        self.in_axles = 0
-        self.out_axles = 0
-
-
-class Torpedo:
-    def __init__(self):
-        self.section_id = "none"
-        self.torpedo_id = 0
-        self.engine_id = 0
-        self.unloaded_entry_time = 0
-        self.unloaded_exit_time = 0
-        self.entry_time = 0
-        self.exit_time = 0
-        self.in_torpedo_axle_count = 0
-        self.out_torpedo_axle_count = 0
-        self.in_axles = 0
-        self.out_axles = 0
-        self.torpedo_detected = False
+class SectionConnections(YardStateView):
+    '''entry/exit tracking of a section, row of the shared yard state table'''
+    left_normal = StateField("left_normal")
+    right_normal = StateField("right_normal")
+    left_reverse = StateField("left_reverse")
+    right_reverse = StateField("right_reverse")
+    torpedo_id = StateField("torpedo_id")
+    engine_id = StateField("engine_id")
+    in_torpedo_axle_count = StateField("in_torpedo_axle_count")
+    out_torpedo_axle_count = StateField("out_torpedo_axle_count")
+    entry_time = StateField("entry_time")
+    exit_time = StateField("exit_time")
+    torpedo_detected = BoolStateField("torpedo_detected")
+    unloaded_entry_time = StateField("unloaded_entry_time")
+    unloaded_exit_time = StateField("unloaded_exit_time")
+    in_axles = StateField("in_axles")
+    out_axles = StateField("out_axles")
+
+
+class Torpedo(YardStateView):
+    '''unloading tracking of a section, own columns, yard_performance tracks the same fields separately'''
+    torpedo_id = StateField("unload_torpedo_id")
+    engine_id = StateField("unload_engine_id")
+    unloaded_entry_time = StateField("unload_entry_time")
+    unloaded_exit_time = StateField("unload_exit_time")
+    in_torpedo_axle_count = StateField("unload_in_torpedo_axle_count")
+    out_torpedo_axle_count = StateField("unload_out_torpedo_axle_count")
+
+
+class SccDbWriter(threading.Thread):
+    '''Background writer, collects rows of many messages and commits them in one transaction.
+
+    With a journal every submit is appended to it first and the journal checkpoint follows
+    the committed batches. When a flush fails (database down) or the backlog is full the
+    writer switches to replay: submit only appends to the journal and the writer drains the
+    journal into the database, retrying with backoff, until it has caught up. Rows are
+    written at least once, a crash between commit and checkpoint replays the last batch.
+    Only connection errors are retried; a batch failing with a data error is written
+    table by table and row by row, rows still failing are quarantined (logged, dropped).
+    '''
+
+    def __init__(self, batch_size=DEFAULT_WRITER_BATCH_SIZE, flush_interval=DEFAULT_WRITER_FLUSH_INTERVAL,
+                 max_pending_rows=DEFAULT_WRITER_MAX_PENDING_ROWS, copy_ingest=None, journal=None,
+                 retry_interval=DEFAULT_JOURNAL_RETRY_INTERVAL, max_retry_interval=DEFAULT_JOURNAL_MAX_RETRY_INTERVAL):
+        threading.Thread.__init__(self, name="scc-db-writer", daemon=True)
+        self.copy_ingest = copy_ingest if copy_ingest is not None else CopyIngest()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending_rows = max_pending_rows
+        self.journal = journal
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.cond = threading.Condition()
+        self.pending = []
+        self.pending_rows = 0
+        self.pending_position = None
+        self.thread_quit = False
+        '''rows left in the journal from the last run are replayed first'''
+        self.replaying = journal is not None and journal.is_replay_pending()
+        self.retry_delay = retry_interval
+
+        '''statistics'''
+        self.submitted_rows = 0
+        self.written_rows = 0
+        self.dropped_rows = 0
+        self.failed_rows = 0
+        self.quarantined_rows = 0
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.replayed_rows = 0
+        self.replay_count = 0
+        self.journal_errors = 0
+
+    def submit(self, model, fields, rows):
+        '''queue rows for model, never blocks on the database'''
+        if len(rows) == 0:
+            return True
+        with self.cond:
+            if self.journal is not None:
+                return self.submit_journal(model, fields, rows)
+            if self.pending_rows + len(rows) > self.max_pending_rows:
+                self.dropped_rows += len(rows)
+                Log.logger.critical(
+                    f'scc_dlm_api: db writer backlog full, dropped {len(rows)} {model._meta.table_name} rows')
+                return False
+            self.pending.append((model, fields, rows))
+            self.pending_rows += len(rows)
+            self.submitted_rows += len(rows)
+            if self.pending_rows >= self.batch_size:
+                self.cond.notify()
+            return True
+
+    def submit_journal(self, model, fields, rows):
+        '''append rows to the journal, keep them in memory too unless replaying, called with cond held'''
+        try:
+            position = self.journal.append(model._meta.table_name, [field.name for field in fields], rows)
+        except Exception as ex:
+            self.journal_errors += 1
+            self.dropped_rows += len(rows)
+            Log.logger.critical(f'scc_dlm_api: journal append of {len(rows)} {model._meta.table_name} rows failed: {ex}')
+            return False
+        self.submitted_rows += len(rows)
+        if self.replaying:
+            return True
+        if self.pending_rows + len(rows) > self.max_pending_rows:
+            Log.logger.warning(f'scc_dlm_api: db writer backlog full, replaying from journal')
+            self.start_replay()
+            return True
+        self.pending.append((model, fields, rows))
+        self.pending_rows += len(rows)
+        self.pending_position = position
+        if self.pending_rows >= self.batch_size:
+            self.cond.notify()
+        return True
+
+    def start_replay(self):
+        '''drop in-memory rows, they are read back from the journal checkpoint, called with cond held'''
+        self.replaying = True
+        self.pending = []
+        self.pending_rows = 0
+        self.pending_position = None
+        self.journal.rewind()
+
+    def run(self):
+        Log.logger.info(
+            f'scc_dlm_api: db writer started, batch size: {self.batch_size}, flush interval: {self.flush_interval}, '
+            f'journal: {self.journal is not None}, replaying: {self.replaying}')
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending_rows >= self.batch_size or self.thread_quit,
+                                   self.flush_interval)
+                replaying = self.replaying
+                batch = self.pending
+                batch_rows = self.pending_rows
+                batch_position = self.pending_position
+                self.pending = []
+                self.pending_rows = 0
+                self.pending_position = None
+                quit_flag = self.thread_quit
+            if replaying:
+                if not quit_flag:
+                    self.replay()
+            elif batch_rows > 0:
+                if self.flush(batch, batch_rows):
+                    if batch_position is not None:
+                        self.journal.commit(batch_position)
+                elif self.journal is not None:
+                    with self.cond:
+                        if not self.replaying:
+                            self.start_replay()
+            if replaying or batch_rows > 0:
+                '''return the connection to the pool between batches'''
+                db_manager.release()
+            if quit_flag:
+                break
+        if self.journal is not None:
+            self.journal.close()
+        Log.logger.info(f'scc_dlm_api: db writer stopped, {self.get_stats()}')
+
+    def replay(self):
+        '''drain the journal into the database until it has caught up with submit'''
+        Log.logger.warning(f'scc_dlm_api: db writer replaying journal from {self.journal.get_stats()["checkpoint"]}')
+        while not self.thread_quit:
+            records, position, row_count = self.journal.read_batch(self.batch_size)
+            if row_count == 0:
+                with self.cond:
+                    if not self.journal.is_replay_pending():
+                        self.replaying = False
+                        self.retry_delay = self.retry_interval
+                        Log.logger.info(f'scc_dlm_api: db writer journal replay done, {self.replayed_rows} rows replayed')
+                        return
+                    '''nothing readable yet (record being written or unreadable), do not spin'''
+                    if self.cond.wait_for(lambda: self.thread_quit, self.retry_delay):
+                        return
+                continue
+
+            batch = []
+            for table_name, field_names, rows in records:
+                model = JOURNAL_MODELS.get(table_name)
+                if model is None:
+                    Log.logger.critical(f'scc_dlm_api: journal record for unknown table {table_name} skipped')
+                    continue
+                batch.append((model, [model._meta.fields[name] for name in field_names], rows))
+            if len(batch) == 0 or self.flush(batch, row_count):
+                self.journal.commit(position)
+                self.replayed_rows += row_count
+                self.replay_count += 1
+                self.retry_delay = self.retry_interval
+                continue
+
+            '''database still down, give the connection back and retry the same rows later'''
+            self.journal.rewind()
+            db_manager.release()
+            with self.cond:
+                if self.cond.wait_for(lambda: self.thread_quit, self.retry_delay):
+                    return
+            self.retry_delay = min(self.retry_delay * 2, self.max_retry_interval)
+
+    def flush(self, batch, batch_rows):
+        '''write one batch in a single transaction, rows are grouped per table, False on connection failure'''
+        result = True
+        ts_start = time.time()
+        try:
+            grouped = {}
+            for model, fields, rows in batch:
+                key = (model, tuple(fields))
+                if key not in grouped:
+                    grouped[key] = []
+                grouped[key].extend(rows)
+
+            database = batch[0][0]._meta.database
+            try:
+                with database.atomic():
+                    for (model, fields), rows in grouped.items():
+                        self.copy_ingest.write(model, list(fields), rows)
+                quarantined_rows = 0
+            except (OperationalError, InterfaceError):
+                raise
+            except Exception as ex:
+                Log.logger.error(f'scc_dlm_api: db writer flush of {batch_rows} rows failed, '
+                                 f'writing table by table: {ex}')
+                quarantined_rows = self.flush_split(grouped)
+            self.written_rows += batch_rows - quarantined_rows
+        except Exception as ex:
+            result = False
+            if self.journal is None:
+                self.failed_rows += batch_rows
+            Log.logger.critical(f'scc_dlm_api: db writer flush of {batch_rows} rows failed: {ex}')
+
+        latency = time.time() - ts_start
+        self.flush_count += 1
+        self.last_flush_latency = latency
+        self.total_flush_latency += latency
+        if latency > self.max_flush_latency:
+            self.max_flush_latency = latency
+        self.last_batch_size = batch_rows
+        if batch_rows > self.max_batch_size:
+            self.max_batch_size = batch_rows
+        return result
+
+    def flush_split(self, grouped):
+        '''write every table in its own transaction, row by row for a failing table,
+        returns the number of quarantined rows, connection errors are raised'''
+        quarantined_rows = 0
+        for (model, fields), rows in grouped.items():
+            database = model._meta.database
+            try:
+                with database.atomic():
+                    model.insert_many(rows, fields=list(fields)).execute()
+                continue
+            except (OperationalError, InterfaceError):
+                raise
+            except Exception as ex:
+                Log.logger.error(f'scc_dlm_api: db writer {len(rows)} {model._meta.table_name} rows failed, '
+                                 f'writing row by row: {ex}')
+            for row in rows:
+                try:
+                    with database.atomic():
+                        model.insert_many([row], fields=list(fields)).execute()
+                except (OperationalError, InterfaceError):
+                    raise
+                except Exception as ex:
+                    quarantined_rows += 1
+                    Log.logger.critical(f'scc_dlm_api: db writer quarantined {model._meta.table_name} row {row}: {ex}')
+        self.quarantined_rows += quarantined_rows
+        return quarantined_rows
+
+    def stop(self):
+        '''flush pending rows and stop the writer thread'''
+        with self.cond:
+            self.thread_quit = True
+            self.cond.notify()
+
+    def get_stats(self):
+        with self.cond:
+            pending_rows = self.pending_rows
+        stats = {"engine": WRITER_ENGINE_THREADED,
+                 "pending_rows": pending_rows,
+                 "submitted_rows": self.submitted_rows,
+                 "written_rows": self.written_rows,
+                 "dropped_rows": self.dropped_rows,
+                 "failed_rows": self.failed_rows,
+                 "quarantined_rows": self.quarantined_rows,
+                 "flush_count": self.flush_count,
+                 "last_flush_latency": self.last_flush_latency,
+                 "max_flush_latency": self.max_flush_latency,
+                 "last_batch_size": self.last_batch_size,
+                 "max_batch_size": self.max_batch_size,
+                 "replaying": self.replaying,
+                 "replayed_rows": self.replayed_rows,
+                 "replay_count": self.replay_count,
+                 "journal_errors": self.journal_errors}
+        if self.flush_count > 0:
+            stats["avg_flush_latency"] = self.total_flush_latency / self.flush_count
+            stats["avg_batch_size"] = self.written_rows / self.flush_count
+        else:
+            stats["avg_flush_latency"] = 0.0
+            stats["avg_batch_size"] = 0.0
+        stats["ingest"] = self.copy_ingest.get_stats()
+        if self.journal is not None:
+            stats["journal"] = self.journal.get_stats()
+        return stats
 
 
 class SccAPI:
     '''OCC DAtabase operations such as Select, Insert, Delete records'''
 
-    def __init__(self):
+    def __init__(self, table=None):
         self.train_trace_obj_list = []
+        '''section_conn_obj_list and torpedo_obj_list are views of the shared yard state table'''
+        self.yard_state = yard_state if table is None else table
+        '''every user of the shared table reads the shared topology, reloaded in place'''
+        self.yard_topology = yard_topology if self.yard_state is yard_state else YardTopology(self.yard_state)
         self.section_conn_obj_list = []
         self.torpedo_obj_list = []
+        '''section_id -> view, yard state row -> SectionConnections for neighbour lookups'''
+        self.section_conn_idx = {}
+        self.section_conn_rows = {}
+        self.torpedo_idx = {}
+        '''version of the yard topology the section views were built from'''
+        self.yard_config_version = 0
         self.entry_torpedo_id = 0
         self.entry_engine_id = 0
         self.torpedo_id = 0
         self.engine_id = 0
         self.last_tt_record_inserted = {
             's3': False, 's4': False, 's7': False, 's8': False, 's11': False}
+        self.db_writer = None
+        self.copy_ingest = CopyIngest()
+        '''a trip is closed by the yard exit / the unloading exit of the torpedo'''
+        self.trip_cache = OpenTripCache({YardPerformanceInfo: YardPerformanceInfo.exit_ts,
+                                         TorpedoPerformanceInfo: TorpedoPerformanceInfo.unload_exit_ts})
+        self.playback_recorder = None
+        self.section_rollup = None
+        self.role_cache = UserRoleCache()
+
+    def configure_role_cache(self, role_cache_cfg=None):
+        '''user roles are cached for TTL seconds, unknown users for NEGATIVE_TTL seconds'''
+        if role_cache_cfg is None:
+            role_cache_cfg = {}
+        self.role_cache = UserRoleCache(
+            role_cache_cfg.get("TTL", DEFAULT_ROLE_CACHE_TTL),
+            role_cache_cfg.get("NEGATIVE_TTL", DEFAULT_ROLE_CACHE_NEGATIVE_TTL),
+            role_cache_cfg.get("MAX_USERS", DEFAULT_ROLE_CACHE_MAX_USERS))
+
+    def configure_playback(self, playback_cfg=None):
+        '''section_playback storage: full section list per message or keyframes plus deltas'''
+        if playback_cfg is None:
+            playback_cfg = {}
+        if playback_cfg.get("MODE", PLAYBACK_MODE_FULL) == PLAYBACK_MODE_KEYFRAME_DELTA:
+            self.playback_recorder = PlaybackRecorder(
+                playback_cfg.get("KEYFRAME_INTERVAL", DEFAULT_PLAYBACK_KEYFRAME_INTERVAL))
+        else:
+            self.playback_recorder = None
+
+    def start_db_writer(self, writer_cfg=None, journal_cfg=None):
+        '''start group-commit writer for section, section_playback and train_trace rows'''
+        try:
+            if writer_cfg is None:
+                writer_cfg = {}
+            if journal_cfg is None:
+                journal_cfg = {}
+            if self.db_writer is None and writer_cfg.get("ENGINE", WRITER_ENGINE_THREADED) == WRITER_ENGINE_ASYNCIO:
+                if journal_cfg.get("ENABLE", False):
+                    '''the asyncio writer has no journal, rows of a failed batch would be lost'''
+                    Log.logger.critical(f'scc_dlm_api: DB_JOURNAL enabled, asyncio db writer has no journal, '
+                                        f'using threaded db writer')
+                elif async_ingest_available():
+                    self.db_writer = AsyncDbWriter(
+                        self.json_data["DATABASE"],
+                        writer_cfg.get("BATCH_SIZE", DEFAULT_WRITER_BATCH_SIZE),
+                        writer_cfg.get("FLUSH_INTERVAL", DEFAULT_WRITER_FLUSH_INTERVAL),
+                        writer_cfg.get("MAX_PENDING_ROWS", DEFAULT_WRITER_MAX_PENDING_ROWS),
+                        writer_cfg.get("ASYNC_POOL_SIZE", DEFAULT_ASYNC_POOL_SIZE),
+                        writer_cfg.get("ASYNC_MAX_INFLIGHT", DEFAULT_ASYNC_MAX_INFLIGHT))
+                    self.db_writer.start()
+                else:
+                    Log.logger.critical(f'scc_dlm_api: asyncpg not installed, using threaded db writer')
+            if self.db_writer is None:
+                self.copy_ingest = CopyIngest(writer_cfg.get("INGEST_METHOD", INGEST_METHOD_COPY))
+                journal = None
+                if journal_cfg.get("ENABLE", False):
+                    journal = SccJournal(
+                        journal_cfg.get("JOURNAL_DIR", DEFAULT_JOURNAL_DIR),
+                        journal_cfg.get("SEGMENT_SIZE", DEFAULT_SEGMENT_SIZE),
+                        journal_cfg.get("MAX_SEGMENTS", DEFAULT_MAX_SEGMENTS),
+                        journal_cfg.get("FSYNC_INTERVAL", DEFAULT_FSYNC_INTERVAL))
+                self.db_writer = SccDbWriter(
+                    writer_cfg.get("BATCH_SIZE", DEFAULT_WRITER_BATCH_SIZE),
+                    writer_cfg.get("FLUSH_INTERVAL", DEFAULT_WRITER_FLUSH_INTERVAL),
+                    writer_cfg.get("MAX_PENDING_ROWS", DEFAULT_WRITER_MAX_PENDING_ROWS),
+                    self.copy_ingest,
+                    journal,
+                    journal_cfg.get("RETRY_INTERVAL", DEFAULT_JOURNAL_RETRY_INTERVAL),
+                    journal_cfg.get("MAX_RETRY_INTERVAL", DEFAULT_JOURNAL_MAX_RETRY_INTERVAL))
+                self.db_writer.start()
+            return self.db_writer
+        except Exception as ex:
+            Log.logger.critical(f'scc_dlm_api: start_db_writer: exception: {ex}')
+
+    def stop_db_writer(self):
+        try:
+            if self.db_writer is not None:
+                self.db_writer.stop()
+                self.db_writer.join()
+                self.db_writer = None
+        except Exception as ex:
+            Log.logger.critical(f'scc_dlm_api: stop_db_writer: exception: {ex}')
+
+    def start_section_rollup(self, rollup_cfg=None):
+        '''start hourly / daily section rollup maintenance'''
+        try:
+            if self.section_rollup is None:
+                self.section_rollup = SectionRollup(rollup_cfg)
+                self.section_rollup.start()
+            return self.section_rollup
+        except Exception as ex:
+            Log.logger.critical(f'scc_dlm_api: start_section_rollup: exception: {ex}')
+
+    def stop_section_rollup(self):
+        try:
+            if self.section_rollup is not None:
+                self.section_rollup.stop()
+                self.section_rollup.join()
+                self.section_rollup = None
+        except Exception as ex:
+            Log.logger.critical(f'scc_dlm_api: stop_section_rollup: exception: {ex}')
+
+    def update_section_rollup(self, data):
+        '''account section_info message in the rollups, in memory only'''
+        try:
+            if self.section_rollup is not None:
+                self.section_rollup.add(to_section_snapshot(data))
+        except Exception as ex:
+            Log.logger.critical(f'scc_dlm_api: update_section_rollup: exception: {ex}')
+
+    def read_section_rollup(self, granularity, t0, t1, section_ids=None):
+        '''hourly / daily per section statistics for dashboards'''
+        try:
+            return read_section_rollup(granularity, t0, t1, section_ids)
+        except Exception as ex:
+            Log.logger.critical(f'scc_dlm_api: read_section_rollup: exception: {ex}')
+
+    def write_rows(self, model, fields, rows):
+        '''hand rows to the db writer, insert synchronously when the writer is not running'''
+        if len(rows) == 0:
+            return
+        if self.db_writer is not None:
+            self.db_writer.submit(model, fields, rows)
+        else:
+            self.copy_ingest.write(model, fields, rows)
 
     def connect_database(self, config):
-        '''Establish connection with database'''
+        '''Establish connection with database (shared pooled database of scc_db_manager)'''
         try:
             self.json_data = config.json_data
             self.db_name = self.json_data["DATABASE"]["DB_NAME"]
-            self.user = self.json_data["DATABASE"]["USER"]
-            self.password = self.json_data["DATABASE"]["PASSWORD"]
-            self.host = self.json_data["DATABASE"]["HOST"]
-            self.port = 5432
 
             if len(self.db_name) == 0:
                 Log.logger.critical(
                     "scc_dlm_api: connect_database:  database name missing")
             else:
-                psql_db = PostgresqlDatabase(
-                    self.db_name,
-                    user=self.user,
-                    password=self.password,
-                    host=self.host,
-                    port=self.port)
+                psql_db = init_db_manager(config)
                 if psql_db:
-                    try:
-                        psql_db.connect()
+                    if db_manager.connect():
                         Log.logger.info(
                             f'scc_dlm_api: database connection successful')
                         return psql_db
-                    except Exception as e:
-                        Log.logger.critical(
-                            f'scc_dlm_api: connect_database: {e}')
+                    else:
                         sys.exit(1)
                 else:
                     return None
@@ -141,65 +595,56 @@ class SccAPI:
                 "scc_dlm_api: connect_database: Exception: ", ex)
 
     def get_user_roles(self, username_param):
-        '''get user roles from database'''
+        '''get user roles, from the role cache or from database on a miss'''
+        user_roles = self.role_cache.get(username_param, self.read_user_roles)
+        if user_roles is None:
+            Log.logger.warning(
+                f'Requested username does not exist in the database')
+            return None
+        Log.logger.info(
+            f'Section reset request received from user:{username_param}, and user role is {user_roles[0]}')
+        return user_roles
+
+    def read_user_roles(self, username_param):
+        '''get user roles from database, None for an unknown username'''
         try:
             user_details_table = OccUserInfo.select().where(
                 OccUserInfo.username == username_param).get()
-            Log.logger.info(
-                f'Section reset request received from user:{username_param}, and user role is {user_details_table.roles[0]}')
             return user_details_table.roles
         except DoesNotExist:
-            Log.logger.warning(
-                f'Requested username does not exist in the database')
             return None
 
     def get_dpu_id(self, section_id_param):
-        '''search dpu id of selected section_id'''
-        try:
-            yard_config_table = YardConfigInfo.select().where(
-                YardConfigInfo.section_id == section_id_param).get()
-            Log.logger.info(
-                f'SECTION ID:{section_id_param} =>  DPU_ID: {yard_config_table.dpu_id}')
-            return yard_config_table.dpu_id
-        except DoesNotExist:
+        '''search dpu id of selected section_id in the yard configuration snapshot'''
+        dpu_id = yard_config_cache.get_snapshot().get_dpu_id(section_id_param)
+        if dpu_id is None:
             Log.logger.warning(
                 f'Requested DPU_ID does not exist in the database')
             return None
+        Log.logger.info(
+            f'SECTION ID:{section_id_param} =>  DPU_ID: {dpu_id}')
+        return dpu_id
 
     def insert_section_info(self, data):
         ''' insert section information '''
         try:
-            json_data = json.loads(data)
+            snapshot = to_section_snapshot(data)
 
             '''list'''
             list_tuple = []
-            d = []
-            for i in range(len(json_data["sections"])):
-                d.append(json_data["ts"])
-                d.append(json_data["sections"][i]["section_id"])
-                d.append(json_data["sections"][i]["section_status"])
-                d.append(json_data["sections"][i]["engine_axle_count"])
-                d.append(json_data["sections"][i]["torpedo_axle_count"])
-                d.append(json_data["sections"][i]["direction"])
-                d.append(json_data["sections"][i]["speed"])
-                d.append(json_data["sections"][i]["torpedo_status"])
-                d.append(json_data["sections"][i]["first_axle"])
-                t = tuple(d)
-                list_tuple.append(t)
-                d.clear()
-
-            SectionInfo.insert_many(
-                list_tuple,
-                fields=[
-                    SectionInfo.ts,
-                    SectionInfo.section_id,
-                    SectionInfo.section_status,
-                    SectionInfo.engine_axle_count,
-                    SectionInfo.torpedo_axle_count,
-                    SectionInfo.direction,
-                    SectionInfo.speed,
-                    SectionInfo.torpedo_status,
-                    SectionInfo.first_axle]).execute()
+            for section in snapshot.sections:
+                list_tuple.append((
+                    snapshot.ts,
+                    section.section_id,
+                    section.section_status,
+                    section.engine_axle_count,
+                    section.torpedo_axle_count,
+                    section.direction,
+                    section.speed,
+                    section.torpedo_status,
+                    section.first_axle))
+
+            self.write_rows(SectionInfo, SECTION_INFO_FIELDS, list_tuple)
 
         except Exception as ex:
             Log.logger.critical(
@@ -208,31 +653,43 @@ class SccAPI:
     def insert_section_playback_info(self, data):
         ''' insert section information '''
         try:
-            json_data = json.loads(data)
+            snapshot = to_section_snapshot(data)
 
-            section_playback_table = SectionPlaybackInfo()
-            section_playback_table.ts = json_data["ts"]
-            section_playback_table.sections = json_data['sections']
-
-            section_playback_table.save()
+            if self.playback_recorder is not None:
+                result = self.playback_recorder.record(snapshot.ts, snapshot.raw_sections())
+                if result is not None:
+                    self.write_rows(*result)
+            else:
+                self.write_rows(SectionPlaybackInfo, SECTION_PLAYBACK_INFO_FIELDS,
+                                [(snapshot.ts, snapshot.raw_sections())])
 
         except Exception as ex:
             Log.logger.critical(
                 f'scc_dlm_api: insert_section_info: exception:  {ex}')
 
-    def read_section_playback_info(self):
+    def get_yard_state_at(self, ts):
+        '''section list of the yard at ts from the playback tables'''
         try:
-            section_playback_model = SectionPlaybackInfo()
-            section_playback_records = section_playback_model.select()
+            return get_yard_state_at(ts)
+        except Exception as ex:
+            Log.logger.critical(f'scc_dlm_api: get_yard_state_at: exception: {ex}')
 
-            for i in section_playback_records:
-                section_msg = i.sections
-                for j in range(len(section_msg)):
-                    Log.logger.info(
-                        f'ts:{i.ts},{section_msg[j]["section_id"]},{section_msg[j]["section_status"]}')
+    def stream_playback(self, t0, t1, speed=1.0, section_ids=None):
+        '''generator of yard states between t0 and t1 for UI replay'''
+        return stream_playback(t0, t1, speed, section_ids)
+
+    def read_section_playback_info(self, t0, t1, section_ids=None, page_size=DEFAULT_PLAYBACK_PAGE_SIZE):
+        '''generator of {"ts", "sections"} playback messages between t0 and t1, streamed page_size rows at a time'''
+        return read_section_playback(t0, t1, section_ids, page_size)
+
+    def read_section_playback_page(self, t0, t1, section_ids=None, page_size=DEFAULT_PLAYBACK_PAGE_SIZE,
+                                   after_t0=False):
+        '''one page of playback messages for the website, next page starts after next_t0'''
+        try:
+            return read_section_playback_page(t0, t1, section_ids, page_size, after_t0)
         except Exception as ex:
             Log.logger.critical(
-                f'scc_dlm_api: read_section_playback_info: exception: {ex}')
+                f'scc_dlm_api: read_section_playback_page: exception: {ex}')
 
     def insert_dp_info(self, data):
         ''' insert DP information '''
@@ -241,29 +698,17 @@ class SccAPI:
 
             '''list'''
             list_tuple = []
-            d = []
-            for i in range(len(json_data["dps"])):
-                d.append(json_data["ts"])
-                d.append(json_data["dpu_id"])
-                d.append(json_data["dps"][i]["dp_id"])
-                d.append(json_data["dps"][i]["axle_count"])
-                d.append(json_data["dps"][i]["axle_type"])
-                d.append(json_data["dps"][i]["direction"])
-                d.append(json_data["dps"][i]["speed"])
-                t = tuple(d)
-                list_tuple.append(t)
-                d.clear()
-
-            DpInfo.insert_many(
-                list_tuple,
-                fields=[
-                    DpInfo.ts,
-                    DpInfo.dpu_id,
-                    DpInfo.dp_id,
-                    DpInfo.axle_count,
-                    DpInfo.axle_type,
-                    DpInfo.direction,
-                    DpInfo.speed]).execute()
+            for dp in json_data["dps"]:
+                list_tuple.append((
+                    json_data["ts"],
+                    json_data["dpu_id"],
+                    dp["dp_id"],
+                    dp["axle_count"],
+                    dp["axle_type"],
+                    dp["direction"],
+                    dp["speed"]))
+
+            self.write_rows(DpInfo, DP_INFO_FIELDS, list_tuple)
 
         except Exception as ex:
             Log.logger.critical(
@@ -330,105 +775,131 @@ class SccAPI:
             Log.logger.critical(
                 f'scc_dlm_api: init_train_movement_info: excpetion: {ex}')
 
+    def new_train_trace_row(self, ts, section, torpedo_id, engine_id):
+        '''build train_trace row from section state, ordered as TRAIN_TRACE_INFO_FIELDS'''
+        return (ts,
+                section.section_id,
+                section.section_status,
+                section.torpedo_axle_count,
+                section.engine_axle_count,
+                section.direction,
+                section.speed,
+                section.torpedo_status,
+                section.first_axle,
+                str(torpedo_id) if torpedo_id is not None else None,
+                str(engine_id) if engine_id is not None else None)
+
     def insert_train_trace_info(self, data):
         '''insert section inform to trace train entry and exit'''
         try:
-            json_data = json.loads(data)
+            snapshot = to_section_snapshot(data)
+            train_trace_rows = []
 
             for i in range(TOTAL_SECTION_TRACE_FOR_TRAIN):
-                for j in range(len(json_data['sections'])):
-                    if json_data['sections'][j]['section_id'] == self.train_trace_obj_list[i].section_id:
-                        '''compare section torpedo_axle_count is 16 or not'''
-                        if json_data['sections'][j]['torpedo_axle_count'] == 16 and json_data['sections'][j]['direction'] == "in":
-                            '''check previous section torpedo_axle_count is less than 16 or not'''
-                            if self.train_trace_obj_list[i].in_torpedo_axle_count < 16:
-                                '''insert record if previous section torpedo_axle_count less than 16 and current
-                                torpedo_axle_count is 16'''
-                                train_trace_table = TrainTraceInfo()
-                                train_trace_table.ts = json_data["ts"]
-                                train_trace_table.section_id = json_data["sections"][j]["section_id"]
-                                train_trace_table.section_status = json_data["sections"][j]["section_status"]
-                                train_trace_table.torpedo_axle_count = json_data[
-                                    "sections"][j]["torpedo_axle_count"]
-                                train_trace_table.engine_axle_count = json_data[
-                                    "sections"][j]["engine_axle_count"]
-                                train_trace_table.direction = json_data["sections"][j]["direction"]
-                                train_trace_table.speed = json_data["sections"][j]["speed"]
-                                train_trace_table.torpedo_status = json_data["sections"][j]["torpedo_status"]
-                                train_trace_table.first_axle = json_data["sections"][j]["first_axle"]
-                                self.entry_torpedo_id = self.entry_torpedo_id + 1
-                                self.entry_engine_id = self.entry_engine_id + 1
-                                train_trace_table.torpedo_id = self.entry_torpedo_id
-                                train_trace_table.engine_id = self.entry_engine_id
-                                train_trace_table.save()
-                                '''save it in train_trace_obj_list'''
-                                self.train_trace_obj_list[i].in_torpedo_axle_count = json_data['sections'][j]['torpedo_axle_count']
-                            else:
-                                self.train_trace_obj_list[i].in_torpedo_axle_count = json_data['sections'][j]['torpedo_axle_count']
-                        else:
-                            self.train_trace_obj_list[i].in_torpedo_axle_count = json_data['sections'][j]['torpedo_axle_count']
-
-                        if json_data['sections'][j]['direction'] == "out" or json_data['sections'][j]['direction'] == "none":
-                            if json_data['sections'][j]['torpedo_axle_count'] >= 1:
-                                self.train_trace_obj_list[i].out_torpedo_axle_count = json_data['sections'][j]['torpedo_axle_count']
-                            elif json_data['sections'][j]['torpedo_axle_count'] == 0:
-                                if self.train_trace_obj_list[i].out_torpedo_axle_count > 0:
-                                    train_trace_table = TrainTraceInfo()
-                                    train_trace_table.ts = json_data["ts"]
-                                    train_trace_table.section_id = json_data["sections"][j]["section_id"]
-                                    train_trace_table.section_status = json_data[
-                                        "sections"][j]["section_status"]
-                                    train_trace_table.torpedo_axle_count = json_data[
-                                        "sections"][j]["torpedo_axle_count"]
-                                    train_trace_table.engine_axle_count = json_data[
-                                        "sections"][j]["engine_axle_count"]
-                                    train_trace_table.direction = json_data["sections"][j]["direction"]
-                                    train_trace_table.speed = json_data["sections"][j]["speed"]
-                                    train_trace_table.torpedo_status = json_data[
-                                        "sections"][j]["torpedo_status"]
-                                    train_trace_table.first_axle = json_data["sections"][j]["first_axle"]
-                                    train_trace_table.torpedo_id = self.entry_torpedo_id
-                                    train_trace_table.engine_id = self.entry_engine_id
-                                    train_trace_table.save()
-                                    self.train_trace_obj_list[i].out_torpedo_axle_count = 0
-                                else:
-                                    pass
-                            else:
-                                pass
+                section = snapshot.get(self.train_trace_obj_list[i].section_id)
+                if section is None:
+                    continue
+
+                '''compare section torpedo_axle_count is 16 or not'''
+                if section.torpedo_axle_count == 16 and section.direction == "in":
+                    '''check previous section torpedo_axle_count is less than 16 or not'''
+                    if self.train_trace_obj_list[i].in_torpedo_axle_count < 16:
+                        '''insert record if previous section torpedo_axle_count less than 16 and current
+                        torpedo_axle_count is 16'''
+                        self.entry_torpedo_id = self.entry_torpedo_id + 1
+                        self.entry_engine_id = self.entry_engine_id + 1
+                        train_trace_rows.append(self.new_train_trace_row(
+                            snapshot.ts, section, self.entry_torpedo_id, self.entry_engine_id))
+                self.train_trace_obj_list[i].in_torpedo_axle_count = section.torpedo_axle_count
+
+                if section.direction == "out" or section.direction == "none":
+                    if section.torpedo_axle_count >= 1:
+                        self.train_trace_obj_list[i].out_torpedo_axle_count = section.torpedo_axle_count
+                    elif section.torpedo_axle_count == 0:
+                        if self.train_trace_obj_list[i].out_torpedo_axle_count > 0:
+                            train_trace_rows.append(self.new_train_trace_row(
+                                snapshot.ts, section, self.entry_torpedo_id, self.entry_engine_id))
+                            self.train_trace_obj_list[i].out_torpedo_axle_count = 0
                         else:
                             pass
                     else:
                         pass
+                else:
+                    pass
+
+            self.write_rows(TrainTraceInfo, TRAIN_TRACE_INFO_FIELDS, train_trace_rows)
         except Exception as ex:
             Log.logger.critical(
                 f'scc_dlm_api: insert_train_trace_info: exception: {ex}')
 
+    def read_point_config_info(self):
+        '''read point machine configuration from database'''
+        try:
+            return list(PointConfig.select())
+        except Exception as ex:
+            Log.logger.critical(f'scc_dlm_api: read_point_config_info: exception: {ex}')
+            return []
+
+    def init_yard_topology(self):
+        '''compile yard topology from the yard configuration snapshot on first call, later calls reuse it'''
+        try:
+            if not self.yard_topology.loaded:
+                snapshot = yard_config_cache.get_snapshot()
+                self.yard_topology.load(snapshot.section_connections, snapshot.point_config, snapshot.version)
+            self.yard_config_version = self.yard_topology.version
+            return self.yard_topology
+        except Exception as ex:
+            Log.logger.critical(f'scc_dlm_api: init_yard_topology: exception: {ex}')
+
+    def get_neighbour_conn(self, section_conn, direction):
+        '''SectionConnections of the neighbour of section_conn in direction, None when there is none'''
+        return self.section_conn_rows.get(self.yard_topology.neighbour(section_conn.row, direction))
+
     def init_section_connections_info(self):
         try:
-            section_connections_db_records = self.read_section_connections_info()
-            for sc in section_connections_db_records:
+            topology = self.init_yard_topology()
+            for section_id in topology.section_ids:
+                section_conn = SectionConnections(self.yard_state, section_id)
                 Log.logger.info(
-                    f'SECTION_ID: {sc.section_id}, LEFT_SECTION: {sc.left_normal}, RIGHT_SECTION: {sc.right_normal}')
-
-            for sc in section_connections_db_records:
-                self.section_conn_obj_list.append(SectionConnections())
-                self.torpedo_obj_list.append(Torpedo())
-
-            sc_idx = 0
-            for sc in section_connections_db_records:
-                self.section_conn_obj_list[sc_idx].section_id = sc.section_id
-                self.section_conn_obj_list[sc_idx].left_normal = sc.left_normal
-                self.section_conn_obj_list[sc_idx].right_normal = sc.right_normal
-                self.section_conn_obj_list[sc_idx].left_reverse = sc.left_reverse
-                self.section_conn_obj_list[sc_idx].right_reverse = sc.right_reverse
-        
-                self.torpedo_obj_list[sc_idx].section_id = sc.section_id
-                sc_idx += 1
-                
+                    f'SECTION_ID: {section_id}, LEFT_SECTION: {section_conn.left_normal}, RIGHT_SECTION: {section_conn.right_normal}')
+                torpedo = Torpedo(self.yard_state, section_id)
+                self.section_conn_obj_list.append(section_conn)
+                self.section_conn_idx[section_id] = section_conn
+                self.section_conn_rows[section_conn.row] = section_conn
+                self.torpedo_obj_list.append(torpedo)
+                self.torpedo_idx[section_id] = torpedo
+
         except Exception as ex:
             Log.logger.critical(
                 f'init_section_connections_info: exception {ex}')
 
+    def apply_yard_config(self, snapshot):
+        '''switch to a reloaded snapshot, the shared topology is compiled once per snapshot, rows and their state are kept'''
+        try:
+            if snapshot is None or snapshot.version == self.yard_config_version:
+                return False
+            if self.yard_topology.reload(snapshot.section_connections, snapshot.point_config, snapshot.version):
+                Log.logger.info(
+                    f'scc_dlm_api: yard configuration {snapshot.version} applied, {self.yard_topology.get_stats()}')
+            self.sync_yard_config()
+            return True
+        except Exception as ex:
+            Log.logger.critical(f'scc_dlm_api: apply_yard_config: exception: {ex}')
+            return False
+
+    def sync_yard_config(self):
+        '''rebuild the section views after the shared topology was reloaded, no-op while it is unchanged'''
+        if self.yard_topology.version == self.yard_config_version:
+            return
+        self.yard_config_version = self.yard_topology.version
+        if len(self.section_conn_obj_list) != 0:
+            self.section_conn_obj_list = []
+            self.torpedo_obj_list = []
+            self.section_conn_idx = {}
+            self.section_conn_rows = {}
+            self.torpedo_idx = {}
+            self.init_section_connections_info()
+
     def init_train_trace_info(self):
         '''initialise train trace objects'''
         try:
@@ -445,6 +916,7 @@ class SccAPI:
 
     def update_torpedo_id(self, data):
         try:
+            self.sync_yard_config()
             for sc_idx in range(len(self.section_conn_obj_list)):
                 Log.logger.info(
                     f'{self.section_conn_obj_list[sc_idx].section_id}')
@@ -485,433 +957,379 @@ class SccAPI:
 
     def torpedo_performance(self, data):
         try:
-            json_data = json.loads(data)
-            section_list = {}
-
-            for json_idx in range(len(json_data['sections'])):
-                section_list[json_data['sections'][json_idx]
-                             ['section_id']] = json_data['sections'][json_idx]
-
-            for json_idx in range(len(json_data['sections'])):
-                if json_data['sections'][json_idx]['section_id'] in UNLOADING_SECTION_LIST:
-                    for sc_idx in range(len(self.torpedo_obj_list)):
-                        if json_data['sections'][json_idx]['section_id'] == self.torpedo_obj_list[sc_idx].section_id:
-                            if json_data['sections'][json_idx]['section_status'] != "none" or json_data[
-                                    'sections'][json_idx]['direction'] != "none":
-                                if json_data['sections'][json_idx]['torpedo_axle_count'] >= 12 and self.torpedo_obj_list[sc_idx].in_torpedo_axle_count < 12:
-                                    self.torpedo_obj_list[sc_idx].unloaded_entry_time = json_data["ts"]
-                                    self.torpedo_obj_list[sc_idx].torpedo_id = "T" + time.strftime('%d%m%Y%H%M%S', time.localtime(json_data["ts"]))
-                                    self.torpedo_obj_list[sc_idx].engine_id = "E" + time.strftime('%d%m%Y%H%M%S', time.localtime(json_data["ts"]))
+            self.sync_yard_config()
+            snapshot = to_section_snapshot(data)
+
+            for section in snapshot.sections:
+                if section.section_id in UNLOADING_SECTION_LIST:
+                    torpedo = self.torpedo_idx.get(section.section_id)
+                    if torpedo is not None:
+                        if section.section_status != "none" or section.direction != "none":
+                            if section.torpedo_axle_count >= 12 and torpedo.in_torpedo_axle_count < 12:
+                                torpedo.unloaded_entry_time = snapshot.ts
+                                torpedo.torpedo_id = "T" + time.strftime('%d%m%Y%H%M%S', time.localtime(snapshot.ts))
+                                torpedo.engine_id = "E" + time.strftime('%d%m%Y%H%M%S', time.localtime(snapshot.ts))
                                     
-                                    Log.logger.info(
-                                        f'Section_id : {self.section_conn_obj_list[sc_idx].section_id},'
-                                        f'torpedo_id : {self.section_conn_obj_list[sc_idx].torpedo_id},'
-                                        f'engine_id: {self.section_conn_obj_list[sc_idx].engine_id},'
-                                        f'unloaded entry ts: {self.section_conn_obj_list[sc_idx].unloaded_entry_time}')
-
-                                    self.torpedo_obj_list[sc_idx].in_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
-
-                                    if self.torpedo_obj_list[sc_idx].torpedo_id != 0 and self.torpedo_obj_list[sc_idx].engine_id != 0:
-                                        '''insert torpedo entry time while entrying unloading section'''
-                                        self.insert_torpedo_loaded_entry_info(
-                                            self.torpedo_obj_list[sc_idx].torpedo_id,
-                                            self.torpedo_obj_list[sc_idx].engine_id,
-                                            self.torpedo_obj_list[sc_idx].unloaded_entry_time,
-                                            self.torpedo_obj_list[sc_idx].section_id)
-                                    else:
-                                        pass
+                                Log.logger.info(
+                                    f'Section_id : {torpedo.section_id},'
+                                    f'torpedo_id : {torpedo.torpedo_id},'
+                                    f'engine_id: {torpedo.engine_id},'
+                                    f'unloaded entry ts: {torpedo.unloaded_entry_time}')
+
+                                torpedo.in_torpedo_axle_count = section.torpedo_axle_count
+
+                                if torpedo.torpedo_id != 0 and torpedo.engine_id != 0:
+                                    '''insert torpedo entry time while entrying unloading section'''
+                                    self.insert_torpedo_loaded_entry_info(
+                                        torpedo.torpedo_id,
+                                        torpedo.engine_id,
+                                        torpedo.unloaded_entry_time,
+                                        torpedo.section_id)
                                 else:
-                                    self.torpedo_obj_list[sc_idx].in_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
+                                    pass
                             else:
-                                pass
+                                torpedo.in_torpedo_axle_count = section.torpedo_axle_count
+                        else:
+                            pass
 
-                            '''-----------------------------------GET UNLOADING EXIT TIME-----------------------------------'''
-                            if json_data['sections'][json_idx]['direction'] == "out" or json_data['sections'][json_idx]['direction'] == "none":
-                                if json_data['sections'][json_idx]['torpedo_axle_count'] >= 6:
-                                    self.torpedo_obj_list[sc_idx].out_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
+                        '''-----------------------------------GET UNLOADING EXIT TIME-----------------------------------'''
+                        if section.direction == "out" or section.direction == "none":
+                            if section.torpedo_axle_count >= 6:
+                                torpedo.out_torpedo_axle_count = section.torpedo_axle_count
+                            else:
+                                pass
+                            if torpedo.out_torpedo_axle_count >= 6 and section.torpedo_axle_count < 6:
+                                torpedo.unloaded_exit_time = snapshot.ts
+
+                                Log.logger.info(f'Section_id : {torpedo.section_id},'
+                                                f'torpedo_id : {torpedo.torpedo_id},'
+                                                f'engine_id: {torpedo.engine_id},'
+                                                f'unloaded exit ts: {torpedo.unloaded_exit_time}')
+
+                                '''do not update db when torpedo id and engine id is 0'''
+                                if torpedo.torpedo_id != 0 and torpedo.engine_id != 0:
+                                    self.update_torpedo_unloaded_exit_info(
+                                        torpedo.torpedo_id,
+                                        torpedo.engine_id,
+                                        torpedo.unloaded_exit_time,
+                                        torpedo.section_id)
                                 else:
                                     pass
-                                if self.torpedo_obj_list[sc_idx].out_torpedo_axle_count >= 6 and json_data[
-                                        'sections'][json_idx]['torpedo_axle_count'] < 6:
-                                    self.torpedo_obj_list[sc_idx].unloaded_exit_time = json_data["ts"]
-
-                                    Log.logger.info(f'Section_id : {self.torpedo_obj_list[sc_idx].section_id},'
-                                                    f'torpedo_id : {self.torpedo_obj_list[sc_idx].torpedo_id},'
-                                                    f'engine_id: {self.torpedo_obj_list[sc_idx].engine_id},'
-                                                    f'unloaded exit ts: {self.torpedo_obj_list[sc_idx].unloaded_exit_time}')
-
-                                    '''do not update db when torpedo id and engine id is 0'''
-                                    if self.torpedo_obj_list[sc_idx].torpedo_id != 0 and self.torpedo_obj_list[sc_idx].engine_id != 0:
-                                        self.update_torpedo_unloaded_exit_info(
-                                            self.torpedo_obj_list[sc_idx].torpedo_id,
-                                            self.torpedo_obj_list[sc_idx].engine_id,
-                                            self.torpedo_obj_list[sc_idx].unloaded_exit_time,
-                                            self.torpedo_obj_list[sc_idx].section_id)
-                                    else:
-                                        pass
 
-                                    self.torpedo_obj_list[sc_idx].out_torpedo_axle_count = 0
-                                else:
-                                    pass
+                                torpedo.out_torpedo_axle_count = 0
                             else:
                                 pass
-
-                            Log.logger.info(
-                                f'Section_id : {self.torpedo_obj_list[sc_idx].section_id},'
-                                f'torpedo_id : {self.torpedo_obj_list[sc_idx].torpedo_id},'
-                                f'engine_id: {self.torpedo_obj_list[sc_idx].engine_id},')
-                                #f'in: {self.torpedo_obj_list[sc_idx].in_torpedo_axle_count},'
-                                #f'out: {self.torpedo_obj_list[sc_idx].out_torpedo_axle_count}')
                         else:
                             pass
+
+                        Log.logger.info(
+                            f'Section_id : {torpedo.section_id},'
+                            f'torpedo_id : {torpedo.torpedo_id},'
+                            f'engine_id: {torpedo.engine_id},')
+                            #f'in: {torpedo.in_torpedo_axle_count},'
+                            #f'out: {torpedo.out_torpedo_axle_count}')
+                    else:
+                        pass
                 else:
                     pass
+
+            '''write performance updates of this message'''
+            self.trip_cache.flush()
         except Exception as ex:
             Log.logger.critical(f'torpedo_performance: exception {ex}')
 
     def yard_performance(self, data):
         try:
-            json_data = json.loads(data)
-            section_list = {}
-
-            for json_idx in range(len(json_data['sections'])):
-                section_list[json_data['sections'][json_idx]
-                             ['section_id']] = json_data['sections'][json_idx]
+            self.sync_yard_config()
+            snapshot = to_section_snapshot(data)
 
-            for json_idx in range(len(json_data['sections'])):
+            for section in snapshot.sections:
 
                 '''--------------------------------------ENTRY EXIT SECTION LOGIC ------------------------------'''
-                if json_data['sections'][json_idx]['section_id'] in ENTRY_EXIT_SECTION_LIST:
-                    for sc_idx in range(len(self.section_conn_obj_list)):
-                        if json_data['sections'][json_idx]['section_id'] == self.section_conn_obj_list[sc_idx].section_id:
-
-                            '''--------------------------GET TRAIN ENTRY TIME------------------------------'''
-                            if json_data['sections'][json_idx]['section_status'] == "occupied" and json_data[
-                                    'sections'][json_idx]['direction'] == "in":
-                                if json_data['sections'][json_idx]['torpedo_axle_count'] >= 12 and self.section_conn_obj_list[sc_idx].in_torpedo_axle_count < 12:
-
-                                    self.torpedo_id = "T" + \
-                                        time.strftime(
-                                            '%d%m%Y%H%M%S', time.localtime(json_data["ts"]))
-                                    self.engine_id = "E" + \
-                                        time.strftime(
-                                            '%d%m%Y%H%M%S', time.localtime(json_data["ts"]))
-
-                                    self.section_conn_obj_list[sc_idx].torpedo_id = self.torpedo_id
-                                    self.section_conn_obj_list[sc_idx].engine_id = self.engine_id
-                                    self.section_conn_obj_list[sc_idx].entry_time = json_data["ts"]
-
-                                    if self.section_conn_obj_list[sc_idx].torpedo_id != 0 and self.section_conn_obj_list[sc_idx].engine_id != 0:
-                                        '''insert new train entry in db'''
-                                        self.insert_train_entry_info(
-                                            self.torpedo_id, self.engine_id, json_data["ts"])
-                                    else:
-                                        pass
+                if section.section_id in ENTRY_EXIT_SECTION_LIST:
+                    section_conn = self.section_conn_idx.get(section.section_id)
+                    if section_conn is not None:
+
+                        '''--------------------------GET TRAIN ENTRY TIME------------------------------'''
+                        if section.section_status == "occupied" and section.direction == "in":
+                            if section.torpedo_axle_count >= 12 and section_conn.in_torpedo_axle_count < 12:
+
+                                self.torpedo_id = "T" + \
+                                    time.strftime(
+                                        '%d%m%Y%H%M%S', time.localtime(snapshot.ts))
+                                self.engine_id = "E" + \
+                                    time.strftime(
+                                        '%d%m%Y%H%M%S', time.localtime(snapshot.ts))
+
+                                section_conn.torpedo_id = self.torpedo_id
+                                section_conn.engine_id = self.engine_id
+                                section_conn.entry_time = snapshot.ts
+
+                                if section_conn.torpedo_id != 0 and section_conn.engine_id != 0:
+                                    '''insert new train entry in db'''
+                                    self.insert_train_entry_info(
+                                        self.torpedo_id, self.engine_id, snapshot.ts)
+                                else:
+                                    pass
 
-                                    if self.section_conn_obj_list[sc_idx].left_normal != "NONE":
-                                        sec_id = self.section_conn_obj_list[sc_idx].left_normal
+                                if section_conn.left_normal != "NONE":
+                                    sec_id = section_conn.left_normal
 
-                                    if self.section_conn_obj_list[sc_idx].right_normal != "NONE":
-                                        sec_id = self.section_conn_obj_list[sc_idx].right_normal
+                                if section_conn.right_normal != "NONE":
+                                    sec_id = section_conn.right_normal
 
-                                    Log.logger.info(
-                                        f'Section_id : {self.section_conn_obj_list[sc_idx].section_id},'
-                                        f'torpedo_id : {self.section_conn_obj_list[sc_idx].torpedo_id},'
-                                        f'engine_id: {self.section_conn_obj_list[sc_idx].engine_id},'
-                                        f'entry ts: {self.section_conn_obj_list[sc_idx].entry_time}')
+                                Log.logger.info(
+                                    f'Section_id : {section_conn.section_id},'
+                                    f'torpedo_id : {section_conn.torpedo_id},'
+                                    f'engine_id: {section_conn.engine_id},'
+                                    f'entry ts: {section_conn.entry_time}')
 
-                                    self.section_conn_obj_list[sc_idx].in_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
-                                else:
-                                    self.section_conn_obj_list[sc_idx].in_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
+                                section_conn.in_torpedo_axle_count = section.torpedo_axle_count
                             else:
-                                pass
-
-                            '''-------------------------------------GET TRAIN EXIT TIME---------------------------------'''
-
-                            if json_data['sections'][json_idx]['direction'] == "out":
+                                section_conn.in_torpedo_axle_count = section.torpedo_axle_count
+                        else:
+                            pass
 
-                                sec_id = self.section_conn_obj_list[sc_idx].left_normal
+                        '''-------------------------------------GET TRAIN EXIT TIME---------------------------------'''
 
-                                for section_idx in range(len(self.section_conn_obj_list)):
-                                    if self.section_conn_obj_list[section_idx].section_id == sec_id:
-                                        if self.section_conn_obj_list[section_idx].torpedo_id != 0:
-                                            self.section_conn_obj_list[
-                                                sc_idx].torpedo_id = self.section_conn_obj_list[section_idx].torpedo_id
-                                            self.section_conn_obj_list[
-                                                sc_idx].engine_id = self.section_conn_obj_list[section_idx].engine_id
-                                        else:
-                                            pass
-                                    else:
-                                        pass
+                        if section.direction == "out":
 
-                                if json_data['sections'][json_idx]['torpedo_axle_count'] >= 6:
-                                    self.section_conn_obj_list[sc_idx].out_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
+                            neighbour_conn = self.get_neighbour_conn(section_conn, LEFT_NORMAL)
+                            if neighbour_conn is not None:
+                                if neighbour_conn.torpedo_id != 0:
+                                    section_conn.torpedo_id = neighbour_conn.torpedo_id
+                                    section_conn.engine_id = neighbour_conn.engine_id
                                 else:
                                     pass
+                            else:
+                                pass
 
-                                '''update train exit time in db'''
-                                if self.section_conn_obj_list[sc_idx].out_torpedo_axle_count >= 6 and json_data['sections'][json_idx]['torpedo_axle_count'] <= 6:
+                            if section.torpedo_axle_count >= 6:
+                                section_conn.out_torpedo_axle_count = section.torpedo_axle_count
+                            else:
+                                pass
 
-                                    Log.logger.info(
-                                        'torpedo exiting detected!!')
-                                    self.section_conn_obj_list[sc_idx].exit_time = json_data["ts"]
-
-                                    if self.section_conn_obj_list[sc_idx].torpedo_id != 0 and self.section_conn_obj_list[sc_idx].engine_id != 0:
-                                        Log.logger.info(
-                                            f'updated train exit info')
-                                        self.update_train_exit_info(
-                                            self.section_conn_obj_list[sc_idx].torpedo_id,
-                                            self.section_conn_obj_list[sc_idx].engine_id,
-                                            self.section_conn_obj_list[sc_idx].exit_time)
-
-                                        self.section_conn_obj_list[sc_idx].out_torpedo_axle_count = 0
-                                        self.section_conn_obj_list[sc_idx].in_torpedo_axle_count = 0
-                                    else:
-                                        pass
+                            '''update train exit time in db'''
+                            if section_conn.out_torpedo_axle_count >= 6 and section.torpedo_axle_count <= 6:
 
-                                    Log.logger.info(
-                                        f'Section_id : {self.section_conn_obj_list[sc_idx].section_id},'
-                                        f'torpedo_id : {self.section_conn_obj_list[sc_idx].torpedo_id},'
-                                        f'engine_id: {self.section_conn_obj_list[sc_idx].engine_id},'
-                                        f'train exit ts: {self.section_conn_obj_list[sc_idx].exit_time}')
+                                Log.logger.info(
+                                    'torpedo exiting detected!!')
+                                section_conn.exit_time = snapshot.ts
 
+                                if section_conn.torpedo_id != 0 and section_conn.engine_id != 0:
+                                    Log.logger.info(
+                                        f'updated train exit info')
+                                    self.update_train_exit_info(
+                                        section_conn.torpedo_id,
+                                        section_conn.engine_id,
+                                        section_conn.exit_time)
+
+                                    section_conn.out_torpedo_axle_count = 0
+                                    section_conn.in_torpedo_axle_count = 0
                                 else:
                                     pass
+
+                                Log.logger.info(
+                                    f'Section_id : {section_conn.section_id},'
+                                    f'torpedo_id : {section_conn.torpedo_id},'
+                                    f'engine_id: {section_conn.engine_id},'
+                                    f'train exit ts: {section_conn.exit_time}')
+
                             else:
                                 pass
-
-                            Log.logger.info(
-                                f'Section_id : {self.section_conn_obj_list[sc_idx].section_id},'
-                                f'torpedo_id : {self.section_conn_obj_list[sc_idx].torpedo_id},'
-                                f'engine_id: {self.section_conn_obj_list[sc_idx].engine_id},')
-                                #f'in: {self.section_conn_obj_list[sc_idx].in_torpedo_axle_count},'
-                                #f'out: {self.section_conn_obj_list[sc_idx].out_torpedo_axle_count}')
                         else:
                             pass
+
+                        Log.logger.info(
+                            f'Section_id : {section_conn.section_id},'
+                            f'torpedo_id : {section_conn.torpedo_id},'
+                            f'engine_id: {section_conn.engine_id},')
+                            #f'in: {section_conn.in_torpedo_axle_count},'
+                            #f'out: {section_conn.out_torpedo_axle_count}')
+                    else:
+                        pass
                 else:
                     pass
 
                 '''------------------------------------------MIDDLE SECTIONS LOGIC---------------------------------------'''
-                if json_data['sections'][json_idx]['section_id'] in MIDDLE_SECTION_LIST:
-                    for sc_idx in range(len(self.section_conn_obj_list)):
-                        if json_data['sections'][json_idx]['section_id'] == self.section_conn_obj_list[sc_idx].section_id:
-                            if json_data['sections'][json_idx]['section_status'] == "occupied" and json_data[
-                                    'sections'][json_idx]['direction'] != "none":
-
-                                if json_data['sections'][json_idx]['direction'] == 'in':
-                                    self.section_conn_obj_list[sc_idx].in_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
-                                elif json_data['sections'][json_idx]['direction'] == 'out':
-                                    self.section_conn_obj_list[sc_idx].out_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
-                                else:
-                                    pass
+                if section.section_id in MIDDLE_SECTION_LIST:
+                    section_conn = self.section_conn_idx.get(section.section_id)
+                    if section_conn is not None:
+                        if section.section_status == "occupied" and section.direction != "none":
+
+                            if section.direction == 'in':
+                                section_conn.in_torpedo_axle_count = section.torpedo_axle_count
+                            elif section.direction == 'out':
+                                section_conn.out_torpedo_axle_count = section.torpedo_axle_count
+                            else:
+                                pass
 
-                                if json_data['sections'][json_idx]['direction'] == "out":
-                                    if self.section_conn_obj_list[sc_idx].left_normal != "NONE":
-                                        sec_id = self.section_conn_obj_list[sc_idx].left_normal
-
-                                        for section_idx in range(
-                                                len(self.section_conn_obj_list)):
-                                            if self.section_conn_obj_list[section_idx].section_id == sec_id and section_list[
-                                                    sec_id]["section_status"] == "occupied":
-                                                if section_list[sec_id]["direction"] == "out":
-                                                    self.section_conn_obj_list[
-                                                        sc_idx].torpedo_id = self.section_conn_obj_list[section_idx].torpedo_id
-                                                    self.section_conn_obj_list[
-                                                        sc_idx].engine_id = self.section_conn_obj_list[section_idx].engine_id
-
-                                                else:
-                                                    pass
-                                            else:
-                                                pass
+                            if section.direction == "out":
+                                neighbour_conn = self.get_neighbour_conn(section_conn, LEFT_NORMAL)
+                                if neighbour_conn is not None:
+                                    sec_id = neighbour_conn.section_id
+                                    if snapshot.section_idx[sec_id].section_status == "occupied":
+                                        if snapshot.section_idx[sec_id].direction == "out":
+                                            section_conn.torpedo_id = neighbour_conn.torpedo_id
+                                            section_conn.engine_id = neighbour_conn.engine_id
+
+                                        else:
+                                            pass
                                     else:
                                         pass
+                                else:
+                                    pass
 
-                                    if self.section_conn_obj_list[sc_idx].left_reverse != "NONE":
-                                        sec_id = self.section_conn_obj_list[sc_idx].left_reverse
-
-                                        for section_idx in range(
-                                                len(self.section_conn_obj_list)):
-                                            if self.section_conn_obj_list[section_idx].section_id == sec_id and section_list[
-                                                    sec_id]["section_status"] == "occupied":
-                                                if section_list[sec_id]["direction"] == "out":
-                                                    self.section_conn_obj_list[
-                                                        sc_idx].torpedo_id = self.section_conn_obj_list[section_idx].torpedo_id
-                                                    self.section_conn_obj_list[
-                                                        sc_idx].engine_id = self.section_conn_obj_list[section_idx].engine_id
-                                                else:
-                                                    pass
-                                            else:
-                                                pass
+                                neighbour_conn = self.get_neighbour_conn(section_conn, LEFT_REVERSE)
+                                if neighbour_conn is not None:
+                                    sec_id = neighbour_conn.section_id
+                                    if snapshot.section_idx[sec_id].section_status == "occupied":
+                                        if snapshot.section_idx[sec_id].direction == "out":
+                                            section_conn.torpedo_id = neighbour_conn.torpedo_id
+                                            section_conn.engine_id = neighbour_conn.engine_id
+                                        else:
+                                            pass
                                     else:
                                         pass
                                 else:
                                     pass
+                            else:
+                                pass
 
-                                if json_data['sections'][json_idx]['direction'] == "in":
-                                    if self.section_conn_obj_list[sc_idx].right_normal != "NONE":
-                                        sec_id = self.section_conn_obj_list[sc_idx].right_normal
-
-                                        for section_idx in range(
-                                                len(self.section_conn_obj_list)):
-                                            if self.section_conn_obj_list[section_idx].section_id == sec_id and section_list[
-                                                    sec_id]["section_status"] == "occupied":
-                                                if section_list[sec_id]["direction"] == "in":
-                                                    self.section_conn_obj_list[
-                                                        sc_idx].torpedo_id = self.section_conn_obj_list[section_idx].torpedo_id
-                                                    self.section_conn_obj_list[
-                                                        sc_idx].engine_id = self.section_conn_obj_list[section_idx].engine_id
-                                                else:
-                                                    pass
-                                            else:
-                                                pass
+                            if section.direction == "in":
+                                neighbour_conn = self.get_neighbour_conn(section_conn, RIGHT_NORMAL)
+                                if neighbour_conn is not None:
+                                    sec_id = neighbour_conn.section_id
+                                    if snapshot.section_idx[sec_id].section_status == "occupied":
+                                        if snapshot.section_idx[sec_id].direction == "in":
+                                            section_conn.torpedo_id = neighbour_conn.torpedo_id
+                                            section_conn.engine_id = neighbour_conn.engine_id
+                                        else:
+                                            pass
                                     else:
                                         pass
+                                else:
+                                    pass
 
-                                    if self.section_conn_obj_list[sc_idx].right_reverse != "NONE":
-                                        sec_id = self.section_conn_obj_list[sc_idx].right_reverse
-
-                                        for section_idx in range(
-                                                len(self.section_conn_obj_list)):
-                                            if self.section_conn_obj_list[section_idx].section_id == sec_id and section_list[
-                                                    sec_id]["section_status"] == "occupied":
-                                                if section_list[sec_id]["direction"] == "in":
-                                                    self.section_conn_obj_list[
-                                                        sc_idx].torpedo_id = self.section_conn_obj_list[section_idx].torpedo_id
-                                                    self.section_conn_obj_list[
-                                                        sc_idx].engine_id = self.section_conn_obj_list[section_idx].engine_id
-                                                else:
-                                                    pass
-                                            else:
-                                                pass
+                                neighbour_conn = self.get_neighbour_conn(section_conn, RIGHT_REVERSE)
+                                if neighbour_conn is not None:
+                                    sec_id = neighbour_conn.section_id
+                                    if snapshot.section_idx[sec_id].section_status == "occupied":
+                                        if snapshot.section_idx[sec_id].direction == "in":
+                                            section_conn.torpedo_id = neighbour_conn.torpedo_id
+                                            section_conn.engine_id = neighbour_conn.engine_id
+                                        else:
+                                            pass
                                     else:
                                         pass
                                 else:
                                     pass
-
                             else:
                                 pass
 
-                            Log.logger.info(
-                                f'Section_id : {self.section_conn_obj_list[sc_idx].section_id},'
-                                f'torpedo_id : {self.section_conn_obj_list[sc_idx].torpedo_id},'
-                                f'engine_id: {self.section_conn_obj_list[sc_idx].engine_id},')
-                                #f'in: {self.section_conn_obj_list[sc_idx].in_torpedo_axle_count},'
-                                #f'out: {self.section_conn_obj_list[sc_idx].out_torpedo_axle_count}')
                         else:
                             pass
+
+                        Log.logger.info(
+                            f'Section_id : {section_conn.section_id},'
+                            f'torpedo_id : {section_conn.torpedo_id},'
+                            f'engine_id: {section_conn.engine_id},')
+                            #f'in: {section_conn.in_torpedo_axle_count},'
+                            #f'out: {section_conn.out_torpedo_axle_count}')
+                    else:
+                        pass
                 else:
                     pass
 
-                if json_data['sections'][json_idx]['section_id'] in UNLOADING_SECTION_LIST:
-                    for sc_idx in range(len(self.section_conn_obj_list)):
-                        if json_data['sections'][json_idx]['section_id'] == self.section_conn_obj_list[sc_idx].section_id:
-                            if json_data['sections'][json_idx]['section_status'] != "none" or json_data[
-                                    'sections'][json_idx]['direction'] != "none":
-                                if json_data['sections'][json_idx]['torpedo_axle_count'] >= 12 and self.section_conn_obj_list[sc_idx].in_torpedo_axle_count < 12:
-                                    self.section_conn_obj_list[sc_idx].unloaded_entry_time = json_data["ts"]
-
-                                    if self.section_conn_obj_list[sc_idx].left_normal != "NONE":
-                                        sec_id = self.section_conn_obj_list[sc_idx].left_normal
-
-                                        for section_idx in range(
-                                                len(self.section_conn_obj_list)):
-                                            if self.section_conn_obj_list[section_idx].section_id == sec_id and section_list[
-                                                    sec_id]["section_status"] != "none":
-                                                self.section_conn_obj_list[
-                                                    sc_idx].torpedo_id = self.section_conn_obj_list[section_idx].torpedo_id
-                                                self.section_conn_obj_list[
-                                                    sc_idx].engine_id = self.section_conn_obj_list[section_idx].engine_id
-                                            else:
-                                                pass
-
-                                    if self.section_conn_obj_list[sc_idx].right_normal != "NONE":
-                                        sec_id = self.section_conn_obj_list[sc_idx].right_normal
-
-                                        for section_idx in range(
-                                                len(self.section_conn_obj_list)):
-                                            if self.section_conn_obj_list[section_idx].section_id == sec_id and section_list[
-                                                    sec_id]["section_status"] != "none":
-                                                self.section_conn_obj_list[
-                                                    sc_idx].torpedo_id = self.section_conn_obj_list[section_idx].torpedo_id
-                                                self.section_conn_obj_list[
-                                                    sc_idx].engine_id = self.section_conn_obj_list[section_idx].engine_id
-                                            else:
-                                                pass
-                                    Log.logger.info(
-                                        f'Section_id : {self.section_conn_obj_list[sc_idx].section_id},'
-                                        f'torpedo_id : {self.section_conn_obj_list[sc_idx].torpedo_id},'
-                                        f'engine_id: {self.section_conn_obj_list[sc_idx].engine_id},'
-                                        f'unloaded entry ts: {self.section_conn_obj_list[sc_idx].unloaded_entry_time}')
-
-                                    self.section_conn_obj_list[sc_idx].in_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
-
-                                    if self.section_conn_obj_list[sc_idx].torpedo_id != 0 and self.section_conn_obj_list[sc_idx].engine_id != 0:
-                                        '''update train entry time while entrying unloading section'''
-                                        self.update_train_unloaded_entry_info(
-                                            self.section_conn_obj_list[sc_idx].torpedo_id,
-                                            self.section_conn_obj_list[sc_idx].engine_id,
-                                            self.section_conn_obj_list[sc_idx].unloaded_entry_time,
-                                            self.section_conn_obj_list[sc_idx].section_id)
+                if section.section_id in UNLOADING_SECTION_LIST:
+                    section_conn = self.section_conn_idx.get(section.section_id)
+                    if section_conn is not None:
+                        if section.section_status != "none" or section.direction != "none":
+                            if section.torpedo_axle_count >= 12 and section_conn.in_torpedo_axle_count < 12:
+                                section_conn.unloaded_entry_time = snapshot.ts
+
+                                neighbour_conn = self.get_neighbour_conn(section_conn, LEFT_NORMAL)
+                                if neighbour_conn is not None:
+                                    sec_id = neighbour_conn.section_id
+                                    if snapshot.section_idx[sec_id].section_status != "none":
+                                        section_conn.torpedo_id = neighbour_conn.torpedo_id
+                                        section_conn.engine_id = neighbour_conn.engine_id
                                     else:
                                         pass
-                                else:
-                                    self.section_conn_obj_list[sc_idx].in_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
-                            else:
-                                pass
 
-                            '''-----------------------------------GET UNLOADING EXIT TIME-----------------------------------'''
-                            if json_data['sections'][json_idx]['direction'] == "out" or json_data['sections'][json_idx]['direction'] == "none":
-                                if json_data['sections'][json_idx]['torpedo_axle_count'] >= 6:
-                                    self.section_conn_obj_list[sc_idx].out_torpedo_axle_count = json_data[
-                                        'sections'][json_idx]['torpedo_axle_count']
-                                else:
-                                    pass
-                                if self.section_conn_obj_list[sc_idx].out_torpedo_axle_count >= 6 and json_data[
-                                        'sections'][json_idx]['torpedo_axle_count'] < 6:
-                                    self.section_conn_obj_list[sc_idx].unloaded_exit_time = json_data["ts"]
-
-                                    Log.logger.info(f'Section_id : {self.section_conn_obj_list[sc_idx].section_id},'
-                                                    f'torpedo_id : {self.section_conn_obj_list[sc_idx].torpedo_id},'
-                                                    f'engine_id: {self.section_conn_obj_list[sc_idx].engine_id},'
-                                                    f'unloaded exit ts: {self.section_conn_obj_list[sc_idx].unloaded_exit_time}')
-
-                                    '''do not update db when torpedo id and engine id is 0'''
-                                    if self.section_conn_obj_list[sc_idx].torpedo_id != 0 and self.section_conn_obj_list[sc_idx].engine_id != 0:
-                                        self.update_train_unloaded_exit_info(
-                                            self.section_conn_obj_list[sc_idx].torpedo_id,
-                                            self.section_conn_obj_list[sc_idx].engine_id,
-                                            self.section_conn_obj_list[sc_idx].unloaded_exit_time,
-                                            self.section_conn_obj_list[sc_idx].section_id)
+                                neighbour_conn = self.get_neighbour_conn(section_conn, RIGHT_NORMAL)
+                                if neighbour_conn is not None:
+                                    sec_id = neighbour_conn.section_id
+                                    if snapshot.section_idx[sec_id].section_status != "none":
+                                        section_conn.torpedo_id = neighbour_conn.torpedo_id
+                                        section_conn.engine_id = neighbour_conn.engine_id
                                     else:
                                         pass
-
-                                    self.section_conn_obj_list[sc_idx].out_torpedo_axle_count = 0
+                                Log.logger.info(
+                                    f'Section_id : {section_conn.section_id},'
+                                    f'torpedo_id : {section_conn.torpedo_id},'
+                                    f'engine_id: {section_conn.engine_id},'
+                                    f'unloaded entry ts: {section_conn.unloaded_entry_time}')
+
+                                section_conn.in_torpedo_axle_count = section.torpedo_axle_count
+
+                                if section_conn.torpedo_id != 0 and section_conn.engine_id != 0:
+                                    '''update train entry time while entrying unloading section'''
+                                    self.update_train_unloaded_entry_info(
+                                        section_conn.torpedo_id,
+                                        section_conn.engine_id,
+                                        section_conn.unloaded_entry_time,
+                                        section_conn.section_id)
                                 else:
                                     pass
+                            else:
+                                section_conn.in_torpedo_axle_count = section.torpedo_axle_count
+                        else:
+                            pass
+
+                        '''-----------------------------------GET UNLOADING EXIT TIME-----------------------------------'''
+                        if section.direction == "out" or section.direction == "none":
+                            if section.torpedo_axle_count >= 6:
+                                section_conn.out_torpedo_axle_count = section.torpedo_axle_count
                             else:
                                 pass
+                            if section_conn.out_torpedo_axle_count >= 6 and section.torpedo_axle_count < 6:
+                                section_conn.unloaded_exit_time = snapshot.ts
+
+                                Log.logger.info(f'Section_id : {section_conn.section_id},'
+                                                f'torpedo_id : {section_conn.torpedo_id},'
+                                                f'engine_id: {section_conn.engine_id},'
+                                                f'unloaded exit ts: {section_conn.unloaded_exit_time}')
+
+                                '''do not update db when torpedo id and engine id is 0'''
+                                if section_conn.torpedo_id != 0 and section_conn.engine_id != 0:
+                                    self.update_train_unloaded_exit_info(
+                                        section_conn.torpedo_id,
+                                        section_conn.engine_id,
+                                        section_conn.unloaded_exit_time,
+                                        section_conn.section_id)
+                                else:
+                                    pass
 
-                            Log.logger.info(
-                                f'Section_id : {self.section_conn_obj_list[sc_idx].section_id},'
-                                f'torpedo_id : {self.section_conn_obj_list[sc_idx].torpedo_id},'
-                                f'engine_id: {self.section_conn_obj_list[sc_idx].engine_id},')
-                                #f'in: {self.section_conn_obj_list[sc_idx].in_torpedo_axle_count},'
-                                #f'out: {self.section_conn_obj_list[sc_idx].out_torpedo_axle_count}')
+                                section_conn.out_torpedo_axle_count = 0
+                            else:
+                                pass
                         else:
                             pass
+
+                        Log.logger.info(
+                            f'Section_id : {section_conn.section_id},'
+                            f'torpedo_id : {section_conn.torpedo_id},'
+                            f'engine_id: {section_conn.engine_id},')
+                            #f'in: {section_conn.in_torpedo_axle_count},'
+                            #f'out: {section_conn.out_torpedo_axle_count}')
+                    else:
+                        pass
                 else:
                     pass
 
+            '''write performance updates of this message'''
+            self.trip_cache.flush()
         except Exception as ex:
             Log.logger.critical(
                 f'scc_dlm_api: insert_yard_performance: exception: {ex}')
@@ -924,23 +1342,26 @@ class SccAPI:
             torpedo_performance_table.unload_entry_ts = unloaded_entry_time
             torpedo_performance_table.unload_section_id = unloaded_section_id
             torpedo_performance_table.save()
+            self.trip_cache.open_trip(TorpedoPerformanceInfo, torpedo_id, torpedo_performance_table.id)
             Log.logger.info(
-                f'inserted torpedo loaded entry time: {entry_time}, torpedo_id: {torpedo_id}')
+                f'inserted torpedo loaded entry time: {unloaded_entry_time}, torpedo_id: {torpedo_id}')
         except Exception as ex:
             Log.logger.critical(f'insert_torpedo_loaded_entry_info: exception: {ex}')
 
     def update_torpedo_unloaded_exit_info(self, torpedo_id, engine_id, unloaded_exit_time, unloaded_section_id):
         try:
-            torpedo_performance_table = TorpedoPerformanceInfo.select().where(
-                TorpedoPerformanceInfo.torpedo_id == torpedo_id).get()
-            torpedo_performance_table.unload_exit_ts = unloaded_exit_time
-            torpedo_performance_table.unload_section_id = unloaded_section_id
-            torpedo_performance_table.save()
-            Log.logger.info(
-                f'inserted unloading zone torpedo exit time: {unloaded_exit_time}, torpedo_id: {torpedo_id}')
-        except DoesNotExist:
-            Log.logger.critical(
-                f'update_torpedo_unloaded_exit_info: record does not exist')
+            if self.trip_cache.update(TorpedoPerformanceInfo, torpedo_id, {
+                    TorpedoPerformanceInfo.unload_exit_ts: unloaded_exit_time,
+                    TorpedoPerformanceInfo.unload_section_id: unloaded_section_id}):
+                '''unloading exit is the last event of a torpedo trip'''
+                self.trip_cache.close_trip(TorpedoPerformanceInfo, torpedo_id)
+                Log.logger.info(
+                    f'inserted unloading zone torpedo exit time: {unloaded_exit_time}, torpedo_id: {torpedo_id}')
+            else:
+                Log.logger.critical(
+                    f'update_torpedo_unloaded_exit_info: record does not exist')
+        except Exception as ex:
+            Log.logger.critical(f'update_torpedo_unloaded_exit_info: exception: {ex}')
 
     def insert_train_entry_info(self, torpedo_id, engine_id, entry_time):
         try:
@@ -949,6 +1370,7 @@ class SccAPI:
             yard_performance_table.torpedo_id = torpedo_id
             yard_performance_table.entry_ts = entry_time
             yard_performance_table.save()
+            self.trip_cache.open_trip(YardPerformanceInfo, torpedo_id, yard_performance_table.id)
             Log.logger.info(
                 f'inserted train entry time: {entry_time}, torpedo_id: {torpedo_id}')
         except Exception as ex:
@@ -956,43 +1378,44 @@ class SccAPI:
 
     def update_train_exit_info(self, torpedo_id, engine_id, exit_time):
         try:
-            yard_performance_table = YardPerformanceInfo.select().where(
-                YardPerformanceInfo.torpedo_id == torpedo_id).get()
-            yard_performance_table.exit_ts = exit_time
-            yard_performance_table.save()
-            Log.logger.info(
-                f'inserted train exit time: {exit_time}, torpedo_id: {torpedo_id}')
-        except DoesNotExist:
-            Log.logger.critical(
-                f'update_train_exit_info: record does not exist')
+            if self.trip_cache.update(YardPerformanceInfo, torpedo_id, {YardPerformanceInfo.exit_ts: exit_time}):
+                '''yard exit is the last event of a train trip'''
+                self.trip_cache.close_trip(YardPerformanceInfo, torpedo_id)
+                Log.logger.info(
+                    f'inserted train exit time: {exit_time}, torpedo_id: {torpedo_id}')
+            else:
+                Log.logger.critical(
+                    f'update_train_exit_info: record does not exist')
+        except Exception as ex:
+            Log.logger.critical(f'update_train_exit_info: exception: {ex}')
 
     def update_train_unloaded_entry_info(
             self, torpedo_id, engine_id, unloaded_entry_time, unloaded_section_id):
         try:
-            yard_performance_table = YardPerformanceInfo.select().where(
-                YardPerformanceInfo.torpedo_id == torpedo_id).get()
-            yard_performance_table.unload_entry_ts = unloaded_entry_time
-            yard_performance_table.unload_section_id = unloaded_section_id
-            yard_performance_table.save()
-            Log.logger.info(
-                f'inserted unloading zone train entry time: {unloaded_entry_time}, torpedo_id: {torpedo_id}')
-        except DoesNotExist:
-            Log.logger.critical(
-                f'update_train_unloaded_entry_info: record does not exist')
+            if self.trip_cache.update(YardPerformanceInfo, torpedo_id, {
+                    YardPerformanceInfo.unload_entry_ts: unloaded_entry_time,
+                    YardPerformanceInfo.unload_section_id: unloaded_section_id}):
+                Log.logger.info(
+                    f'inserted unloading zone train entry time: {unloaded_entry_time}, torpedo_id: {torpedo_id}')
+            else:
+                Log.logger.critical(
+                    f'update_train_unloaded_entry_info: record does not exist')
+        except Exception as ex:
+            Log.logger.critical(f'update_train_unloaded_entry_info: exception: {ex}')
 
     def update_train_unloaded_exit_info(
             self, torpedo_id, engine_id, unloaded_exit_time, unloaded_section_id):
         try:
-            yard_performance_table = YardPerformanceInfo.select().where(
-                YardPerformanceInfo.torpedo_id == torpedo_id).get()
-            yard_performance_table.unload_exit_ts = unloaded_exit_time
-            yard_performance_table.unload_section_id = unloaded_section_id
-            yard_performance_table.save()
-            Log.logger.info(
-                f'inserted unloading zone train exit time: {unloaded_exit_time}, torpedo_id: {torpedo_id}')
-        except DoesNotExist:
-            Log.logger.critical(
-                f'update_train_unloaded_exit_info: record does not exist')
+            if self.trip_cache.update(YardPerformanceInfo, torpedo_id, {
+                    YardPerformanceInfo.unload_exit_ts: unloaded_exit_time,
+                    YardPerformanceInfo.unload_section_id: unloaded_section_id}):
+                Log.logger.info(
+                    f'inserted unloading zone train exit time: {unloaded_exit_time}, torpedo_id: {torpedo_id}')
+            else:
+                Log.logger.critical(
+                    f'update_train_unloaded_exit_info: record does not exist')
+        except Exception as ex:
+            Log.logger.critical(f'update_train_unloaded_exit_info: exception: {ex}')
 
     def insert_event_info(self, event_ts, event_id, event_desc):
         try:
@@ -9,7 +9,7 @@
 '''
 
 '''import python packages'''
-from json_checker import Checker
+from json_checker import Checker, OptionalKey, Or
 import json_checker
 from typing import NamedTuple
 from os import path
@@ -40,7 +40,99 @@ class SccDlmConfRead:
             "PORT": int
         },
         "TOTAL_YARD": int,
-        "TOTAL_SECTION": int
+        "TOTAL_SECTION": int,
+        OptionalKey("INGEST_QUEUE"): {
+            "MAX_SIZE": int,
+            "OVERFLOW_POLICY": str
+        },
+        OptionalKey("DB_WRITER"): {
+            "BATCH_SIZE": int,
+            "FLUSH_INTERVAL": Or(int, float),
+            OptionalKey("MAX_PENDING_ROWS"): int,
+            OptionalKey("INGEST_METHOD"): str,
+            OptionalKey("ENGINE"): str,
+            OptionalKey("ASYNC_POOL_SIZE"): int,
+            OptionalKey("ASYNC_MAX_INFLIGHT"): int
+        },
+        OptionalKey("MQTT_SPOOL"): {
+            "MAX_MESSAGES": int,
+            "DRAIN_RATE": Or(int, float),
+            "LATEST_TOPICS": list,
+            "KEEP_ALL_TOPICS": list,
+            OptionalKey("DEFAULT_POLICY"): str,
+            OptionalKey("SPOOL_FILE"): str,
+            OptionalKey("SPOOL_FILE_SIZE"): int
+        },
+        OptionalKey("SECTION_INFO_PUBLISH"): {
+            "MODE": str,
+            "KEYFRAME_INTERVAL": Or(int, float)
+        },
+        OptionalKey("CODEC"): {
+            OptionalKey("DEFAULT"): str,
+            OptionalKey("TOPICS"): dict
+        },
+        OptionalKey("MQTT_DISPATCHER"): {
+            OptionalKey("DEFAULT_CLASS"): str,
+            OptionalKey("PREEMPT_MAX_WAIT"): Or(int, float),
+            OptionalKey("CLASSES"): dict,
+            OptionalKey("TOPICS"): dict
+        },
+        OptionalKey("DB_POOL"): {
+            OptionalKey("MAX_CONNECTIONS"): int,
+            OptionalKey("STALE_TIMEOUT"): Or(int, float),
+            OptionalKey("WAIT_TIMEOUT"): Or(int, float)
+        },
+        OptionalKey("PARTITIONING"): {
+            "ENABLE": bool,
+            OptionalKey("PRECREATE_DAYS"): int,
+            OptionalKey("DEFAULT_RETENTION_DAYS"): int,
+            OptionalKey("RETENTION_DAYS"): dict,
+            OptionalKey("EXPIRE_ACTION"): str,
+            OptionalKey("ARCHIVE_SCHEMA"): str,
+            OptionalKey("MAINTENANCE_INTERVAL"): Or(int, float)
+        },
+        OptionalKey("MQTT_PUBLISHER"): {
+            "ENABLE": bool,
+            OptionalKey("QUEUE_SIZE"): int,
+            OptionalKey("QOS"): int,
+            OptionalKey("TOPIC_QOS"): dict,
+            OptionalKey("MAX_INFLIGHT"): int,
+            OptionalKey("ACK_TIMEOUT"): Or(int, float)
+        },
+        OptionalKey("DB_JOURNAL"): {
+            "ENABLE": bool,
+            OptionalKey("JOURNAL_DIR"): str,
+            OptionalKey("SEGMENT_SIZE"): int,
+            OptionalKey("MAX_SEGMENTS"): int,
+            OptionalKey("FSYNC_INTERVAL"): Or(int, float),
+            OptionalKey("RETRY_INTERVAL"): Or(int, float),
+            OptionalKey("MAX_RETRY_INTERVAL"): Or(int, float)
+        },
+        OptionalKey("SECTION_PLAYBACK"): {
+            "MODE": str,
+            OptionalKey("KEYFRAME_INTERVAL"): Or(int, float)
+        },
+        OptionalKey("ROLLUP"): {
+            "ENABLE": bool,
+            OptionalKey("FLUSH_INTERVAL"): Or(int, float),
+            OptionalKey("MAX_GAP"): Or(int, float),
+            OptionalKey("REAGGREGATE_DELAY"): Or(int, float)
+        },
+        OptionalKey("TRAIL_THROUGH"): {
+            "ENGINE": str
+        },
+        OptionalKey("ROLE_CACHE"): {
+            OptionalKey("TTL"): Or(int, float),
+            OptionalKey("NEGATIVE_TTL"): Or(int, float),
+            OptionalKey("MAX_USERS"): int
+        },
+        OptionalKey("YARD_CONFIG_CACHE"): {
+            OptionalKey("RELOAD_DEBOUNCE"): Or(int, float),
+            OptionalKey("NOTIFY_ENABLE"): bool,
+            OptionalKey("NOTIFY_CHANNEL"): str,
+            OptionalKey("CREATE_TRIGGERS"): bool,
+            OptionalKey("NOTIFY_RETRY_INTERVAL"): Or(int, float)
+        }
     }
 
     def __init__(self):
@@ -50,6 +142,21 @@ class SccDlmConfRead:
         self.json_data = None
         self.lmb = None
         self.scc_id = None
+        self.ingest_queue = {}
+        self.db_writer = {}
+        self.mqtt_spool = {}
+        self.section_publish = {}
+        self.codec = {}
+        self.mqtt_dispatcher = {}
+        self.mqtt_publisher = {}
+        self.db_pool = {}
+        self.partitioning = {}
+        self.db_journal = {}
+        self.section_playback = {}
+        self.rollup = {}
+        self.trail_through = {}
+        self.role_cache = {}
+        self.yard_config_cache = {}
 
     def read_cfg(self, file_name):
         if path.exists(file_name): #if file exists then it will load in "self.json_data", if not then it will show error
@@ -77,6 +184,21 @@ class SccDlmConfRead:
             self.version = self.json_data['VERSION']
             self.lmb = self.json_data['LOCAL_MQTT_BROKER']
             self.scc_id = self.json_data['SCC_ID']
+            self.ingest_queue = self.json_data.get('INGEST_QUEUE', {})
+            self.db_writer = self.json_data.get('DB_WRITER', {})
+            self.mqtt_spool = self.json_data.get('MQTT_SPOOL', {})
+            self.section_publish = self.json_data.get('SECTION_INFO_PUBLISH', {})
+            self.codec = self.json_data.get('CODEC', {})
+            self.mqtt_dispatcher = self.json_data.get('MQTT_DISPATCHER', {})
+            self.mqtt_publisher = self.json_data.get('MQTT_PUBLISHER', {})
+            self.db_pool = self.json_data.get('DB_POOL', {})
+            self.partitioning = self.json_data.get('PARTITIONING', {})
+            self.db_journal = self.json_data.get('DB_JOURNAL', {})
+            self.section_playback = self.json_data.get('SECTION_PLAYBACK', {})
+            self.rollup = self.json_data.get('ROLLUP', {})
+            self.trail_through = self.json_data.get('TRAIL_THROUGH', {})
+            self.role_cache = self.json_data.get('ROLE_CACHE', {})
+            self.yard_config_cache = self.json_data.get('YARD_CONFIG_CACHE', {})
 
             self.database = DatabaseStruct(**self.json_data['DATABASE'])
             self.validate_cfg()
@@ -17,6 +17,7 @@ from peewee import * #module to write sql query in python
 from datetime import datetime
 import sys
 from playhouse.postgres_ext import * #module for some postgresql specific data types
+from scc_db_manager import *
 sys.path.insert(1, "./common") #adding common makes them import as they are installed modules
 
 if Log.logger is None:
@@ -27,26 +28,15 @@ cfg = SccDlmConfRead()
 cfg.read_cfg('../config/scc.conf')
 
 json_data = cfg.json_data
-db_name = json_data["DATABASE"]["DB_NAME"]
-user = json_data["DATABASE"]["USER"]
-password = json_data["DATABASE"]["PASSWORD"]
-host = json_data["DATABASE"]["HOST"]
-port = 5432
-psql_db = None
-
-try: #block to connect postgrsql to database
-    psql_db = PostgresqlDatabase(
-        db_name, user=user, password=password, host=host, port=port)
-    if psql_db != None:
-        psql_db.connect() #connect postgresql to database
-except Exception as e: #if any exception occurs then it will show error
-    Log.logger.critical(f'scc_dlm_model: Exception: {e}')
+
+'''shared pooled database, connections are checked out per thread on first query'''
+psql_db = init_db_manager(cfg)
 
 
 class SccModel(Model):
     """A base model that will use our Postgresql database"""
     class Meta:
-        database = psql_db
+        database = scc_db
 
 
 class SectionConfigInfo(SccModel):
@@ -93,14 +83,55 @@ class SectionInfo(SccModel):
 
 
 class SectionPlaybackInfo(SccModel):
-    ''' Section information table '''
-    ts = DoubleField()
+    ''' Section information table (full section list, keyframe of the playback) '''
+    ts = DoubleField(index=True)
     sections = JSONField()
 
     class Meta:
         table_name = "section_playback"
 
 
+class SectionPlaybackDelta(SccModel):
+    ''' Sections changed since the previous section_playback / section_playback_delta row '''
+    ts = DoubleField(index=True)
+    sections = JSONField()
+
+    class Meta:
+        table_name = "section_playback_delta"
+
+
+class SectionRollupHourly(SccModel):
+    ''' Per section occupancy, axle and direction statistics of one hour (bucket_ts: UTC hour start) '''
+    section_id = CharField()
+    bucket_ts = DoubleField()
+    occupied_time = DoubleField(default=0.0)
+    sample_count = IntegerField(default=0)
+    axle_count = IntegerField(default=0)
+    in_count = IntegerField(default=0)
+    out_count = IntegerField(default=0)
+    last_ts = DoubleField(default=0.0)
+
+    class Meta:
+        table_name = "section_rollup_hourly"
+        indexes = ((('section_id', 'bucket_ts'), True),)
+
+
+class SectionRollupDaily(SccModel):
+    ''' Per section occupancy, axle and direction statistics of one day (bucket_ts: UTC day start) '''
+    section_id = CharField()
+    bucket_ts = DoubleField()
+    occupied_time = DoubleField(default=0.0)
+    sample_count = IntegerField(default=0)
+    axle_count = IntegerField(default=0)
+    in_count = IntegerField(default=0)
+    out_count = IntegerField(default=0)
+    last_ts = DoubleField(default=0.0)
+
+    class Meta:
+        table_name = "section_rollup_daily"
+        indexes = ((('section_id', 'bucket_ts'), True),)
+
+
 class TrainTraceInfo(SccModel):
     ''' Section information table '''
     ts = DoubleField()
@@ -122,7 +153,7 @@ class TrainTraceInfo(SccModel):
 class YardPerformanceInfo(SccModel):
     ''' Yard performance information table'''
     engine_id = CharField(null=True)
-    torpedo_id = CharField(null=True)
+    torpedo_id = CharField(null=True, index=True)
     entry_ts = DoubleField(null=True)
     exit_ts = DoubleField(null=True)
     unload_entry_ts = DoubleField(null=True)
@@ -136,7 +167,7 @@ class YardPerformanceInfo(SccModel):
 class TorpedoPerformanceInfo(SccModel):
     '''Torpedo performance information table'''
     engine_id = CharField(null=True)
-    torpedo_id = CharField(null=True)
+    torpedo_id = CharField(null=True, index=True)
     entry_ts = DoubleField(null=True)
     exit_ts = DoubleField(null=True)
     unload_entry_ts = DoubleField(null=True)
@@ -0,0 +1,175 @@
+'''
+*****************************************************************************
+*File : scc_ingest.py
+*Module : SCC server
+*Purpose : Bounded ingest queue and evaluator worker for sem/section_info
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+OVERFLOW_POLICY_BLOCK = "block"
+OVERFLOW_POLICY_DROP_OLDEST = "drop_oldest"
+OVERFLOW_POLICY_COALESCE = "coalesce"
+OVERFLOW_POLICY_LIST = [OVERFLOW_POLICY_BLOCK,
+                        OVERFLOW_POLICY_DROP_OLDEST, OVERFLOW_POLICY_COALESCE]
+
+DEFAULT_QUEUE_MAX_SIZE = 100
+DEFAULT_BLOCK_TIMEOUT = 1.0
+STATS_LOG_INTERVAL = 60
+
+
+class IngestQueue:
+    '''Bounded FIFO between the MQTT network thread and the evaluator worker'''
+
+    def __init__(self, max_size=DEFAULT_QUEUE_MAX_SIZE,
+                 overflow_policy=OVERFLOW_POLICY_DROP_OLDEST, block_timeout=DEFAULT_BLOCK_TIMEOUT):
+        if max_size < 1:
+            Log.logger.warning(
+                f'ingest queue: invalid max size {max_size}, using {DEFAULT_QUEUE_MAX_SIZE}')
+            max_size = DEFAULT_QUEUE_MAX_SIZE
+        if overflow_policy not in OVERFLOW_POLICY_LIST:
+            Log.logger.warning(
+                f'ingest queue: invalid overflow policy {overflow_policy}, using {OVERFLOW_POLICY_DROP_OLDEST}')
+            overflow_policy = OVERFLOW_POLICY_DROP_OLDEST
+
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.msg_queue = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+
+        '''counters'''
+        self.enqueued_count = 0
+        self.dequeued_count = 0
+        self.dropped_count = 0
+        self.coalesced_count = 0
+        self.max_depth = 0
+
+    def put(self, payload):
+        '''enqueue payload, apply overflow policy when queue is full'''
+        with self.cond:
+            if self.closed:
+                return False
+
+            if len(self.msg_queue) >= self.max_size:
+                if self.overflow_policy == OVERFLOW_POLICY_COALESCE:
+                    '''every message is a full yard snapshot, only the latest one matters'''
+                    self.coalesced_count += len(self.msg_queue)
+                    self.msg_queue.clear()
+                elif self.overflow_policy == OVERFLOW_POLICY_DROP_OLDEST:
+                    self.msg_queue.popleft()
+                    self.dropped_count += 1
+                else:
+                    self.cond.wait_for(lambda: len(self.msg_queue) < self.max_size or self.closed,
+                                       self.block_timeout)
+                    if len(self.msg_queue) >= self.max_size or self.closed:
+                        self.dropped_count += 1
+                        return False
+
+            self.msg_queue.append((time.time(), payload))
+            self.enqueued_count += 1
+            if len(self.msg_queue) > self.max_depth:
+                self.max_depth = len(self.msg_queue)
+            self.cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        '''dequeue oldest (recv_ts, payload), None on timeout or close'''
+        with self.cond:
+            if not self.cond.wait_for(lambda: len(self.msg_queue) > 0 or self.closed, timeout):
+                return None
+            if len(self.msg_queue) == 0:
+                return None
+            item = self.msg_queue.popleft()
+            self.dequeued_count += 1
+            self.cond.notify_all()
+            return item
+
+    def depth(self):
+        with self.cond:
+            return len(self.msg_queue)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def get_stats(self):
+        with self.cond:
+            return {"depth": len(self.msg_queue),
+                    "max_depth": self.max_depth,
+                    "enqueued": self.enqueued_count,
+                    "dequeued": self.dequeued_count,
+                    "dropped": self.dropped_count,
+                    "coalesced": self.coalesced_count}
+
+
+class EvaluatorWorker(threading.Thread):
+    '''Dedicated thread which drains IngestQueue and runs the evaluator, done_fn runs after every message'''
+
+    def __init__(self, ingest_queue, handler_fn, name="scc-evaluator", done_fn=None):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.ingest_queue = ingest_queue
+        self.handler_fn = handler_fn
+        self.done_fn = done_fn
+        self.thread_quit = False
+
+        '''lag = time spent by a message in the queue before evaluation'''
+        self.processed_count = 0
+        self.error_count = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.last_stats_ts = time.time()
+
+    def run(self):
+        Log.logger.info(f'{self.name}: evaluator worker started')
+        while not self.thread_quit:
+            item = self.ingest_queue.get(timeout=1.0)
+            if item is not None:
+                recv_ts, payload = item
+                lag = time.time() - recv_ts
+                self.last_lag = lag
+                self.total_lag += lag
+                if lag > self.max_lag:
+                    self.max_lag = lag
+                try:
+                    self.handler_fn(payload, recv_ts)
+                except Exception as ex:
+                    self.error_count += 1
+                    Log.logger.critical(f'{self.name}: handler exception: {ex}')
+                if self.done_fn is not None:
+                    self.done_fn()
+                self.processed_count += 1
+
+            if time.time() - self.last_stats_ts >= STATS_LOG_INTERVAL:
+                self.last_stats_ts = time.time()
+                Log.logger.info(f'{self.name}: {self.get_stats()}')
+        Log.logger.info(f'{self.name}: evaluator worker stopped')
+
+    def stop(self):
+        self.thread_quit = True
+        self.ingest_queue.close()
+
+    def get_stats(self):
+        stats = self.ingest_queue.get_stats()
+        stats["processed"] = self.processed_count
+        stats["errors"] = self.error_count
+        stats["last_lag"] = self.last_lag
+        stats["max_lag"] = self.max_lag
+        if self.processed_count > 0:
+            stats["avg_lag"] = self.total_lag / self.processed_count
+        else:
+            stats["avg_lag"] = 0.0
+        return stats
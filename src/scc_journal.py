@@ -0,0 +1,269 @@
+'''
+*****************************************************************************
+*File : scc_journal.py
+*Module : SCC
+*Purpose : Local write-ahead journal (segment files, CRC framed records, batched fsync) for DB rows
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import os
+import json
+import struct
+import threading
+import time
+import zlib
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+DEFAULT_JOURNAL_DIR = "../../journal/scc"
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+DEFAULT_MAX_SEGMENTS = 64
+'''appends are fsynced together every FSYNC_INTERVAL seconds, 0 = fsync every append'''
+DEFAULT_FSYNC_INTERVAL = 0.05
+
+SEGMENT_FILE_SUFFIX = ".jnl"
+CHECKPOINT_FILE_NAME = "checkpoint"
+'''record: payload length, crc32 of payload; payload = json {"m": table, "f": [field], "r": [row]}'''
+RECORD_HEADER = struct.Struct('<II')
+
+
+def segment_file_name(seq):
+    return f'{seq:010d}{SEGMENT_FILE_SUFFIX}'
+
+
+class SccJournal:
+    '''Append-only journal of (table, fields, rows) records in numbered segment files.
+
+    append() only writes to the active segment file buffer, a sync thread fsyncs all
+    appends of the last fsync_interval together. A position is (segment, offset) of the
+    end of a record; commit(position) stores the checkpoint and deletes segments which
+    are fully committed. read_batch() reads records after the checkpoint for replay.
+    '''
+
+    def __init__(self, journal_dir=DEFAULT_JOURNAL_DIR, segment_size=DEFAULT_SEGMENT_SIZE,
+                 max_segments=DEFAULT_MAX_SEGMENTS, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.journal_dir = journal_dir
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.sync_cond = threading.Condition(self.lock)
+        self.thread_quit = False
+        self.dirty = False
+
+        '''statistics'''
+        self.append_count = 0
+        self.append_bytes = 0
+        self.fsync_count = 0
+        self.total_fsync_latency = 0.0
+        self.max_fsync_latency = 0.0
+        self.dropped_segments = 0
+        self.corrupt_count = 0
+
+        os.makedirs(journal_dir, exist_ok=True)
+        self.checkpoint = self.load_checkpoint()
+        segments = self.list_segments()
+        '''always start a new segment, the tail of the previous one may be torn'''
+        self.write_seq = (segments[-1] + 1) if len(segments) > 0 else self.checkpoint[0] + 1
+        self.write_fd = open(self.segment_path(self.write_seq), 'ab')
+        self.write_offset = 0
+        if len(segments) == 0:
+            self.checkpoint = (self.write_seq, 0)
+        self.read_pos = self.checkpoint
+
+        self.sync_th = threading.Thread(target=self.sync_loop, name="scc-journal-sync", daemon=True)
+        self.sync_th.start()
+
+    def segment_path(self, seq):
+        return os.path.join(self.journal_dir, segment_file_name(seq))
+
+    def list_segments(self):
+        segments = []
+        for file_name in os.listdir(self.journal_dir):
+            if file_name.endswith(SEGMENT_FILE_SUFFIX):
+                try:
+                    segments.append(int(file_name[:-len(SEGMENT_FILE_SUFFIX)]))
+                except ValueError:
+                    pass
+        return sorted(segments)
+
+    def load_checkpoint(self):
+        '''(segment, offset) of the first record not yet in the database'''
+        try:
+            with open(os.path.join(self.journal_dir, CHECKPOINT_FILE_NAME)) as f:
+                checkpoint = json.load(f)
+                return (checkpoint["segment"], checkpoint["offset"])
+        except FileNotFoundError:
+            segments = self.list_segments()
+            return (segments[0], 0) if len(segments) > 0 else (0, 0)
+        except Exception as ex:
+            Log.logger.critical(f'scc_journal: invalid checkpoint, replaying all segments: {ex}')
+            segments = self.list_segments()
+            return (segments[0], 0) if len(segments) > 0 else (0, 0)
+
+    def store_checkpoint(self, position):
+        file_name = os.path.join(self.journal_dir, CHECKPOINT_FILE_NAME)
+        tmp_file_name = file_name + ".tmp"
+        with open(tmp_file_name, 'w') as f:
+            json.dump({"segment": position[0], "offset": position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file_name, file_name)
+
+    def append(self, table_name, field_names, rows):
+        '''append one record, returns its end position'''
+        payload = json.dumps({"m": table_name, "f": field_names, "r": rows}).encode()
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            if self.write_offset > 0 and self.write_offset + len(record) > self.segment_size:
+                self.rotate()
+            self.write_fd.write(record)
+            self.write_offset += len(record)
+            self.append_count += 1
+            self.append_bytes += len(record)
+            if self.fsync_interval <= 0:
+                self.fsync()
+            elif not self.dirty:
+                self.dirty = True
+                self.sync_cond.notify()
+            return (self.write_seq, self.write_offset)
+
+    def fsync(self):
+        '''called with lock held'''
+        ts_start = time.time()
+        self.write_fd.flush()
+        os.fsync(self.write_fd.fileno())
+        latency = time.time() - ts_start
+        self.dirty = False
+        self.fsync_count += 1
+        self.total_fsync_latency += latency
+        if latency > self.max_fsync_latency:
+            self.max_fsync_latency = latency
+
+    def rotate(self):
+        '''seal active segment and open the next one, called with lock held'''
+        self.fsync()
+        self.write_fd.close()
+        self.write_seq += 1
+        self.write_fd = open(self.segment_path(self.write_seq), 'ab')
+        self.write_offset = 0
+
+        segments = self.list_segments()
+        while len(segments) > self.max_segments:
+            '''database down for too long, oldest rows are lost'''
+            oldest = segments.pop(0)
+            os.remove(self.segment_path(oldest))
+            self.dropped_segments += 1
+            Log.logger.critical(f'scc_journal: journal full, dropped segment {segment_file_name(oldest)}')
+            if self.checkpoint[0] <= oldest:
+                self.checkpoint = (oldest + 1, 0)
+            if self.read_pos[0] <= oldest:
+                self.read_pos = (oldest + 1, 0)
+
+    def sync_loop(self):
+        with self.lock:
+            while not self.thread_quit:
+                self.sync_cond.wait_for(lambda: self.dirty or self.thread_quit)
+                if self.thread_quit:
+                    break
+                '''let more appends join this fsync'''
+                self.sync_cond.wait(self.fsync_interval)
+                if self.dirty:
+                    self.fsync()
+
+    def end_position(self):
+        with self.lock:
+            return (self.write_seq, self.write_offset)
+
+    def commit(self, position):
+        '''rows up to position are in the database'''
+        try:
+            with self.lock:
+                if position <= self.checkpoint:
+                    return
+                self.checkpoint = position
+                if self.read_pos < position:
+                    self.read_pos = position
+            self.store_checkpoint(position)
+            for seq in self.list_segments():
+                if seq < position[0]:
+                    os.remove(self.segment_path(seq))
+        except Exception as ex:
+            Log.logger.critical(f'scc_journal: commit: exception: {ex}')
+
+    def rewind(self):
+        '''replay from the checkpoint, used after a failed database write'''
+        with self.lock:
+            self.read_pos = self.checkpoint
+
+    def read_batch(self, max_rows):
+        '''records after the last read position: ([(table, fields, rows)], end position, row count)'''
+        with self.lock:
+            if self.dirty:
+                self.write_fd.flush()
+            write_seq = self.write_seq
+            write_offset = self.write_offset
+            seq, offset = self.read_pos
+
+        records = []
+        row_count = 0
+        while row_count < max_rows and (seq, offset) < (write_seq, write_offset):
+            end = write_offset if seq == write_seq else None
+            try:
+                with open(self.segment_path(seq), 'rb') as f:
+                    f.seek(offset)
+                    while row_count < max_rows and (end is None or offset < end):
+                        header = f.read(RECORD_HEADER.size)
+                        if len(header) < RECORD_HEADER.size:
+                            break
+                        length, crc = RECORD_HEADER.unpack(header)
+                        payload = f.read(length)
+                        if len(payload) < length or zlib.crc32(payload) != crc:
+                            self.corrupt_count += 1
+                            Log.logger.critical(f'scc_journal: corrupt record in {segment_file_name(seq)} '
+                                                f'at {offset}, rest of segment skipped')
+                            break
+                        record = json.loads(payload)
+                        records.append((record["m"], record["f"], record["r"]))
+                        row_count += len(record["r"])
+                        offset += RECORD_HEADER.size + length
+            except FileNotFoundError:
+                pass
+            if row_count >= max_rows or seq == write_seq:
+                break
+            '''sealed segment done, continue with the next one'''
+            seq, offset = seq + 1, 0
+
+        with self.lock:
+            self.read_pos = (seq, offset)
+        return records, (seq, offset), row_count
+
+    def is_replay_pending(self):
+        with self.lock:
+            return self.read_pos < (self.write_seq, self.write_offset)
+
+    def close(self):
+        with self.lock:
+            self.thread_quit = True
+            self.fsync()
+            self.write_fd.close()
+            self.sync_cond.notify_all()
+
+    def get_stats(self):
+        with self.lock:
+            fsync_count = self.fsync_count if self.fsync_count > 0 else 1
+            return {"write_position": (self.write_seq, self.write_offset),
+                    "checkpoint": self.checkpoint,
+                    "read_position": self.read_pos,
+                    "appends": self.append_count,
+                    "append_bytes": self.append_bytes,
+                    "fsyncs": self.fsync_count,
+                    "avg_fsync_latency": self.total_fsync_latency / fsync_count,
+                    "max_fsync_latency": self.max_fsync_latency,
+                    "dropped_segments": self.dropped_segments,
+                    "corrupt_records": self.corrupt_count}
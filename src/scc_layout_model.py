@@ -14,6 +14,7 @@
 from scc_dlm_conf import *
 from scc_log import *
 from peewee import *
+from scc_db_manager import *
 from datetime import datetime
 import sys
 sys.path.insert(1, "./common")
@@ -26,26 +27,15 @@ cfg = SccDlmConfRead()
 cfg.read_cfg('../config/scc.conf')
 
 json_data = cfg.json_data
-db_name = json_data["DATABASE"]["DB_NAME"]
-user = json_data["DATABASE"]["USER"]
-password = json_data["DATABASE"]["PASSWORD"]
-host = json_data["DATABASE"]["HOST"]
-port = 5432
-psql_db = None
-
-try:
-    psql_db = PostgresqlDatabase(
-        db_name, user=user, password=password, host=host, port=port)
-    if psql_db != None:
-        psql_db.connect()
-except Exception as e:
-    Log.logger.critical(f'occ_dlm_model: Exception: {e}')
+
+'''shared pooled database, same instance as scc_dlm_model'''
+psql_db = init_db_manager(cfg)
 
 
 class OccModel(Model):
     """A base model that will use our Postgresql database"""
     class Meta:
-        database = psql_db
+        database = scc_db
 
 
 class LayoutSectionInfo(OccModel):
@@ -0,0 +1,279 @@
+'''
+*****************************************************************************
+*File : scc_partition.py
+*Module : SCC
+*Purpose : Daily range partitioning of telemetry tables with partition maintenance and retention
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+from peewee import *
+from peewee import EnclosedNodeList
+
+sys.path.insert(1, "./common")
+from scc_log import *
+from scc_dlm_model import *
+from scc_db_manager import *
+
+EXPIRE_ACTION_DROP = "drop"
+EXPIRE_ACTION_ARCHIVE = "archive"
+
+DEFAULT_PRECREATE_DAYS = 3
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_ARCHIVE_SCHEMA = "scc_archive"
+DEFAULT_MAINTENANCE_INTERVAL = 3600
+
+'''telemetry models partitioned by day on ts (epoch seconds, UTC day boundaries)'''
+PARTITIONED_MODELS = [SectionInfo, SectionPlaybackInfo, SectionPlaybackDelta, TrainTraceInfo, DpInfo]
+PARTITION_KEY = "ts"
+PARTITION_DATE_FORMAT = "%Y%m%d"
+SECONDS_PER_DAY = 86400
+
+
+def day_start(ts):
+    '''UTC midnight of the day containing ts'''
+    return datetime.fromtimestamp(ts, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def partition_name(table_name, day):
+    return f'{table_name}_p{day.strftime(PARTITION_DATE_FORMAT)}'
+
+
+def partition_day(table_name, name):
+    '''day of a partition created by partition_name, None for other tables (default partition)'''
+    prefix = f'{table_name}_p'
+    if not name.startswith(prefix):
+        return None
+    try:
+        return datetime.strptime(name[len(prefix):], PARTITION_DATE_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+class PartitionManager(threading.Thread):
+    '''Create the partitioned parent tables, pre-create future daily partitions and expire old ones.
+
+    Expired partitions are dropped or, with EXPIRE_ACTION archive, detached and moved to
+    ARCHIVE_SCHEMA, so old data never needs a mass DELETE. A default partition catches rows
+    outside every daily partition (maintenance fell behind, clock jumps); maintenance moves
+    them into the partition of their day, which is then expired like any other day.
+    Existing non partitioned tables are left untouched (logged), they have to be migrated
+    manually.
+
+    partition_cfg:
+        {"ENABLE": true, "PRECREATE_DAYS": 3, "DEFAULT_RETENTION_DAYS": 30,
+         "RETENTION_DAYS": {"section_playback": 90}, "EXPIRE_ACTION": "drop",
+         "ARCHIVE_SCHEMA": "scc_archive", "MAINTENANCE_INTERVAL": 3600}
+    '''
+
+    def __init__(self, partition_cfg=None, models=None):
+        threading.Thread.__init__(self, name="scc-partition-manager", daemon=True)
+        if partition_cfg is None:
+            partition_cfg = {}
+        self.models = models if models is not None else PARTITIONED_MODELS
+        self.precreate_days = partition_cfg.get("PRECREATE_DAYS", DEFAULT_PRECREATE_DAYS)
+        self.default_retention_days = partition_cfg.get("DEFAULT_RETENTION_DAYS", DEFAULT_RETENTION_DAYS)
+        self.retention_days = partition_cfg.get("RETENTION_DAYS", {})
+        self.expire_action = partition_cfg.get("EXPIRE_ACTION", EXPIRE_ACTION_DROP)
+        if self.expire_action not in [EXPIRE_ACTION_DROP, EXPIRE_ACTION_ARCHIVE]:
+            Log.logger.warning(f'scc_partition: invalid expire action {self.expire_action}, '
+                               f'using {EXPIRE_ACTION_DROP}')
+            self.expire_action = EXPIRE_ACTION_DROP
+        self.archive_schema = partition_cfg.get("ARCHIVE_SCHEMA", DEFAULT_ARCHIVE_SCHEMA)
+        self.maintenance_interval = partition_cfg.get("MAINTENANCE_INTERVAL", DEFAULT_MAINTENANCE_INTERVAL)
+        self.quit_event = threading.Event()
+        '''models whose table exists and is partitioned'''
+        self.managed_models = []
+
+        '''counters'''
+        self.created_count = 0
+        self.moved_rows = 0
+        self.dropped_count = 0
+        self.archived_count = 0
+        self.error_count = 0
+        self.last_run_ts = 0.0
+
+    def get_retention_days(self, model):
+        return self.retention_days.get(model._meta.table_name, self.default_retention_days)
+
+    def create_table_sql(self, model):
+        '''CREATE TABLE ... PARTITION BY RANGE (ts), primary key has to include the partition key'''
+        ctx = model._schema._create_context()
+        ctx.literal('CREATE TABLE IF NOT EXISTS ').sql(model).literal(' ')
+        pk_field = model._meta.primary_key
+        columns = []
+        for field in model._meta.sorted_fields:
+            if field is pk_field:
+                columns.append(SQL(f'"{field.column_name}" SERIAL NOT NULL'))
+            else:
+                columns.append(field.ddl(ctx))
+        columns.append(SQL(f'PRIMARY KEY ("{pk_field.column_name}", "{PARTITION_KEY}")'))
+        ctx.sql(EnclosedNodeList(columns)).literal(f' PARTITION BY RANGE ("{PARTITION_KEY}")')
+        return ctx.query()
+
+    def is_partitioned(self, table_name):
+        '''True partitioned, False plain table, None table does not exist'''
+        cursor = scc_db.execute_sql(
+            "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relname = %s AND n.nspname = current_schema()", (table_name,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0] == 'p'
+
+    def list_partitions(self, table_name):
+        cursor = scc_db.execute_sql(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "JOIN pg_namespace n ON n.oid = p.relnamespace "
+            "WHERE p.relname = %s AND n.nspname = current_schema()", (table_name,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def create_tables(self):
+        '''create partitioned parent tables, ts index and default partition, call before create_tables'''
+        self.managed_models = []
+        for model in self.models:
+            table_name = model._meta.table_name
+            try:
+                partitioned = self.is_partitioned(table_name)
+                if partitioned is False:
+                    Log.logger.warning(f'scc_partition: {table_name} exists and is not partitioned, '
+                                       f'partition maintenance skipped for it')
+                    continue
+                if partitioned is None:
+                    sql, params = self.create_table_sql(model)
+                    scc_db.execute_sql(sql, params)
+                    Log.logger.info(f'scc_partition: created partitioned table {table_name}')
+                scc_db.execute_sql(
+                    f'CREATE INDEX IF NOT EXISTS "{table_name}_{PARTITION_KEY}_idx" '
+                    f'ON "{table_name}" ("{PARTITION_KEY}")')
+                scc_db.execute_sql(
+                    f'CREATE TABLE IF NOT EXISTS "{table_name}_default" PARTITION OF "{table_name}" DEFAULT')
+                self.managed_models.append(model)
+            except Exception as ex:
+                self.error_count += 1
+                Log.logger.critical(f'scc_partition: create_tables: {table_name}: exception: {ex}')
+
+    def default_partition_days(self, table_name):
+        '''UTC days having rows in the default partition'''
+        cursor = scc_db.execute_sql(
+            f'SELECT DISTINCT floor("{PARTITION_KEY}" / {SECONDS_PER_DAY}) FROM "{table_name}_default"')
+        return [datetime.fromtimestamp(row[0] * SECONDS_PER_DAY, timezone.utc) for row in cursor.fetchall()]
+
+    def create_partition(self, table_name, day, move_rows):
+        '''create the partition of day, with move_rows the rows of day are moved out of the default partition.
+
+        postgres refuses a new partition while the default partition holds rows of its range,
+        the default partition is detached, the rows moved and the default attached again in
+        one transaction.
+        '''
+        name = partition_name(table_name, day)
+        default_name = f'{table_name}_default'
+        day_from = day.timestamp()
+        day_to = (day + timedelta(days=1)).timestamp()
+        if not move_rows:
+            scc_db.execute_sql(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table_name}" '
+                f'FOR VALUES FROM ({day_from}) TO ({day_to})')
+            self.created_count += 1
+            Log.logger.info(f'scc_partition: created partition {name}')
+            return
+        with scc_db.atomic():
+            scc_db.execute_sql(f'ALTER TABLE "{table_name}" DETACH PARTITION "{default_name}"')
+            scc_db.execute_sql(
+                f'CREATE TABLE "{name}" PARTITION OF "{table_name}" FOR VALUES FROM ({day_from}) TO ({day_to})')
+            cursor = scc_db.execute_sql(
+                f'WITH moved AS (DELETE FROM "{default_name}" '
+                f'WHERE "{PARTITION_KEY}" >= %s AND "{PARTITION_KEY}" < %s RETURNING *) '
+                f'INSERT INTO "{name}" SELECT * FROM moved', (day_from, day_to))
+            moved_rows = cursor.rowcount
+            scc_db.execute_sql(f'ALTER TABLE "{table_name}" ATTACH PARTITION "{default_name}" DEFAULT')
+        self.created_count += 1
+        self.moved_rows += moved_rows
+        Log.logger.warning(f'scc_partition: created partition {name}, moved {moved_rows} rows '
+                           f'from {default_name}')
+
+    def ensure_partitions(self, model, now):
+        '''create daily partitions from today up to precreate_days ahead and for the days in the default partition'''
+        table_name = model._meta.table_name
+        existing = set(self.list_partitions(table_name))
+        today = day_start(now)
+        days = set(today + timedelta(days=day_idx) for day_idx in range(self.precreate_days + 1))
+        default_days = set(self.default_partition_days(table_name))
+        for day in sorted(days | default_days):
+            if partition_name(table_name, day) in existing:
+                continue
+            self.create_partition(table_name, day, day in default_days)
+
+    def expire_partitions(self, model, now):
+        '''drop or archive daily partitions entirely older than the retention period'''
+        table_name = model._meta.table_name
+        oldest_kept = day_start(now) - timedelta(days=self.get_retention_days(model))
+        for name in self.list_partitions(table_name):
+            day = partition_day(table_name, name)
+            if day is None or day >= oldest_kept:
+                continue
+            with scc_db.atomic():
+                if self.expire_action == EXPIRE_ACTION_ARCHIVE:
+                    scc_db.execute_sql(f'CREATE SCHEMA IF NOT EXISTS "{self.archive_schema}"')
+                    scc_db.execute_sql(f'ALTER TABLE "{table_name}" DETACH PARTITION "{name}"')
+                    scc_db.execute_sql(f'ALTER TABLE "{name}" SET SCHEMA "{self.archive_schema}"')
+                    self.archived_count += 1
+                    Log.logger.info(f'scc_partition: archived partition {name} to {self.archive_schema}')
+                else:
+                    scc_db.execute_sql(f'DROP TABLE "{name}"')
+                    self.dropped_count += 1
+                    Log.logger.info(f'scc_partition: dropped partition {name}')
+
+    def run_maintenance(self, now=None):
+        if now is None:
+            now = time.time()
+        for model in self.managed_models:
+            try:
+                self.ensure_partitions(model, now)
+                self.expire_partitions(model, now)
+            except Exception as ex:
+                self.error_count += 1
+                Log.logger.critical(f'scc_partition: maintenance of {model._meta.table_name}: exception: {ex}')
+        self.last_run_ts = time.time()
+
+    def run(self):
+        Log.logger.info(f'scc_partition: partition manager started, interval: {self.maintenance_interval}s')
+        while True:
+            self.run_maintenance()
+            '''return the connection to the pool between runs'''
+            db_manager.release()
+            if self.quit_event.wait(self.maintenance_interval):
+                break
+        Log.logger.info(f'scc_partition: partition manager stopped, {self.get_stats()}')
+
+    def stop(self):
+        self.quit_event.set()
+
+    def get_stats(self):
+        return {"tables": [model._meta.table_name for model in self.managed_models],
+                "created": self.created_count,
+                "moved_rows": self.moved_rows,
+                "dropped": self.dropped_count,
+                "archived": self.archived_count,
+                "errors": self.error_count,
+                "last_run_ts": self.last_run_ts}
+
+
+if __name__ == '__main__':
+    if Log.logger is None:
+        my_log = Log()
+
+    partition_manager = PartitionManager(cfg.partitioning)
+    if db_manager.connect():
+        partition_manager.create_tables()
+        partition_manager.run_maintenance()
+        Log.logger.info(f'partition stats: {partition_manager.get_stats()}')
+    sys.exit(0)
@@ -0,0 +1,253 @@
+'''
+*****************************************************************************
+*File : scc_playback.py
+*Module : SCC
+*Purpose : Keyframe plus diff section playback storage, yard state at time and replay stream
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import json
+import time
+import heapq
+import threading
+
+from peewee import *
+from playhouse.postgres_ext import PostgresqlExtDatabase, ServerSide
+
+sys.path.insert(1, "./common")
+from scc_log import *
+from scc_dlm_model import *
+
+PLAYBACK_MODE_FULL = "full"
+PLAYBACK_MODE_KEYFRAME_DELTA = "keyframe_delta"
+
+DEFAULT_PLAYBACK_KEYFRAME_INTERVAL = 30
+DEFAULT_PLAYBACK_PAGE_SIZE = 1000
+
+SECTION_PLAYBACK_KEYFRAME_FIELDS = [
+    SectionPlaybackInfo.ts,
+    SectionPlaybackInfo.sections]
+
+SECTION_PLAYBACK_DELTA_FIELDS = [
+    SectionPlaybackDelta.ts,
+    SectionPlaybackDelta.sections]
+
+
+class PlaybackRecorder:
+    '''Turn section snapshots into section_playback keyframes and section_playback_delta rows.
+
+    keyframe (section_playback)      : ts, [section, ...] every keyframe_interval seconds (message ts)
+    delta    (section_playback_delta): ts, {section_id: section} of the sections changed since
+                                       the previous row, messages without change are not stored
+    '''
+
+    def __init__(self, keyframe_interval=DEFAULT_PLAYBACK_KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.lock = threading.Lock()
+        self.last_sections = {}
+        self.last_keyframe_ts = None
+
+        '''counters'''
+        self.keyframe_count = 0
+        self.delta_count = 0
+        self.delta_section_count = 0
+        self.unchanged_count = 0
+
+    def request_keyframe(self):
+        with self.lock:
+            self.last_keyframe_ts = None
+
+    def record(self, ts, section_msg_list):
+        '''(model, fields, rows) to write for one message, None when nothing changed'''
+        with self.lock:
+            if self.last_keyframe_ts is None or ts < self.last_keyframe_ts or \
+                    ts - self.last_keyframe_ts >= self.keyframe_interval:
+                self.last_keyframe_ts = ts
+                self.last_sections = {}
+                for section_msg in section_msg_list:
+                    self.last_sections[section_msg["section_id"]] = section_msg
+                self.keyframe_count += 1
+                return SectionPlaybackInfo, SECTION_PLAYBACK_KEYFRAME_FIELDS, [(ts, section_msg_list)]
+
+            changed_sections = {}
+            for section_msg in section_msg_list:
+                section_id = section_msg["section_id"]
+                if self.last_sections.get(section_id) != section_msg:
+                    changed_sections[section_id] = section_msg
+                    self.last_sections[section_id] = section_msg
+            if len(changed_sections) == 0:
+                self.unchanged_count += 1
+                return None
+            self.delta_count += 1
+            self.delta_section_count += len(changed_sections)
+            return SectionPlaybackDelta, SECTION_PLAYBACK_DELTA_FIELDS, [(ts, changed_sections)]
+
+    def get_stats(self):
+        with self.lock:
+            return {"keyframes": self.keyframe_count,
+                    "deltas": self.delta_count,
+                    "delta_sections": self.delta_section_count,
+                    "unchanged": self.unchanged_count}
+
+
+def apply_playback_row(state, sections):
+    '''keyframe (list) replaces the state, delta (dict) updates it'''
+    if isinstance(sections, list):
+        state.clear()
+        for section_msg in sections:
+            state[section_msg["section_id"]] = section_msg
+    else:
+        state.update(sections)
+
+
+def load_yard_state(ts, inclusive=True):
+    '''(state ts, {section_id: section}) from the nearest keyframe at (or before) ts plus the deltas after it'''
+    if inclusive:
+        keyframe_cond = SectionPlaybackInfo.ts <= ts
+        delta_cond = SectionPlaybackDelta.ts <= ts
+    else:
+        keyframe_cond = SectionPlaybackInfo.ts < ts
+        delta_cond = SectionPlaybackDelta.ts < ts
+    keyframe = (SectionPlaybackInfo
+                .select(SectionPlaybackInfo.ts, SectionPlaybackInfo.sections)
+                .where(keyframe_cond)
+                .order_by(SectionPlaybackInfo.ts.desc())
+                .limit(1)
+                .tuples()
+                .first())
+    state = {}
+    if keyframe is None:
+        return None, state
+    state_ts, sections = keyframe
+    apply_playback_row(state, sections)
+    deltas = (SectionPlaybackDelta
+              .select(SectionPlaybackDelta.ts, SectionPlaybackDelta.sections)
+              .where((SectionPlaybackDelta.ts > state_ts) & delta_cond)
+              .order_by(SectionPlaybackDelta.ts)
+              .tuples())
+    for state_ts, sections in deltas.iterator():
+        apply_playback_row(state, sections)
+    return state_ts, state
+
+
+def get_yard_state_at(ts):
+    '''{"ts", "sections"} of the yard at ts, None when no keyframe exists before ts'''
+    state_ts, state = load_yard_state(ts)
+    if state_ts is None:
+        return None
+    return {"ts": state_ts, "sections": list(state.values())}
+
+
+def iterate_rows(query, page_size):
+    '''rows of a .tuples() query with constant memory: server side cursor fetching page_size
+    rows per round trip on PostgreSQL (caller holds a transaction), client side iterator otherwise'''
+    database = query._database
+    if isinstance(getattr(database, 'obj', database), PostgresqlExtDatabase):
+        return ServerSide(query, array_size=page_size)
+    return query.iterator()
+
+
+def read_section_playback(t0, t1, section_ids=None, page_size=DEFAULT_PLAYBACK_PAGE_SIZE, after_t0=False):
+    '''yield {"ts", "sections"} for every stored playback row with t0 <= ts <= t1 (t0 < ts with after_t0).
+
+    Works for full (every row a keyframe) and keyframe_delta storage. With section_ids only
+    those sections are returned and rows changing none of them are skipped. Memory does
+    not depend on the time range, rows are streamed page_size at a time.
+    '''
+    if section_ids is not None:
+        section_ids = set(section_ids)
+    state_ts, state = load_yard_state(t0, inclusive=after_t0)
+    if after_t0:
+        keyframe_cond = (SectionPlaybackInfo.ts > t0) & (SectionPlaybackInfo.ts <= t1)
+        delta_cond = (SectionPlaybackDelta.ts > t0) & (SectionPlaybackDelta.ts <= t1)
+    else:
+        keyframe_cond = (SectionPlaybackInfo.ts >= t0) & (SectionPlaybackInfo.ts <= t1)
+        delta_cond = (SectionPlaybackDelta.ts >= t0) & (SectionPlaybackDelta.ts <= t1)
+    keyframes = (SectionPlaybackInfo
+                 .select(SectionPlaybackInfo.ts, SectionPlaybackInfo.sections)
+                 .where(keyframe_cond)
+                 .order_by(SectionPlaybackInfo.ts)
+                 .tuples())
+    deltas = (SectionPlaybackDelta
+              .select(SectionPlaybackDelta.ts, SectionPlaybackDelta.sections)
+              .where(delta_cond)
+              .order_by(SectionPlaybackDelta.ts)
+              .tuples())
+
+    '''server side cursors only live inside a transaction'''
+    with SectionPlaybackInfo._meta.database.atomic():
+        for ts, sections in heapq.merge(iterate_rows(keyframes, page_size), iterate_rows(deltas, page_size),
+                                        key=lambda row: row[0]):
+            apply_playback_row(state, sections)
+            if section_ids is None:
+                yield {"ts": ts, "sections": list(state.values())}
+            elif isinstance(sections, list) or not section_ids.isdisjoint(sections):
+                yield {"ts": ts, "sections": [state[section_id] for section_id in state
+                                              if section_id in section_ids]}
+
+
+def read_section_playback_page(t0, t1, section_ids=None, page_size=DEFAULT_PLAYBACK_PAGE_SIZE, after_t0=False):
+    '''one page for the website: {"messages": [...], "next_t0": ts or None}, next page with after_t0=True'''
+    messages = []
+    for msg in read_section_playback(t0, t1, section_ids, page_size, after_t0):
+        messages.append(msg)
+        if len(messages) >= page_size:
+            break
+    next_t0 = messages[-1]["ts"] if len(messages) >= page_size else None
+    return {"messages": messages, "next_t0": next_t0}
+
+
+def stream_playback(t0, t1, speed=1.0, section_ids=None, page_size=DEFAULT_PLAYBACK_PAGE_SIZE):
+    '''yield {"ts", "sections"} yard state for every stored change between t0 and t1.
+
+    The first state is the yard state at t0, following states are paced at speed times
+    real time (speed <= 0: as fast as possible) for UI replay. Rows are read one page
+    (own short transaction) at a time, no cursor stays open while pacing.
+    '''
+    state_msg = get_yard_state_at(t0)
+    if state_msg is not None:
+        sections = state_msg["sections"]
+        if section_ids is not None:
+            sections = [section for section in sections if section["section_id"] in section_ids]
+        yield {"ts": t0, "sections": sections}
+
+    wall_start = time.time()
+    page_t0 = t0
+    while page_t0 is not None:
+        page = read_section_playback_page(page_t0, t1, section_ids, page_size, after_t0=True)
+        for msg in page["messages"]:
+            if speed > 0:
+                delay = wall_start + (msg["ts"] - t0) / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            yield msg
+        page_t0 = page["next_t0"]
+
+
+if __name__ == '__main__':
+    if Log.logger is None:
+        my_log = Log()
+
+    '''storage of one hour of 1s messages, 14 sections, one section changing per message'''
+    recorder = PlaybackRecorder()
+    sections = [{"section_id": "S" + str(i + 1), "section_status": "vacant", "engine_axle_count": 0,
+                 "torpedo_axle_count": 0, "direction": "none", "speed": 0.0, "torpedo_status": "none",
+                 "first_axle": "none", "error_code": 0} for i in range(14)]
+    full_bytes = 0
+    stored_bytes = 0
+    ts = time.time()
+    for msg_idx in range(3600):
+        section = dict(sections[msg_idx % 14])
+        section["section_status"] = "occupied" if section["section_status"] == "vacant" else "vacant"
+        sections[msg_idx % 14] = section
+        full_bytes += len(json.dumps(sections))
+        result = recorder.record(ts + msg_idx, list(sections))
+        if result is not None:
+            stored_bytes += len(json.dumps(result[2][0][1]))
+    Log.logger.info(f'playback storage: full {full_bytes} bytes, keyframe+delta {stored_bytes} bytes, '
+                    f'{full_bytes / stored_bytes:.1f}x, {recorder.get_stats()}')
+    sys.exit(0)
@@ -0,0 +1,83 @@
+'''
+*****************************************************************************
+*File : scc_playback_export.py
+*Module : SCC
+*Purpose : Command line export of section playback for a time range (csv or json lines)
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import csv
+import json
+import argparse
+from datetime import datetime
+
+sys.path.insert(1, "./common")
+from scc_log import *
+from scc_playback import *
+
+EXPORT_FORMAT_CSV = "csv"
+EXPORT_FORMAT_JSONL = "jsonl"
+
+CSV_COLUMNS = ["ts", "section_id", "section_status", "engine_axle_count", "torpedo_axle_count",
+               "direction", "speed", "torpedo_status", "first_axle"]
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_time(value):
+    '''epoch seconds or local time "YYYY-mm-dd HH:MM:SS"'''
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.strptime(value, TIME_FORMAT).timestamp()
+
+
+def export_playback(out_file, t0, t1, section_ids=None, export_format=EXPORT_FORMAT_CSV,
+                    page_size=DEFAULT_PLAYBACK_PAGE_SIZE):
+    '''write playback messages between t0 and t1 to out_file, returns number of messages'''
+    msg_count = 0
+    if export_format == EXPORT_FORMAT_CSV:
+        writer = csv.writer(out_file)
+        writer.writerow(CSV_COLUMNS)
+        for msg in read_section_playback(t0, t1, section_ids, page_size):
+            for section in msg["sections"]:
+                writer.writerow([msg["ts"]] + [section.get(column) for column in CSV_COLUMNS[1:]])
+            msg_count += 1
+    else:
+        for msg in read_section_playback(t0, t1, section_ids, page_size):
+            out_file.write(json.dumps(msg))
+            out_file.write("\n")
+            msg_count += 1
+    return msg_count
+
+
+if __name__ == '__main__':
+    if Log.logger is None:
+        my_log = Log()
+
+    parser = argparse.ArgumentParser(description="export section playback between two times")
+    parser.add_argument("--from", dest="t0", required=True, help=f'epoch seconds or "{TIME_FORMAT}"')
+    parser.add_argument("--to", dest="t1", required=True, help=f'epoch seconds or "{TIME_FORMAT}"')
+    parser.add_argument("--sections", help="comma separated section ids, default all sections")
+    parser.add_argument("--format", choices=[EXPORT_FORMAT_CSV, EXPORT_FORMAT_JSONL], default=EXPORT_FORMAT_CSV)
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PLAYBACK_PAGE_SIZE)
+    parser.add_argument("--output", help="output file, default stdout")
+    args = parser.parse_args()
+
+    section_ids = args.sections.split(",") if args.sections else None
+    out_file = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        msg_count = export_playback(out_file, parse_time(args.t0), parse_time(args.t1), section_ids,
+                                    args.format, args.page_size)
+        Log.logger.info(f'scc_playback_export: exported {msg_count} playback messages')
+    except Exception as ex:
+        Log.logger.critical(f'scc_playback_export: exception: {ex}')
+        sys.exit(1)
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
+    sys.exit(0)
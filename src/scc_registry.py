@@ -0,0 +1,128 @@
+'''
+*****************************************************************************
+*File : scc_registry.py
+*Module : SCC server
+*Purpose : Section and point registries, lookup by id and dense integer index
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+
+class SectionRegistry:
+    '''Sections of the yard in configuration order.
+
+    sections[idx] is the dense array view (idx is also stored in section.my_idx),
+    get(section_id) and index_of(section_id) are dict lookups.
+    '''
+
+    def __init__(self):
+        self.sections = []
+        self.section_idx = {}
+        self.dense_idx = {}
+
+    def add(self, section):
+        '''register section, a section id already registered is replaced in place'''
+        idx = self.dense_idx.get(section.section_id)
+        if idx is None:
+            idx = len(self.sections)
+            self.sections.append(section)
+            self.dense_idx[section.section_id] = idx
+        else:
+            self.sections[idx] = section
+        section.my_idx = idx
+        self.section_idx[section.section_id] = section
+        return idx
+
+    def get(self, section_id):
+        return self.section_idx.get(section_id)
+
+    def index_of(self, section_id):
+        '''dense index of section_id, -1 when unknown'''
+        return self.dense_idx.get(section_id, -1)
+
+    def ids(self):
+        return [section.section_id for section in self.sections]
+
+    def get_dp_list(self, section_id):
+        section = self.section_idx.get(section_id)
+        return section.dp_id if section is not None else []
+
+    def get_status(self, section_id):
+        section = self.section_idx.get(section_id)
+        return section.section_status if section is not None else "none"
+
+    def __getitem__(self, idx):
+        return self.sections[idx]
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __contains__(self, section_id):
+        return section_id in self.section_idx
+
+
+class PointRegistry:
+    '''Points (point machines) by point_id, dense index and points of each section'''
+
+    def __init__(self):
+        self.points = []
+        self.point_idx = {}
+        self.dense_idx = {}
+        self.section_points = {}
+
+    def add(self, point):
+        idx = self.dense_idx.get(point.point_id)
+        if idx is None:
+            idx = len(self.points)
+            self.points.append(point)
+            self.dense_idx[point.point_id] = idx
+        else:
+            old_point = self.points[idx]
+            self.section_points.get(old_point.section_id, []).remove(old_point)
+            self.points[idx] = point
+        self.point_idx[point.point_id] = point
+        self.section_points.setdefault(point.section_id, []).append(point)
+        return idx
+
+    def get(self, point_id):
+        return self.point_idx.get(point_id)
+
+    def index_of(self, point_id):
+        '''dense index of point_id, -1 when unknown'''
+        return self.dense_idx.get(point_id, -1)
+
+    def get_section_points(self, section_id):
+        return self.section_points.get(section_id, [])
+
+    def update_status(self, point_msg):
+        '''apply pms/point_info message, False for an unknown point'''
+        point = self.point_idx.get(point_msg["point_id"])
+        if point is None:
+            return False
+        point.point_status = point_msg["point_status"]
+        point.point_mode = point_msg["point_mode"]
+        point.error_code = point_msg["error_code"]
+        point.ts = point_msg["ts"]
+        return True
+
+    def __getitem__(self, idx):
+        return self.points[idx]
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, point_id):
+        return point_id in self.point_idx
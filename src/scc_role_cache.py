@@ -0,0 +1,121 @@
+'''
+*****************************************************************************
+*File : scc_role_cache.py
+*Module : SCC
+*Purpose : User role cache (username -> roles) with TTL, LRU eviction and negative caching
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+DEFAULT_ROLE_CACHE_TTL = 300
+DEFAULT_ROLE_CACHE_NEGATIVE_TTL = 30
+DEFAULT_ROLE_CACHE_MAX_USERS = 256
+
+'''admin topic, {"username": "<name>"} drops one user, {} or no username drops all users'''
+USER_ROLES_INVALIDATE_TOPIC = "cwsm/user_roles_invalidate"
+
+
+class UserRoleCache:
+    '''roles of a username read from user_details, kept for ttl seconds.
+
+    An unknown username is cached as None for negative_ttl seconds so repeated
+    reset commands of an unknown user do not query the database either. At most
+    max_users entries are kept, the least recently used is evicted first. A
+    database error is not cached, the next request queries again.
+    '''
+
+    def __init__(self, ttl=DEFAULT_ROLE_CACHE_TTL, negative_ttl=DEFAULT_ROLE_CACHE_NEGATIVE_TTL,
+                 max_users=DEFAULT_ROLE_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        '''username -> (expiry time, roles or None), least recently used first'''
+        self.users = OrderedDict()
+
+        '''statistics'''
+        self.hit_count = 0
+        self.negative_hit_count = 0
+        self.miss_count = 0
+        self.expired_count = 0
+        self.eviction_count = 0
+        self.invalidation_count = 0
+
+    def lookup(self, username):
+        '''(True, roles) for a valid entry, (False, None) when the database has to be queried'''
+        with self.lock:
+            entry = self.users.get(username)
+            if entry is not None:
+                expiry, roles = entry
+                if time.monotonic() < expiry:
+                    self.users.move_to_end(username)
+                    if roles is None:
+                        self.negative_hit_count += 1
+                    else:
+                        self.hit_count += 1
+                    return True, roles
+                del self.users[username]
+                self.expired_count += 1
+            self.miss_count += 1
+            return False, None
+
+    def store(self, username, roles):
+        '''cache roles of username, None caches an unknown user'''
+        ttl = self.negative_ttl if roles is None else self.ttl
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.users[username] = (time.monotonic() + ttl, roles)
+            self.users.move_to_end(username)
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+                self.eviction_count += 1
+
+    def get(self, username, read_roles):
+        '''roles of username, read_roles(username) is called on a miss'''
+        found, roles = self.lookup(username)
+        if found:
+            return roles
+        roles = read_roles(username)
+        self.store(username, roles)
+        return roles
+
+    def invalidate(self, username=None):
+        '''drop one username, all users when username is None'''
+        with self.lock:
+            if username is None:
+                self.users.clear()
+            else:
+                self.users.pop(username, None)
+            self.invalidation_count += 1
+        Log.logger.info(f'scc_role_cache: user roles invalidated: {username if username is not None else "all users"}')
+
+    def invalidate_sub_fn(self, in_client, user_data, message):
+        '''cwsm/user_roles_invalidate subscribe function'''
+        try:
+            payload = message.payload
+            invalidate_msg = json.loads(payload) if len(payload) != 0 else {}
+            self.invalidate(invalidate_msg.get("username"))
+        except Exception as ex:
+            Log.logger.critical(f'scc_role_cache: invalidate_sub_fn: exception: {ex}')
+
+    def get_stats(self):
+        with self.lock:
+            return {"users": len(self.users),
+                    "hits": self.hit_count,
+                    "negative_hits": self.negative_hit_count,
+                    "misses": self.miss_count,
+                    "expired": self.expired_count,
+                    "evictions": self.eviction_count,
+                    "invalidations": self.invalidation_count}
@@ -0,0 +1,298 @@
+'''
+*****************************************************************************
+*File : scc_rollup.py
+*Module : SCC
+*Purpose : Incrementally maintained hourly and daily per section rollups with late data re-aggregation
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import time
+import threading
+
+from peewee import *
+
+sys.path.insert(1, "./common")
+from scc_log import *
+from scc_dlm_model import *
+from scc_db_manager import *
+
+HOUR_SECONDS = 3600
+DAY_SECONDS = 86400
+
+ROLLUP_GRANULARITY_HOURLY = "hourly"
+ROLLUP_GRANULARITY_DAILY = "daily"
+ROLLUP_MODELS = {ROLLUP_GRANULARITY_HOURLY: SectionRollupHourly,
+                 ROLLUP_GRANULARITY_DAILY: SectionRollupDaily}
+
+DEFAULT_ROLLUP_FLUSH_INTERVAL = 10
+'''longer gaps between two messages are not counted as occupied time'''
+DEFAULT_ROLLUP_MAX_GAP = 10
+'''closed hours are re-aggregated this long after their end, so queued rows are in the section table'''
+DEFAULT_REAGGREGATE_DELAY = 60
+
+'''counter columns, index in the increment list'''
+ROLLUP_COLUMNS = ["occupied_time", "sample_count", "axle_count", "in_count", "out_count", "last_ts"]
+OCCUPIED_TIME, SAMPLE_COUNT, AXLE_COUNT, IN_COUNT, OUT_COUNT, LAST_TS = range(len(ROLLUP_COLUMNS))
+
+SECTION_STATUS_OCCUPIED = "occupied"
+
+
+def bucket_start(ts, bucket_seconds):
+    '''UTC hour / day start of ts'''
+    return float(int(ts // bucket_seconds) * bucket_seconds)
+
+
+class RollupAccumulator:
+    '''Turn a per section ordered stream of section states into per (section, hour) increments.
+
+    occupied_time: seconds a section is occupied (gap to the next message, at most max_gap)
+    axle_count   : axles entering the section (increase of engine + torpedo axle count)
+    in_count     : occupations starting with direction in, out_count: with direction out
+    '''
+
+    def __init__(self, max_gap=DEFAULT_ROLLUP_MAX_GAP):
+        self.max_gap = max_gap
+        '''section_id -> (ts, section_status, axle count)'''
+        self.last_state = {}
+        '''(section_id, hour bucket_ts) -> [occupied_time, sample_count, axle_count, in_count, out_count, last_ts]'''
+        self.increments = {}
+
+    def get_increment(self, section_id, ts):
+        key = (section_id, bucket_start(ts, HOUR_SECONDS))
+        increment = self.increments.get(key)
+        if increment is None:
+            increment = [0.0, 0, 0, 0, 0, 0.0]
+            self.increments[key] = increment
+        return increment
+
+    def add(self, section_id, ts, section_status, engine_axle_count, torpedo_axle_count, direction, count=True):
+        '''add one section state, False when it is older than the last one of the section (late data).
+        count=False only seeds the last state (row before a re-aggregated hour)'''
+        axles = (engine_axle_count or 0) + (torpedo_axle_count or 0)
+        last = self.last_state.get(section_id)
+        if last is not None and ts <= last[0]:
+            return False
+        self.last_state[section_id] = (ts, section_status, axles)
+        if not count:
+            return True
+
+        if last is not None and last[1] == SECTION_STATUS_OCCUPIED:
+            self.get_increment(section_id, last[0])[OCCUPIED_TIME] += min(ts - last[0], self.max_gap)
+        increment = self.get_increment(section_id, ts)
+        increment[SAMPLE_COUNT] += 1
+        increment[LAST_TS] = ts
+        if last is not None:
+            if axles > last[2]:
+                increment[AXLE_COUNT] += axles - last[2]
+            if section_status == SECTION_STATUS_OCCUPIED and last[1] != SECTION_STATUS_OCCUPIED:
+                if direction == "in":
+                    increment[IN_COUNT] += 1
+                elif direction == "out":
+                    increment[OUT_COUNT] += 1
+        return True
+
+    def take_increments(self):
+        increments = self.increments
+        self.increments = {}
+        return increments
+
+
+def to_rollup_rows(increments, bucket_seconds):
+    '''hour increments -> rows of bucket_seconds buckets'''
+    buckets = {}
+    for (section_id, hour_ts), increment in increments.items():
+        key = (section_id, bucket_start(hour_ts, bucket_seconds))
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = list(increment)
+        else:
+            for idx in range(LAST_TS):
+                bucket[idx] += increment[idx]
+            bucket[LAST_TS] = max(bucket[LAST_TS], increment[LAST_TS])
+    return [dict(zip(["section_id", "bucket_ts"] + ROLLUP_COLUMNS, [section_id, bucket_ts] + values))
+            for (section_id, bucket_ts), values in buckets.items()]
+
+
+def upsert_rollup(model, rows, replace=False):
+    '''INSERT ... ON CONFLICT (section_id, bucket_ts) DO UPDATE, adds the counters or replaces them'''
+    if len(rows) == 0:
+        return
+    if replace:
+        update = {getattr(model, column): getattr(EXCLUDED, column) for column in ROLLUP_COLUMNS}
+    else:
+        update = {getattr(model, column): getattr(model, column) + getattr(EXCLUDED, column)
+                  for column in ROLLUP_COLUMNS[:LAST_TS]}
+        update[model.last_ts] = fn.GREATEST(model.last_ts, EXCLUDED.last_ts)
+    (model
+     .insert_many(rows)
+     .on_conflict(conflict_target=[model.section_id, model.bucket_ts], update=update)
+     .execute())
+
+
+class SectionRollup(threading.Thread):
+    '''Maintain section_rollup_hourly / section_rollup_daily while messages arrive.
+
+    add() runs on the evaluator and only updates in-memory increments, the rollup thread
+    upserts them every flush_interval (counters are added). A message older than the last
+    one of a section marks its hour dirty, dirty hours are rebuilt from the section table
+    once closed (reaggregate_delay after the hour end) and the day row is re-summed from
+    the hour rows.
+    '''
+
+    def __init__(self, rollup_cfg=None):
+        threading.Thread.__init__(self, name="scc-section-rollup", daemon=True)
+        if rollup_cfg is None:
+            rollup_cfg = {}
+        self.flush_interval = rollup_cfg.get("FLUSH_INTERVAL", DEFAULT_ROLLUP_FLUSH_INTERVAL)
+        self.max_gap = rollup_cfg.get("MAX_GAP", DEFAULT_ROLLUP_MAX_GAP)
+        self.reaggregate_delay = rollup_cfg.get("REAGGREGATE_DELAY", DEFAULT_REAGGREGATE_DELAY)
+        self.lock = threading.Lock()
+        self.accumulator = RollupAccumulator(self.max_gap)
+        self.dirty_hours = set()
+        self.quit_event = threading.Event()
+
+        '''counters'''
+        self.msg_count = 0
+        self.late_count = 0
+        self.flush_count = 0
+        self.upsert_rows = 0
+        self.reaggregate_count = 0
+        self.error_count = 0
+
+    def add(self, snapshot):
+        '''account one section snapshot'''
+        with self.lock:
+            self.msg_count += 1
+            late = False
+            for section in snapshot.sections:
+                if not self.accumulator.add(section.section_id, snapshot.ts, section.section_status,
+                                            section.engine_axle_count, section.torpedo_axle_count,
+                                            section.direction):
+                    late = True
+            if late:
+                self.mark_dirty(snapshot.ts)
+
+    def mark_dirty(self, ts):
+        '''called with lock held, the next hour depends on ts when it is within max_gap of its start'''
+        self.late_count += 1
+        hour_ts = bucket_start(ts, HOUR_SECONDS)
+        self.dirty_hours.add(hour_ts)
+        if ts + self.max_gap >= hour_ts + HOUR_SECONDS:
+            self.dirty_hours.add(hour_ts + HOUR_SECONDS)
+
+    def flush(self):
+        with self.lock:
+            increments = self.accumulator.take_increments()
+        if len(increments) == 0:
+            return
+        try:
+            with scc_db.atomic():
+                hourly_rows = to_rollup_rows(increments, HOUR_SECONDS)
+                upsert_rollup(SectionRollupHourly, hourly_rows)
+                upsert_rollup(SectionRollupDaily, to_rollup_rows(increments, DAY_SECONDS))
+            self.flush_count += 1
+            self.upsert_rows += len(hourly_rows)
+        except Exception as ex:
+            '''counters are retried with the next flush'''
+            self.error_count += 1
+            with self.lock:
+                for key, increment in increments.items():
+                    pending = self.accumulator.increments.get(key)
+                    if pending is None:
+                        self.accumulator.increments[key] = increment
+                    else:
+                        for idx in range(LAST_TS):
+                            pending[idx] += increment[idx]
+                        pending[LAST_TS] = max(pending[LAST_TS], increment[LAST_TS])
+            Log.logger.critical(f'scc_rollup: flush of {len(increments)} increments failed: {ex}')
+
+    def reaggregate_hour(self, hour_ts):
+        '''rebuild one hour from the section table, then re-sum its day'''
+        accumulator = RollupAccumulator(self.max_gap)
+        rows = (SectionInfo
+                .select(SectionInfo.section_id, SectionInfo.ts, SectionInfo.section_status,
+                        SectionInfo.engine_axle_count, SectionInfo.torpedo_axle_count, SectionInfo.direction)
+                .where((SectionInfo.ts >= hour_ts - self.max_gap) &
+                       (SectionInfo.ts < hour_ts + HOUR_SECONDS + self.max_gap))
+                .order_by(SectionInfo.section_id, SectionInfo.ts)
+                .tuples())
+        for section_id, ts, section_status, engine_axle_count, torpedo_axle_count, direction in rows.iterator():
+            accumulator.add(section_id, ts, section_status, engine_axle_count, torpedo_axle_count, direction,
+                            count=ts >= hour_ts)
+        '''rows around the hour only give occupied time at the hour boundaries'''
+        increments = {key: increment for key, increment in accumulator.increments.items() if key[1] == hour_ts}
+
+        day_ts = bucket_start(hour_ts, DAY_SECONDS)
+        with scc_db.atomic():
+            SectionRollupHourly.delete().where(SectionRollupHourly.bucket_ts == hour_ts).execute()
+            upsert_rollup(SectionRollupHourly, to_rollup_rows(increments, HOUR_SECONDS))
+            day_rows = (SectionRollupHourly
+                        .select(SectionRollupHourly.section_id,
+                                fn.SUM(SectionRollupHourly.occupied_time).alias("occupied_time"),
+                                fn.SUM(SectionRollupHourly.sample_count).alias("sample_count"),
+                                fn.SUM(SectionRollupHourly.axle_count).alias("axle_count"),
+                                fn.SUM(SectionRollupHourly.in_count).alias("in_count"),
+                                fn.SUM(SectionRollupHourly.out_count).alias("out_count"),
+                                fn.MAX(SectionRollupHourly.last_ts).alias("last_ts"))
+                        .where((SectionRollupHourly.bucket_ts >= day_ts) &
+                               (SectionRollupHourly.bucket_ts < day_ts + DAY_SECONDS))
+                        .group_by(SectionRollupHourly.section_id)
+                        .dicts())
+            day_rows = [dict(row, bucket_ts=day_ts) for row in day_rows]
+            upsert_rollup(SectionRollupDaily, day_rows, replace=True)
+        self.reaggregate_count += 1
+        Log.logger.info(f'scc_rollup: re-aggregated hour {hour_ts}, {len(increments)} sections')
+
+    def reaggregate_dirty(self, now=None):
+        '''re-aggregate dirty hours which are closed'''
+        if now is None:
+            now = time.time()
+        with self.lock:
+            due_hours = sorted(hour_ts for hour_ts in self.dirty_hours
+                               if hour_ts + HOUR_SECONDS + self.reaggregate_delay <= now)
+        for hour_ts in due_hours:
+            try:
+                self.reaggregate_hour(hour_ts)
+                with self.lock:
+                    self.dirty_hours.discard(hour_ts)
+            except Exception as ex:
+                self.error_count += 1
+                Log.logger.critical(f'scc_rollup: re-aggregation of hour {hour_ts} failed: {ex}')
+
+    def run(self):
+        Log.logger.info(f'scc_rollup: section rollup started, flush interval: {self.flush_interval}s')
+        while True:
+            quit_flag = self.quit_event.wait(self.flush_interval)
+            self.flush()
+            self.reaggregate_dirty()
+            db_manager.release()
+            if quit_flag:
+                break
+        Log.logger.info(f'scc_rollup: section rollup stopped, {self.get_stats()}')
+
+    def stop(self):
+        self.quit_event.set()
+
+    def get_stats(self):
+        with self.lock:
+            return {"messages": self.msg_count,
+                    "late": self.late_count,
+                    "dirty_hours": len(self.dirty_hours),
+                    "flushes": self.flush_count,
+                    "upsert_rows": self.upsert_rows,
+                    "reaggregations": self.reaggregate_count,
+                    "errors": self.error_count}
+
+
+def read_section_rollup(granularity, t0, t1, section_ids=None):
+    '''rollup rows with t0 <= bucket_ts < t1, one row per section and hour / day'''
+    model = ROLLUP_MODELS[granularity]
+    query = model.select().where((model.bucket_ts >= t0) & (model.bucket_ts < t1))
+    if section_ids is not None:
+        query = query.where(model.section_id.in_(list(section_ids)))
+    with db_manager.checkout():
+        return list(query.order_by(model.bucket_ts, model.section_id).dicts())
@@ -0,0 +1,148 @@
+'''
+*****************************************************************************
+*File : scc_section_delta.py
+*Module : SCC server
+*Purpose : Delta encoded occ/section_info publishing with periodic keyframes
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import json
+import time
+import threading
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+SECTION_PUBLISH_MODE_FULL = "full"
+SECTION_PUBLISH_MODE_DELTA = "delta"
+
+SECTION_INFO_TOPIC = "occ/section_info"
+SECTION_INFO_DELTA_TOPIC = "occ/section_info/delta"
+SECTION_INFO_KEYFRAME_REQ_TOPIC = "occ/section_info/keyframe_req"
+
+DEFAULT_KEYFRAME_INTERVAL = 30
+
+
+class SectionDeltaPublisher:
+    '''Publish only changed sections, with a full keyframe every keyframe_interval seconds.
+
+    keyframe (SECTION_INFO_TOPIC)      : {"ts", "seq", "keyframe": true, "sections": [section, ...]}
+    delta    (SECTION_INFO_DELTA_TOPIC): {"ts", "seq", "keyframe_seq", "sections": {section_id: section}}
+
+    seq increments by one for every keyframe or delta published, a consumer which
+    sees a gap requests a new keyframe on SECTION_INFO_KEYFRAME_REQ_TOPIC.
+    '''
+
+    def __init__(self, mqtt_client, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        self.mqtt_client = mqtt_client
+        self.keyframe_interval = keyframe_interval
+        self.lock = threading.Lock()
+        self.last_sections = {}
+        self.seq = 0
+        self.keyframe_seq = 0
+        self.last_keyframe_ts = 0.0
+        self.keyframe_requested = True
+
+        '''counters'''
+        self.keyframe_count = 0
+        self.delta_count = 0
+        self.delta_section_count = 0
+
+    def request_keyframe(self):
+        with self.lock:
+            self.keyframe_requested = True
+
+    def keyframe_req_sub_fn(self, in_client, user_data, message):
+        '''subscribe occ/section_info/keyframe_req receive from UI'''
+        try:
+            Log.logger.info(f'section info keyframe requested')
+            self.request_keyframe()
+        except Exception as ex:
+            Log.logger.critical(f'keyframe_req_sub_fn: exception: {ex}')
+
+    def publish(self, ts, section_msg_list):
+        '''publish keyframe or delta for section list built by construct_section_msg_list'''
+        try:
+            with self.lock:
+                now = time.time()
+                '''while broker is down keyframes are coalesced by the spool, deltas would only be stale'''
+                keyframe_due = self.keyframe_requested or \
+                    now - self.last_keyframe_ts >= self.keyframe_interval or \
+                    not self.mqtt_client.is_connected
+
+                if keyframe_due:
+                    self.seq += 1
+                    self.keyframe_seq = self.seq
+                    self.last_keyframe_ts = now
+                    self.keyframe_requested = False
+                    self.last_sections = {}
+                    for section_msg in section_msg_list:
+                        self.last_sections[section_msg["section_id"]] = section_msg
+                    self.keyframe_count += 1
+                    topic = SECTION_INFO_TOPIC
+                    msg = json.dumps({"ts": ts, "seq": self.seq, "keyframe": True, "sections": section_msg_list})
+                else:
+                    changed_sections = {}
+                    for section_msg in section_msg_list:
+                        section_id = section_msg["section_id"]
+                        if self.last_sections.get(section_id) != section_msg:
+                            changed_sections[section_id] = section_msg
+                            self.last_sections[section_id] = section_msg
+                    if len(changed_sections) == 0:
+                        return
+                    self.seq += 1
+                    self.delta_count += 1
+                    self.delta_section_count += len(changed_sections)
+                    topic = SECTION_INFO_DELTA_TOPIC
+                    msg = json.dumps({"ts": ts, "seq": self.seq, "keyframe_seq": self.keyframe_seq,
+                                      "sections": changed_sections})
+
+            self.mqtt_client.pub(topic, msg)
+        except Exception as ex:
+            Log.logger.critical(f'SectionDeltaPublisher: publish: exception: {ex}')
+
+    def get_stats(self):
+        with self.lock:
+            return {"seq": self.seq,
+                    "keyframes": self.keyframe_count,
+                    "deltas": self.delta_count,
+                    "delta_sections": self.delta_section_count}
+
+
+class SectionStateRebuilder:
+    '''Consumer side: rebuild full section state from the latest keyframe and following deltas'''
+
+    def __init__(self):
+        self.sections = {}
+        self.seq = 0
+        self.ts = 0.0
+        self.synced = False
+
+    def apply_keyframe(self, keyframe_msg):
+        self.sections = {}
+        for section_msg in keyframe_msg["sections"]:
+            self.sections[section_msg["section_id"]] = section_msg
+        self.seq = keyframe_msg["seq"]
+        self.ts = keyframe_msg["ts"]
+        self.synced = True
+
+    def apply_delta(self, delta_msg):
+        '''returns False when a keyframe is needed (not synced or sequence gap)'''
+        if not self.synced:
+            return False
+        if delta_msg["seq"] <= self.seq:
+            return True
+        if delta_msg["seq"] != self.seq + 1:
+            self.synced = False
+            return False
+        self.sections.update(delta_msg["sections"])
+        self.seq = delta_msg["seq"]
+        self.ts = delta_msg["ts"]
+        return True
+
+    def get_section_list(self):
+        return list(self.sections.values())
@@ -0,0 +1,78 @@
+'''
+*****************************************************************************
+*File : scc_section_snapshot.py
+*Module : SCC server
+*Purpose : Typed section snapshot parsed once per sem/section_info message
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import json
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+
+class SectionState:
+    '''state of one section as received in sem/section_info'''
+    __slots__ = ("section_id", "section_status", "engine_axle_count", "torpedo_axle_count",
+                 "direction", "speed", "torpedo_status", "first_axle", "error_code")
+
+    def __init__(self, section_msg):
+        self.section_id = section_msg["section_id"]
+        self.section_status = section_msg.get("section_status")
+        self.engine_axle_count = section_msg.get("engine_axle_count")
+        self.torpedo_axle_count = section_msg.get("torpedo_axle_count")
+        self.direction = section_msg.get("direction")
+        self.speed = section_msg.get("speed")
+        self.torpedo_status = section_msg.get("torpedo_status")
+        self.first_axle = section_msg.get("first_axle")
+        self.error_code = section_msg.get("error_code")
+
+
+class SectionSnapshot:
+    '''all sections of one message, indexed by section_id'''
+    __slots__ = ("ts", "sections", "section_idx", "msg", "payload", "codec")
+
+    def __init__(self, payload, msg, codec=None):
+        self.payload = payload
+        self.msg = msg
+        self.codec = codec
+        self.ts = msg["ts"]
+        self.sections = []
+        self.section_idx = {}
+        for section_msg in msg["sections"]:
+            section = SectionState(section_msg)
+            self.sections.append(section)
+            self.section_idx[section.section_id] = section
+
+    @classmethod
+    def from_payload(cls, payload, codec=None):
+        '''parse raw MQTT payload (bytes or str), keep payload for republish'''
+        if codec is not None:
+            return cls(payload, codec.decode(payload), codec)
+        return cls(payload, json.loads(payload))
+
+    def get(self, section_id):
+        return self.section_idx.get(section_id)
+
+    def codec_name(self):
+        '''codec of payload, JSON when parsed without codec'''
+        return self.codec.name if self.codec is not None else "json"
+
+    def raw_sections(self):
+        '''sections as received, used for JSON columns'''
+        return self.msg["sections"]
+
+    def __len__(self):
+        return len(self.sections)
+
+
+def to_section_snapshot(data):
+    '''accept SectionSnapshot or section_info json message'''
+    if isinstance(data, SectionSnapshot):
+        return data
+    return SectionSnapshot.from_payload(data)
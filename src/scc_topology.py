@@ -0,0 +1,170 @@
+'''
+*****************************************************************************
+*File : scc_topology.py
+*Module : SCC
+*Purpose : Yard topology (section neighbours and points) compiled once from layout_section_connections
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import threading
+from array import array
+
+sys.path.insert(1, "./common")
+from scc_log import *
+from scc_yard_state import *
+
+LEFT_NORMAL = "left_normal"
+RIGHT_NORMAL = "right_normal"
+LEFT_REVERSE = "left_reverse"
+RIGHT_REVERSE = "right_reverse"
+NEIGHBOUR_DIRECTIONS = [LEFT_NORMAL, RIGHT_NORMAL, LEFT_REVERSE, RIGHT_REVERSE]
+
+'''layout_section_connections values meaning "no neighbour"'''
+NO_NEIGHBOUR_VALUES = ["", "NONE", "none"]
+
+NO_ROW = -1
+
+
+class YardTopology:
+    '''Section neighbours and point machines of the yard, indexed by yard state table row.
+
+    layout_section_connections is compiled once: every neighbour id is resolved to its row
+    ("NONE"/empty become -1), adjacency[direction][row] is the neighbour row, so a rule
+    evaluator finds a neighbour with one array lookup instead of scanning the section list.
+    The neighbour id strings are also kept in the yard state table for logging.
+    A reloaded yard configuration is compiled once by reload() and swapped into the same
+    object, so every holder of the shared yard_topology reads the new topology.
+    '''
+
+    def __init__(self, table):
+        self.table = table
+        self.lock = threading.Lock()
+        self.loaded = False
+        '''version of the yard configuration snapshot the topology was compiled from'''
+        self.version = 0
+        self.section_ids = []
+        self.adjacency = {direction: array('i') for direction in NEIGHBOUR_DIRECTIONS}
+        self.point_rows = {}
+        self.row_point = {}
+        '''row -> rows having row as neighbour'''
+        self.dependent_rows = {}
+
+        '''statistics'''
+        self.unknown_neighbours = 0
+        self.unknown_point_sections = 0
+
+    def resolve(self, section_id, direction, neighbour_id):
+        '''row of neighbour_id, NO_ROW for a "no neighbour" value'''
+        if neighbour_id is None or neighbour_id.strip() in NO_NEIGHBOUR_VALUES:
+            return NO_ROW
+        neighbour_id = neighbour_id.strip()
+        if neighbour_id not in self.table:
+            self.unknown_neighbours += 1
+            Log.logger.warning(
+                f'scc_topology: {section_id} {direction} neighbour {neighbour_id} not in layout_section_connections')
+        return self.table.add_section(neighbour_id)
+
+    def load(self, section_connections_records, point_config_records, version=0):
+        '''compile topology, only the first call loads, returns True when loaded by this call'''
+        with self.lock:
+            if self.loaded:
+                return False
+            self.version = version
+            records = list(section_connections_records)
+            for sc in records:
+                self.table.add_section(sc.section_id)
+                self.section_ids.append(sc.section_id)
+
+            neighbours = []
+            for sc in records:
+                row = self.table.row_of(sc.section_id)
+                for direction in NEIGHBOUR_DIRECTIONS:
+                    neighbour_id = getattr(sc, direction)
+                    self.table.columns[direction][row] = neighbour_id
+                    neighbours.append((row, direction, self.resolve(sc.section_id, direction, neighbour_id)))
+
+            '''rows of unknown neighbours are added while resolving, size the arrays afterwards'''
+            for direction in NEIGHBOUR_DIRECTIONS:
+                self.adjacency[direction] = array('i', [NO_ROW] * len(self.table))
+            for row, direction, neighbour_row in neighbours:
+                self.adjacency[direction][row] = neighbour_row
+                if neighbour_row != NO_ROW and row not in self.dependent_rows.get(neighbour_row, []):
+                    self.dependent_rows.setdefault(neighbour_row, []).append(row)
+
+            for point in point_config_records:
+                row = self.table.row_of(point.section_id)
+                if row == NO_ROW:
+                    self.unknown_point_sections += 1
+                    Log.logger.warning(
+                        f'scc_topology: point {point.point_id} section {point.section_id} not in layout_section_connections')
+                    continue
+                self.point_rows.setdefault(point.point_id, []).append(row)
+                self.row_point[row] = point.point_id
+                self.table.columns["point_id"][row] = point.point_id
+
+            self.loaded = True
+            Log.logger.info(f'scc_topology: yard topology loaded, {self.get_stats()}')
+            return True
+
+    def reload(self, section_connections_records, point_config_records, version):
+        '''compile a reloaded yard configuration and swap it in, returns False when version is already loaded'''
+        with self.lock:
+            if self.loaded and version == self.version:
+                return False
+            topology = YardTopology(self.table)
+            self.table.reset_column("point_id")
+            topology.load(section_connections_records, point_config_records, version)
+
+            '''compiled lookups are swapped in by reference, readers keep the ones they got'''
+            self.section_ids = topology.section_ids
+            self.adjacency = topology.adjacency
+            self.point_rows = topology.point_rows
+            self.row_point = topology.row_point
+            self.dependent_rows = topology.dependent_rows
+            self.unknown_neighbours = topology.unknown_neighbours
+            self.unknown_point_sections = topology.unknown_point_sections
+            self.version = version
+            self.loaded = True
+            return True
+
+    def neighbour(self, row, direction):
+        '''neighbour row in direction, NO_ROW when there is none'''
+        adjacency = self.adjacency[direction]
+        if 0 <= row < len(adjacency):
+            return adjacency[row]
+        return NO_ROW
+
+    def neighbour_id(self, section_id, direction):
+        '''neighbour section id in direction, None when there is none'''
+        row = self.neighbour(self.table.row_of(section_id), direction)
+        return self.table.section_ids[row] if row != NO_ROW else None
+
+    def neighbours(self, row):
+        '''all neighbour rows of row'''
+        return [self.adjacency[direction][row] for direction in NEIGHBOUR_DIRECTIONS
+                if row < len(self.adjacency[direction]) and self.adjacency[direction][row] != NO_ROW]
+
+    def dependents(self, row):
+        '''rows having row as neighbour in any direction'''
+        return self.dependent_rows.get(row, [])
+
+    def point_sections(self, point_id):
+        '''rows of the sections of point_id'''
+        return self.point_rows.get(point_id, [])
+
+    def section_point(self, row):
+        return self.row_point.get(row)
+
+    def get_stats(self):
+        return {"sections": len(self.section_ids),
+                "points": len(self.point_rows),
+                "unknown_neighbours": self.unknown_neighbours,
+                "unknown_point_sections": self.unknown_point_sections}
+
+
+'''topology of the shared yard state table'''
+yard_topology = YardTopology(yard_state)
@@ -20,9 +20,14 @@ from datetime import datetime, timedelta
 from scc_dlm_model import *
 from scc_layout_model import *
 from scc_dlm_api import *
+from scc_section_snapshot import *
+from scc_topology import *
+from scc_change_detector import *
 sys.path.insert(1, "./common")
 
 TRAIL_THROUGH_SECTION_LIST = ["S3", "S4", "S7", "S8", "S11"]
+'''sections whose torpedo status is taken from sem/section_info'''
+TORPEDO_STATUS_SECTION_LIST = ['S1', 'S2', 'S3', 'S4', 'S20', 'S21', 'S22']
 
 
 class Sec:
@@ -49,11 +54,19 @@ class Sec:
 class Trailthrough:
     def __init__(self, mqtt_client):
         self.scc_api = SccAPI()
-        self.db_conn = self.scc_api.connect_database(cfg)
+        self.yard_topology = self.scc_api.yard_topology
+        '''shared pooled database, no connection of its own'''
+        self.db_conn = db_manager.database if db_manager.connect() else None
         self.tt_sec_obj_list = []
+        '''section_id -> Sec, point_id -> [Sec]'''
+        self.tt_sec_idx = {}
+        self.tt_sec_by_point = {}
+        '''yard state row -> position in tt_sec_obj_list'''
+        self.tt_sec_pos = {}
         self.total_sec = 0
         self.mqtt_client = mqtt_client
-        self.prev_section_list = {}
+        '''sections changed by the last snapshot applied to the yard state'''
+        self.change_detector = SectionChangeDetector(self.scc_api.yard_state, self.yard_topology)
         self.TOTAL_SECTION = 14
 
     def get_point_config(self):
@@ -86,19 +99,26 @@ class Trailthrough:
                     self.tt_sec_obj_list[sc_idx].right_normal = sc.right_normal
                     self.tt_sec_obj_list[sc_idx].left_reverse = sc.left_reverse
                     self.tt_sec_obj_list[sc_idx].right_reverse = sc.right_reverse
+                    self.tt_sec_idx[sc.section_id] = self.tt_sec_obj_list[sc_idx]
                     sc_idx += 1
 
+                '''neighbour lookups use the yard topology, compiled once'''
+                self.scc_api.init_yard_topology()
+                for sec_idx in range(len(self.tt_sec_obj_list)):
+                    self.tt_sec_pos[self.yard_topology.table.row_of(self.tt_sec_obj_list[sec_idx].section_id)] = sec_idx
+
                 point_config = self.get_point_config()
 
                 for point in point_config:
-                    for sec_idx in range(len(self.tt_sec_obj_list)):
-                        if self.tt_sec_obj_list[sec_idx].section_id == point.section_id:
-                            self.tt_sec_obj_list[sec_idx].point_id = point.point_id
+                    tt_sec = self.tt_sec_idx.get(point.section_id)
+                    if tt_sec is not None:
+                        tt_sec.point_id = point.point_id
+                        self.tt_sec_by_point.setdefault(point.point_id, []).append(tt_sec)
 
-                            Log.logger.info(
-                                f'SECTION_ID: {self.tt_sec_obj_list[sec_idx].section_id}, POINT_ID: {self.tt_sec_obj_list[sec_idx].point_id}')
-                        else:
-                            pass
+                        Log.logger.info(
+                            f'SECTION_ID: {tt_sec.section_id}, POINT_ID: {tt_sec.point_id}')
+                    else:
+                        pass
                 self.total_sec = len(self.tt_sec_obj_list)
             else:
                 pass
@@ -108,11 +128,30 @@ class Trailthrough:
             Log.logger.critical(
                 f'init_section_connections_info: exception {ex}')
 
+    def get_neighbour_sec(self, tt_sec, direction):
+        '''Sec of the neighbour of tt_sec in direction, None for "NONE"/empty neighbours'''
+        return self.tt_sec_idx.get(self.yard_topology.neighbour_id(tt_sec.section_id, direction))
+
+    def get_candidate_positions(self, rows):
+        '''positions in tt_sec_obj_list of rows, sorted so rules run in section list order'''
+        return sorted([self.tt_sec_pos[row] for row in rows if row in self.tt_sec_pos])
+
+    def update_sec_status(self, section_list):
+        '''copy section state of the message into the Sec objects'''
+        for tt_sec in self.tt_sec_obj_list:
+            section = section_list.get(tt_sec.section_id)
+            if section is not None:
+                tt_sec.section_status = section['section_status']
+                tt_sec.direction = section['direction']
+                tt_sec.torpedo_axle_count = section['torpedo_axle_count']
+                tt_sec.error_code = section['error_code']
+
     def detect_trail_through(self, section_json_data, point_obj_list):
         '''trail through detection using section status and point status'''
         try:
             section_list = {}
-            json_data = json.loads(section_json_data)
+            snapshot = to_section_snapshot(section_json_data)
+            json_data = snapshot.msg
 
             for json_idx in range(len(json_data['sections'])):
                 section_list[json_data['sections'][json_idx]
@@ -123,33 +162,27 @@ class Trailthrough:
                 #Log.logger.info(
                 #    f'{point_obj_list[point_idx].point_id}, {point_obj_list[point_idx].point_status}, {point_obj_list[point_idx].point_mode}')
 
-                for sec_idx in range(self.total_sec):
-                    if point_obj_list[point_idx].point_id == self.tt_sec_obj_list[sec_idx].point_id:
-                        self.tt_sec_obj_list[sec_idx].point_status = point_obj_list[point_idx].point_status
-                        self.tt_sec_obj_list[sec_idx].point_mode = point_obj_list[point_idx].point_mode
-                    else:
-                        pass
+                for tt_sec in self.tt_sec_by_point.get(point_obj_list[point_idx].point_id, []):
+                    tt_sec.point_status = point_obj_list[point_idx].point_status
+                    tt_sec.point_mode = point_obj_list[point_idx].point_mode
 
-            for sec_idx in range(len(self.tt_sec_obj_list)):
-                for json_sec_idx in range(len(json_data['sections'])):
-                    if self.tt_sec_obj_list[sec_idx].section_id == json_data['sections'][json_sec_idx]['section_id']:
-                        self.tt_sec_obj_list[sec_idx].section_status = json_data['sections'][json_sec_idx]['section_status']
-                        self.tt_sec_obj_list[sec_idx].direction = json_data['sections'][json_sec_idx]['direction']
-                        self.tt_sec_obj_list[sec_idx].torpedo_axle_count = json_data['sections'][json_sec_idx]['torpedo_axle_count']
-                        self.tt_sec_obj_list[sec_idx].error_code = json_data['sections'][json_sec_idx]['error_code']
-                    else:
-                        pass
+            self.update_sec_status(section_list)
+
+            '''only sections next to a section whose torpedo axle count changed can detect a trail through,
+            no-op when the server already applied this snapshot'''
+            self.scc_api.yard_state.update_from_snapshot(snapshot)
+            candidate_rows = self.change_detector.affected_rows(self.change_detector.axle_count_changed_rows)
 
             tt_sec_list = []
 
-            for sec_idx in range(len(self.tt_sec_obj_list)):
+            for sec_idx in self.get_candidate_positions(candidate_rows):
                 if self.tt_sec_obj_list[sec_idx].section_id in ['S20', 'S18', 'S12', 'S10', 'S9']:
                     if self.tt_sec_obj_list[sec_idx].section_status == "occupied" and self.tt_sec_obj_list[sec_idx].direction == "out":
                         left_normal_sec_id = self.tt_sec_obj_list[sec_idx].left_normal
                         left_reverse_sec_id = self.tt_sec_obj_list[sec_idx].left_reverse
 
                         if section_list[left_normal_sec_id]["section_status"] == "occupied" and section_list[left_normal_sec_id]["direction"] == "out":
-                            if len(self.prev_section_list)!= 0 and (section_list[left_normal_sec_id]["torpedo_axle_count"] != self.prev_section_list[left_normal_sec_id]["torpedo_axle_count"]):
+                            if self.change_detector.axle_count_changed(left_normal_sec_id):
                                 if self.tt_sec_obj_list[sec_idx].point_status == "reverse" and self.tt_sec_obj_list[sec_idx].point_mode != "manual":
                                     Log.logger.info(
                                         f'trail-through detected in Section id:{self.tt_sec_obj_list[sec_idx].section_id}')
@@ -167,7 +200,7 @@ class Trailthrough:
                             pass
 
                         if section_list[left_reverse_sec_id]["section_status"] == "occupied" and section_list[left_reverse_sec_id]["direction"] == "out":
-                            if len(self.prev_section_list)!= 0 and (section_list[left_reverse_sec_id]["torpedo_axle_count"] != self.prev_section_list[left_reverse_sec_id]["torpedo_axle_count"]):
+                            if self.change_detector.axle_count_changed(left_reverse_sec_id):
                                 if self.tt_sec_obj_list[sec_idx].point_status == "normal" and self.tt_sec_obj_list[sec_idx].point_mode != "manual":
                                     Log.logger.info(
                                         f'trail-through detected in Section id:{self.tt_sec_obj_list[sec_idx].section_id}')
@@ -194,7 +227,7 @@ class Trailthrough:
                         right_reverse_sec_id = self.tt_sec_obj_list[sec_idx].right_reverse
 
                         if section_list[right_normal_sec_id]["section_status"] == "occupied" and section_list[right_normal_sec_id]["direction"] == "in":
-                            if len(self.prev_section_list)!= 0 and (section_list[right_normal_sec_id]["torpedo_axle_count"] != self.prev_section_list[right_normal_sec_id]["torpedo_axle_count"]):
+                            if self.change_detector.axle_count_changed(right_normal_sec_id):
                                 if self.tt_sec_obj_list[sec_idx].point_status == "reverse" and self.tt_sec_obj_list[sec_idx].point_mode != "manual":
                                     Log.logger.info(
                                         f'trail-through detected in Section id:{self.tt_sec_obj_list[sec_idx].section_id}')
@@ -212,7 +245,7 @@ class Trailthrough:
                             pass
 
                         if section_list[right_reverse_sec_id]["section_status"] == "occupied" and section_list[right_reverse_sec_id]["direction"] == "in":
-                            if len(self.prev_section_list)!= 0 and (section_list[right_reverse_sec_id]["torpedo_axle_count"] != self.prev_section_list[right_reverse_sec_id]["torpedo_axle_count"]):
+                            if self.change_detector.axle_count_changed(right_reverse_sec_id):
                                 if self.tt_sec_obj_list[sec_idx].point_status == "normal" and self.tt_sec_obj_list[sec_idx].point_mode != "manual":
                                     Log.logger.info(
                                         f'trail-through detected in Section id:{self.tt_sec_obj_list[sec_idx].section_id}')
@@ -234,7 +267,6 @@ class Trailthrough:
                     pass
 
             Log.logger.info(f'return value: {tt_sec_list}')
-            self.prev_section_list = section_list
             return tt_sec_list
         except Exception as ex:
             Log.logger.critical(f'find trail through: exception: {ex}')
@@ -243,7 +275,8 @@ class Trailthrough:
         '''find torpedo status'''
         try:
             section_list = {}
-            json_data = json.loads(section_json_data)
+            snapshot = to_section_snapshot(section_json_data)
+            json_data = snapshot.msg
 
             Log.logger.info(f'find torpedo status called')
             Log.logger.info(f'{len(self.tt_sec_obj_list)}')
@@ -252,29 +285,36 @@ class Trailthrough:
                 section_list[json_data['sections'][json_idx]
                              ['section_id']] = json_data['sections'][json_idx]
 
+            self.update_sec_status(section_list)
             for sec_idx in range(len(self.tt_sec_obj_list)):
-                for json_sec_idx in range(len(json_data['sections'])):
-                    if self.tt_sec_obj_list[sec_idx].section_id == json_data['sections'][json_sec_idx]['section_id']:
-                        self.tt_sec_obj_list[sec_idx].section_status = json_data['sections'][json_sec_idx]['section_status']
-                        self.tt_sec_obj_list[sec_idx].direction = json_data['sections'][json_sec_idx]['direction']
-                        self.tt_sec_obj_list[sec_idx].torpedo_axle_count = json_data['sections'][json_sec_idx]['torpedo_axle_count']
-                        self.tt_sec_obj_list[sec_idx].error_code = json_data['sections'][json_sec_idx]['error_code']
-                        self.tt_sec_obj_list[sec_idx].engine_axle_count = json_data['sections'][json_sec_idx]['engine_axle_count']
-                        self.tt_sec_obj_list[sec_idx].speed = json_data['sections'][json_sec_idx]['speed']
-                        self.tt_sec_obj_list[sec_idx].first_axle = json_data['sections'][json_sec_idx]['first_axle']
-
-                        if self.tt_sec_obj_list[sec_idx].section_id in ['S1', 'S2', 'S3', 'S4', 'S20', 'S21', 'S22']:
-                            self.tt_sec_obj_list[sec_idx].torpedo_status = json_data['sections'][json_sec_idx]['torpedo_status']
-                            if self.tt_sec_obj_list[sec_idx].torpedo_status != "none":
-                                Log.logger.info(f'{self.tt_sec_obj_list[sec_idx].section_id}, {self.tt_sec_obj_list[sec_idx].torpedo_status}')
-                            else:
-                                pass
+                section = section_list.get(self.tt_sec_obj_list[sec_idx].section_id)
+                if section is not None:
+                    self.tt_sec_obj_list[sec_idx].engine_axle_count = section['engine_axle_count']
+                    self.tt_sec_obj_list[sec_idx].speed = section['speed']
+                    self.tt_sec_obj_list[sec_idx].first_axle = section['first_axle']
+
+                    if self.tt_sec_obj_list[sec_idx].section_id in TORPEDO_STATUS_SECTION_LIST:
+                        self.tt_sec_obj_list[sec_idx].torpedo_status = section['torpedo_status']
+                        if self.tt_sec_obj_list[sec_idx].torpedo_status != "none":
+                            Log.logger.info(f'{self.tt_sec_obj_list[sec_idx].section_id}, {self.tt_sec_obj_list[sec_idx].torpedo_status}')
                         else:
                             pass
                     else:
                         pass
-            
-            for sec_idx in range(len(self.tt_sec_obj_list)):
+                else:
+                    pass
+
+            '''rules run for changed sections, sections next to a torpedo axle count change and the sections
+            whose torpedo status was just taken from the message, the others would keep their state'''
+            self.scc_api.yard_state.update_from_snapshot(snapshot)
+            candidate_rows = self.change_detector.affected_rows(
+                self.change_detector.axle_count_changed_rows)
+            candidate_rows.update(self.change_detector.changed_rows)
+            for section_id in TORPEDO_STATUS_SECTION_LIST:
+                if section_id in section_list:
+                    candidate_rows.add(self.yard_topology.table.row_of(section_id))
+
+            for sec_idx in self.get_candidate_positions(candidate_rows):
                 left_normal_sec_id = self.tt_sec_obj_list[sec_idx].left_normal
                 left_reverse_sec_id = self.tt_sec_obj_list[sec_idx].left_reverse
                 right_normal_sec_id = self.tt_sec_obj_list[sec_idx].right_normal
@@ -283,30 +323,30 @@ class Trailthrough:
                 if self.tt_sec_obj_list[sec_idx].section_id not in ['S1', 'S2', 'S3', 'S4', 'S20', 'S21', 'S22']:
                     if self.tt_sec_obj_list[sec_idx].section_status != "cleared" and self.tt_sec_obj_list[sec_idx].direction == "in":
                         if right_normal_sec_id != "NONE":
-                            if len(self.prev_section_list)!= 0 and (section_list[right_normal_sec_id]["torpedo_axle_count"] != self.prev_section_list[right_normal_sec_id]["torpedo_axle_count"]):
-                                for rn_sec_idx in range(len(self.tt_sec_obj_list)):
-                                    if self.tt_sec_obj_list[rn_sec_idx].section_id == self.tt_sec_obj_list[sec_idx].right_normal:
-                                        if self.tt_sec_obj_list[rn_sec_idx].torpedo_status != "none":
-                                            self.tt_sec_obj_list[sec_idx].torpedo_status = self.tt_sec_obj_list[rn_sec_idx].torpedo_status
-                                        else:
-                                            pass
+                            if self.change_detector.axle_count_changed(right_normal_sec_id):
+                                rn_sec = self.get_neighbour_sec(self.tt_sec_obj_list[sec_idx], RIGHT_NORMAL)
+                                if rn_sec is not None:
+                                    if rn_sec.torpedo_status != "none":
+                                        self.tt_sec_obj_list[sec_idx].torpedo_status = rn_sec.torpedo_status
                                     else:
                                         pass
+                                else:
+                                    pass
                             else:
                                 pass
                         else:
                             pass
 
                         if right_reverse_sec_id != "NONE":
-                            if len(self.prev_section_list)!= 0 and (section_list[right_reverse_sec_id]["torpedo_axle_count"] != self.prev_section_list[right_reverse_sec_id]["torpedo_axle_count"]):
-                                for rr_sec_idx in range(len(self.tt_sec_obj_list)):
-                                    if self.tt_sec_obj_list[rr_sec_idx].section_id == self.tt_sec_obj_list[sec_idx].right_reverse:
-                                        if self.tt_sec_obj_list[rr_sec_idx].torpedo_status != "none":
-                                            self.tt_sec_obj_list[sec_idx].torpedo_status = self.tt_sec_obj_list[rr_sec_idx].torpedo_status
-                                        else:
-                                            pass
+                            if self.change_detector.axle_count_changed(right_reverse_sec_id):
+                                rr_sec = self.get_neighbour_sec(self.tt_sec_obj_list[sec_idx], RIGHT_REVERSE)
+                                if rr_sec is not None:
+                                    if rr_sec.torpedo_status != "none":
+                                        self.tt_sec_obj_list[sec_idx].torpedo_status = rr_sec.torpedo_status
                                     else:
                                         pass
+                                else:
+                                    pass
                             else:
                                 pass
                         else:
@@ -320,29 +360,29 @@ class Trailthrough:
                 if self.tt_sec_obj_list[sec_idx].section_id not in ['S1', 'S2', 'S3', 'S4']:
                     if self.tt_sec_obj_list[sec_idx].section_status != "cleared" and self.tt_sec_obj_list[sec_idx].direction == "out":
                         if left_normal_sec_id != "NONE":
-                            if len(self.prev_section_list)!= 0 and (section_list[left_normal_sec_id]["torpedo_axle_count"] != self.prev_section_list[left_normal_sec_id]["torpedo_axle_count"]):
-                                for ln_sec_idx in range(len(self.tt_sec_obj_list)):
-                                    if self.tt_sec_obj_list[ln_sec_idx].section_id == self.tt_sec_obj_list[sec_idx].left_normal:
-                                        if self.tt_sec_obj_list[ln_sec_idx].torpedo_status != "none" and self.tt_sec_obj_list[sec_idx].torpedo_axle_count >= 6 :
-                                            self.tt_sec_obj_list[sec_idx].torpedo_status = self.tt_sec_obj_list[ln_sec_idx].torpedo_status
-                                        else:
-                                            pass
+                            if self.change_detector.axle_count_changed(left_normal_sec_id):
+                                ln_sec = self.get_neighbour_sec(self.tt_sec_obj_list[sec_idx], LEFT_NORMAL)
+                                if ln_sec is not None:
+                                    if ln_sec.torpedo_status != "none" and self.tt_sec_obj_list[sec_idx].torpedo_axle_count >= 6 :
+                                        self.tt_sec_obj_list[sec_idx].torpedo_status = ln_sec.torpedo_status
                                     else:
                                         pass
+                                else:
+                                    pass
                             else:
                                 pass
                         else:
                             pass
                         if left_reverse_sec_id != "NONE":
-                            if len(self.prev_section_list)!= 0 and (section_list[left_reverse_sec_id]["torpedo_axle_count"] != self.prev_section_list[left_reverse_sec_id]["torpedo_axle_count"]):
-                                for lr_sec_idx in range(len(self.tt_sec_obj_list)):
-                                    if self.tt_sec_obj_list[lr_sec_idx].section_id == self.tt_sec_obj_list[sec_idx].left_reverse:
-                                        if self.tt_sec_obj_list[lr_sec_idx].torpedo_status != "none" and self.tt_sec_obj_list[sec_idx].torpedo_axle_count >= 6 :
-                                            self.tt_sec_obj_list[sec_idx].torpedo_status = self.tt_sec_obj_list[lr_sec_idx].torpedo_status
-                                        else:
-                                            pass
+                            if self.change_detector.axle_count_changed(left_reverse_sec_id):
+                                lr_sec = self.get_neighbour_sec(self.tt_sec_obj_list[sec_idx], LEFT_REVERSE)
+                                if lr_sec is not None:
+                                    if lr_sec.torpedo_status != "none" and self.tt_sec_obj_list[sec_idx].torpedo_axle_count >= 6 :
+                                        self.tt_sec_obj_list[sec_idx].torpedo_status = lr_sec.torpedo_status
                                     else:
                                         pass
+                                else:
+                                    pass
                             else:
                                 pass
                         else:
@@ -364,9 +404,7 @@ class Trailthrough:
             #                    f'S_STATUS: {self.tt_sec_obj_list[sec_idx].section_status},'
             #                    f'T AC: {self.tt_sec_obj_list[sec_idx].torpedo_axle_count},'
             #                    f'DIR: {self.tt_sec_obj_list[sec_idx].direction}')
-            
-            self.prev_section_list = section_list
-           
+
             '''return new section message with torpedo status'''
             json_section_msg = self.construct_section_json_msg()
             return json_section_msg
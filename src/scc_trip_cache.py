@@ -0,0 +1,135 @@
+'''
+*****************************************************************************
+*File : scc_trip_cache.py
+*Module : SCC
+*Purpose : Open trip cache (torpedo_id -> row id) and batched single statement updates
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+import threading
+from collections import OrderedDict
+
+from peewee import *
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+DEFAULT_MAX_OPEN_TRIPS = 1000
+
+
+class OpenTripCache:
+    '''primary key of the active yard_performance / torpedo_performance row per torpedo_id.
+
+    update() only records the changed columns, flush() writes them with one
+    UPDATE ... SET <changed columns> WHERE id = pk per row, all rows of a message
+    in one transaction; after a failed flush they stay queued for the next one,
+    so a trip closed in the cache keeps its exit values. A torpedo_id missing in the cache (e.g. after restart) is
+    looked up once by the torpedo_id index: the latest row of the torpedo whose
+    close field (model -> field written by the last event of a trip) is still NULL.
+    '''
+
+    def __init__(self, close_fields=None, max_open_trips=DEFAULT_MAX_OPEN_TRIPS):
+        self.close_fields = close_fields if close_fields is not None else {}
+        self.max_open_trips = max_open_trips
+        self.lock = threading.Lock()
+        '''model -> OrderedDict(torpedo_id -> pk), oldest trip first'''
+        self.trips = {}
+        '''(model, pk) -> {field: value}'''
+        self.pending = OrderedDict()
+
+        '''statistics'''
+        self.hit_count = 0
+        self.miss_count = 0
+        self.update_count = 0
+        self.flush_count = 0
+        self.error_count = 0
+
+    def ensure_indexes(self, models):
+        '''create torpedo_id index on existing tables'''
+        for model in models:
+            try:
+                model._schema.create_indexes(safe=True)
+            except Exception as ex:
+                Log.logger.critical(f'scc_trip_cache: ensure_indexes: {model._meta.table_name}: exception: {ex}')
+
+    def open_trip(self, model, torpedo_id, pk):
+        with self.lock:
+            model_trips = self.trips.setdefault(model, OrderedDict())
+            model_trips[torpedo_id] = pk
+            model_trips.move_to_end(torpedo_id)
+            while len(model_trips) > self.max_open_trips:
+                model_trips.popitem(last=False)
+
+    def close_trip(self, model, torpedo_id):
+        with self.lock:
+            self.trips.get(model, {}).pop(torpedo_id, None)
+
+    def get_pk(self, model, torpedo_id):
+        '''row id of the open trip, None when no row exists'''
+        with self.lock:
+            pk = self.trips.get(model, {}).get(torpedo_id)
+            if pk is not None:
+                self.hit_count += 1
+                return pk
+            self.miss_count += 1
+        query = model.select(model.id).where(model.torpedo_id == torpedo_id)
+        close_field = self.close_fields.get(model)
+        if close_field is not None:
+            query = query.where(close_field.is_null())
+        row = query.order_by(model.id.desc()).limit(1).first()
+        if row is None:
+            return None
+        self.open_trip(model, torpedo_id, row.id)
+        return row.id
+
+    def update(self, model, torpedo_id, values):
+        '''queue column values for the open trip of torpedo_id, False when no row exists'''
+        pk = self.get_pk(model, torpedo_id)
+        if pk is None:
+            return False
+        with self.lock:
+            key = (model, pk)
+            if key not in self.pending:
+                self.pending[key] = {}
+            self.pending[key].update(values)
+        return True
+
+    def flush(self):
+        '''write queued updates, one UPDATE per row'''
+        with self.lock:
+            pending = self.pending
+            self.pending = OrderedDict()
+        if len(pending) == 0:
+            return
+        try:
+            database = next(iter(pending))[0]._meta.database
+            with database.atomic():
+                for (model, pk), values in pending.items():
+                    model.update(values).where(model.id == pk).execute()
+            self.update_count += len(pending)
+            self.flush_count += 1
+        except Exception as ex:
+            '''updates are retried with the next flush, values queued meanwhile are newer and win'''
+            self.error_count += 1
+            with self.lock:
+                for key, values in self.pending.items():
+                    if key in pending:
+                        pending[key].update(values)
+                    else:
+                        pending[key] = values
+                self.pending = pending
+            Log.logger.critical(f'scc_trip_cache: flush of {len(pending)} updates failed: {ex}')
+
+    def get_stats(self):
+        with self.lock:
+            return {"open_trips": {model._meta.table_name: len(trips) for model, trips in self.trips.items()},
+                    "pending": len(self.pending),
+                    "hits": self.hit_count,
+                    "misses": self.miss_count,
+                    "updates": self.update_count,
+                    "flushes": self.flush_count,
+                    "errors": self.error_count}
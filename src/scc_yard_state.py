@@ -0,0 +1,295 @@
+'''
+*****************************************************************************
+*File : scc_yard_state.py
+*Module : SCC
+*Purpose : Column oriented yard state table shared by scc server, dlm api and trail through
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import python packages'''
+import sys
+from array import array
+from operator import attrgetter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+sys.path.insert(1, "./common")
+from scc_log import *
+
+'''enum columns, value -> small int code, values not listed here get the next free code'''
+SECTION_STATUS_VALUES = ["none", "cleared", "occupied"]
+DIRECTION_VALUES = ["none", "in", "out"]
+TORPEDO_STATUS_VALUES = ["none", "loaded", "unloaded"]
+FIRST_AXLE_VALUES = ["none", "torpedo", "engine"]
+POINT_STATUS_VALUES = ["none", "normal", "reverse"]
+POINT_MODE_VALUES = ["none", "auto", "manual"]
+
+ENUM_COLUMNS = {
+    "section_status": (SECTION_STATUS_VALUES, "cleared"),
+    "direction": (DIRECTION_VALUES, "none"),
+    "torpedo_status": (TORPEDO_STATUS_VALUES, "loaded"),
+    "first_axle": (FIRST_AXLE_VALUES, "torpedo"),
+    "point_status": (POINT_STATUS_VALUES, "none"),
+    "point_mode": (POINT_MODE_VALUES, "none")}
+
+'''numeric columns, array typecode and default'''
+NUMERIC_COLUMNS = {
+    "ts": ('d', 0.0),
+    "speed": ('d', 10.0),
+    "engine_axle_count": ('i', 0),
+    "torpedo_axle_count": ('i', 0),
+    "error_code": ('i', 0),
+    "point_error": ('i', 0),
+    "in_torpedo_axle_count": ('i', 0),
+    "out_torpedo_axle_count": ('i', 0),
+    "in_axles": ('i', 0),
+    "out_axles": ('i', 0),
+    "torpedo_detected": ('B', 0),
+    "entry_time": ('d', 0.0),
+    "exit_time": ('d', 0.0),
+    "unload_in_torpedo_axle_count": ('i', 0),
+    "unload_out_torpedo_axle_count": ('i', 0),
+    "unloaded_entry_time": ('d', 0.0),
+    "unloaded_exit_time": ('d', 0.0),
+    "unload_entry_time": ('d', 0.0),
+    "unload_exit_time": ('d', 0.0)}
+
+'''topology and id columns (strings or 0), plain lists'''
+OBJECT_COLUMNS = {
+    "left_normal": "none",
+    "right_normal": "none",
+    "left_reverse": "none",
+    "right_reverse": "none",
+    "point_id": "none",
+    "torpedo_id": 0,
+    "engine_id": 0,
+    "unload_torpedo_id": 0,
+    "unload_engine_id": 0}
+
+'''sem/section_info fields written once per message'''
+SNAPSHOT_ENUM_FIELDS = ["section_status", "direction", "torpedo_status", "first_axle"]
+SNAPSHOT_INT_FIELDS = ["engine_axle_count", "torpedo_axle_count", "error_code"]
+get_snapshot_values = attrgetter(*(SNAPSHOT_ENUM_FIELDS + SNAPSHOT_INT_FIELDS + ["speed"]))
+SNAPSHOT_AXLE_COUNT_IDX = (SNAPSHOT_ENUM_FIELDS + SNAPSHOT_INT_FIELDS).index("torpedo_axle_count")
+
+MAX_ENUM_CODE = 255
+
+
+class EnumCodes:
+    '''value <-> small int code of one enum column'''
+
+    def __init__(self, values):
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            if len(self.values) > MAX_ENUM_CODE:
+                raise ValueError(f'too many values in enum column, {value} not added')
+            code = len(self.values)
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+
+class YardStateTable:
+    '''Per section state of the yard, one row per section, one column per field.
+
+    Enum fields (section_status, direction, ...) are stored as one byte codes, counters
+    and times in typed arrays, so a row costs a few dozen bytes instead of an attribute
+    dict per subsystem. section_id is mapped to the row index. Subsystems access rows
+    through YardStateView subclasses, sem/section_info is applied once per message by
+    update_from_snapshot.
+    '''
+
+    def __init__(self):
+        self.section_ids = []
+        self.row_idx = {}
+        self.enums = {}
+        self.columns = {}
+        self.defaults = {}
+        for column, (values, default) in ENUM_COLUMNS.items():
+            self.enums[column] = EnumCodes(values)
+            self.columns[column] = array('B')
+            self.defaults[column] = self.enums[column].code(default)
+        for column, (typecode, default) in NUMERIC_COLUMNS.items():
+            self.columns[column] = array(typecode)
+            self.defaults[column] = default
+        for column, default in OBJECT_COLUMNS.items():
+            self.columns[column] = []
+            self.defaults[column] = default
+        self.last_snapshot = None
+        '''row -> sem/section_info values applied last, unchanged sections are not written again'''
+        self.snapshot_values = {}
+        '''rows changed by the last snapshot, rows among them whose torpedo_axle_count changed'''
+        self.changed_rows = set()
+        self.axle_count_changed_rows = set()
+
+        '''statistics'''
+        self.snapshot_updates = 0
+        self.unknown_sections = 0
+        self.changed_sections = 0
+
+    def add_section(self, section_id):
+        '''row of section_id, a new row with default values is appended for an unknown id'''
+        row = self.row_idx.get(section_id)
+        if row is None:
+            row = len(self.section_ids)
+            self.section_ids.append(section_id)
+            self.row_idx[section_id] = row
+            for column, values in self.columns.items():
+                values.append(self.defaults[column])
+        return row
+
+    def row_of(self, section_id):
+        '''row of section_id, -1 when unknown'''
+        return self.row_idx.get(section_id, -1)
+
+    def get(self, column, row):
+        '''decoded value, enum columns return their string value'''
+        value = self.columns[column][row]
+        enum = self.enums.get(column)
+        return enum.values[value] if enum is not None else value
+
+    def set(self, column, row, value):
+        enum = self.enums.get(column)
+        self.columns[column][row] = enum.code(value) if enum is not None else value
+
+    def reset_column(self, column, rows=None):
+        '''set column back to its default, for all rows or the given rows'''
+        values = self.columns[column]
+        default = self.defaults[column]
+        for row in (range(len(values)) if rows is None else rows):
+            values[row] = default
+
+    def update_from_snapshot(self, snapshot):
+        '''apply sem/section_info once, calling again with the same snapshot is a no-op.
+        Only ts is written for sections whose values did not change since the last snapshot.
+        The changed rows are kept in changed_rows, the rows whose torpedo_axle_count changed in
+        axle_count_changed_rows; the first message of a section is no axle count change.'''
+        if snapshot is self.last_snapshot:
+            return
+        self.last_snapshot = snapshot
+        self.snapshot_updates += 1
+        columns = self.columns
+        ts_column = columns["ts"]
+        snapshot_values = self.snapshot_values
+        changed_rows = set()
+        axle_count_changed_rows = set()
+        self.changed_rows = changed_rows
+        self.axle_count_changed_rows = axle_count_changed_rows
+        for section in snapshot.sections:
+            row = self.row_idx.get(section.section_id)
+            if row is None:
+                self.unknown_sections += 1
+                continue
+            ts_column[row] = snapshot.ts
+            values = get_snapshot_values(section)
+            prev_values = snapshot_values.get(row)
+            if prev_values == values:
+                continue
+            if prev_values is not None and \
+                    prev_values[SNAPSHOT_AXLE_COUNT_IDX] != values[SNAPSHOT_AXLE_COUNT_IDX]:
+                axle_count_changed_rows.add(row)
+            changed_rows.add(row)
+            snapshot_values[row] = values
+            self.changed_sections += 1
+            for field in SNAPSHOT_ENUM_FIELDS:
+                value = getattr(section, field)
+                if value is not None:
+                    columns[field][row] = self.enums[field].code(value)
+            for field in SNAPSHOT_INT_FIELDS:
+                value = getattr(section, field)
+                if value is not None:
+                    columns[field][row] = int(value)
+            if section.speed is not None:
+                columns["speed"][row] = float(section.speed)
+
+    def as_numpy(self, column):
+        '''zero copy numpy view of a numeric or enum column, valid until the next add_section'''
+        if np is None:
+            raise RuntimeError("numpy is not installed")
+        values = self.columns[column]
+        if isinstance(values, list):
+            raise TypeError(f'{column} is not a numeric column')
+        return np.frombuffer(values, dtype=values.typecode)
+
+    def code_of(self, column, value):
+        '''enum code of value, -1 when value never occurred in column'''
+        return self.enums[column].codes.get(value, -1)
+
+    def get_stats(self):
+        column_bytes = 0
+        for values in self.columns.values():
+            if isinstance(values, array):
+                column_bytes += values.itemsize * len(values)
+        return {"rows": len(self.section_ids),
+                "column_bytes": column_bytes,
+                "snapshot_updates": self.snapshot_updates,
+                "changed_sections": self.changed_sections,
+                "unknown_sections": self.unknown_sections}
+
+    def __len__(self):
+        return len(self.section_ids)
+
+    def __contains__(self, section_id):
+        return section_id in self.row_idx
+
+
+class StateField:
+    '''attribute of a YardStateView stored in a table column'''
+
+    def __init__(self, column):
+        self.column = column
+
+    def __get__(self, view, owner):
+        if view is None:
+            return self
+        return view.table.columns[self.column][view.row]
+
+    def __set__(self, view, value):
+        view.table.columns[self.column][view.row] = value
+
+
+class EnumStateField(StateField):
+    '''enum attribute, read and written as string, stored as code'''
+
+    def __get__(self, view, owner):
+        if view is None:
+            return self
+        return view.table.enums[self.column].values[view.table.columns[self.column][view.row]]
+
+    def __set__(self, view, value):
+        view.table.columns[self.column][view.row] = view.table.enums[self.column].code(value)
+
+
+class BoolStateField(StateField):
+    def __get__(self, view, owner):
+        if view is None:
+            return self
+        return bool(view.table.columns[self.column][view.row])
+
+    def __set__(self, view, value):
+        view.table.columns[self.column][view.row] = 1 if value else 0
+
+
+class YardStateView:
+    '''one row of a YardStateTable, subclasses declare the fields they use'''
+
+    def __init__(self, table, section_id):
+        self.table = table
+        self.row = table.add_section(section_id)
+
+    @property
+    def section_id(self):
+        return self.table.section_ids[self.row]
+
+
+'''yard state shared by all subsystems of the process'''
+yard_state = YardStateTable()
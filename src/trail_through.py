@@ -15,41 +15,68 @@ import sys
 import json
 import os
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from peewee import *
 from datetime import datetime, timedelta
 from scc_dlm_model import *
 from scc_layout_model import *
 from scc_dlm_api import *
+from scc_section_snapshot import *
+from scc_yard_state import *
+from scc_topology import *
+from scc_change_detector import *
 sys.path.insert(1, "./common")
 
-class Sec:
-    def __init__(self):
-        self.section_id = "none"
-        self.left_normal = "none"
-        self.right_normal = "none"
-        self.left_reverse = "none"
-        self.right_reverse = "none"
-        #self.engine_axle_count = 0
-        self.torpedo_axle_count = 0
-        self.section_status = "none"
-        self.point_id = "none"
-        self.point_status = "none"
-        self.point_mode = "none"
-        self.point_error = 0
-        #self.torpedo_status = "none"
-        self.direction = "none"
-        #self.speed = 10
-        #self.first_axle = "none"
-        self.error_code = 0
+TRAIL_THROUGH_ENGINE_REFERENCE = "reference"
+TRAIL_THROUGH_ENGINE_NUMPY = "numpy"
+
+class Sec(YardStateView):
+    '''section with point machine, row of the shared yard state table'''
+    left_normal = StateField("left_normal")
+    right_normal = StateField("right_normal")
+    left_reverse = StateField("left_reverse")
+    right_reverse = StateField("right_reverse")
+    #engine_axle_count = StateField("engine_axle_count")
+    torpedo_axle_count = StateField("torpedo_axle_count")
+    section_status = EnumStateField("section_status")
+    point_id = StateField("point_id")
+    point_status = EnumStateField("point_status")
+    point_mode = EnumStateField("point_mode")
+    point_error = StateField("point_error")
+    #torpedo_status = EnumStateField("torpedo_status")
+    direction = EnumStateField("direction")
+    #speed = StateField("speed")
+    #first_axle = EnumStateField("first_axle")
+    error_code = StateField("error_code")
 
 class Trailthrough:
-    def __init__(self, mqtt_client):
-        self.scc_api = SccAPI()
-        self.db_conn = self.scc_api.connect_database(cfg)
+    def __init__(self, mqtt_client, table=None, engine=TRAIL_THROUGH_ENGINE_REFERENCE):
+        self.scc_api = SccAPI(table)
+        self.yard_state = yard_state if table is None else table
+        self.yard_topology = self.scc_api.yard_topology
+        '''shared pooled database, checked out by init_trail_through_info'''
+        self.db_conn = None
         self.tt_sec_obj_list = []
+        '''section_id -> Sec'''
+        self.tt_sec_idx = {}
         self.total_pm_sec = 0
         self.mqtt_client = mqtt_client
-        self.prev_sections_info = {}
+        '''yard state row -> position in tt_sec_obj_list'''
+        self.tt_sec_pos = {}
+        '''sections changed by the last snapshot, rules run only for the sections depending on them'''
+        self.change_detector = SectionChangeDetector(self.yard_state, self.yard_topology)
+
+        '''vectorized engine, rows and neighbour rows of the point sections'''
+        if engine == TRAIL_THROUGH_ENGINE_NUMPY and np is None:
+            Log.logger.warning(f'numpy not installed, reference trail through engine used')
+            engine = TRAIL_THROUGH_ENGINE_REFERENCE
+        self.engine = engine
+        self.tt_rows = None
+        self.tt_neighbour_rows = {}
 
     def get_point_config(self):
         '''get pms configuration from database table'''
@@ -64,37 +91,10 @@ class Trailthrough:
         try:
 
             Log.logger.info(f'init trail through info called')
+            self.db_conn = db_manager.database if db_manager.connect() else None
             if self.db_conn:
-                section_connections_db_records = self.scc_api.read_section_connections_info()
-
-                for sc in section_connections_db_records:
-                    Log.logger.info(
-                        f'SECTION_ID: {sc.section_id}, LEFT_SECTION: {sc.left_normal}, RIGHT_SECTION: {sc.right_normal}')
-
-                for sc in section_connections_db_records:
-                    self.tt_sec_obj_list.append(Sec())
-
-                sc_idx = 0
-                for sc in section_connections_db_records:
-                    self.tt_sec_obj_list[sc_idx].section_id = sc.section_id
-                    self.tt_sec_obj_list[sc_idx].left_normal = sc.left_normal
-                    self.tt_sec_obj_list[sc_idx].right_normal = sc.right_normal
-                    self.tt_sec_obj_list[sc_idx].left_reverse = sc.left_reverse
-                    self.tt_sec_obj_list[sc_idx].right_reverse = sc.right_reverse
-                    sc_idx += 1
-
-                point_config = self.get_point_config()
-
-                for point in point_config:
-                    for sec_idx in range(len(self.tt_sec_obj_list)):
-                        if self.tt_sec_obj_list[sec_idx].section_id == point.section_id:
-                            self.tt_sec_obj_list[sec_idx].point_id = point.point_id
-
-                            Log.logger.info(
-                                f'SECTION_ID: {self.tt_sec_obj_list[sec_idx].section_id}, POINT_ID: {self.tt_sec_obj_list[sec_idx].point_id}')
-                        else:
-                            pass
-                self.total_pm_sec = len(self.tt_sec_obj_list)
+                '''neighbours and points come from the yard topology, compiled once'''
+                self.init_trail_through_sections(self.scc_api.init_yard_topology())
             else:
                 pass
                 Log.logger.warning(f'database not connected!!')
@@ -102,70 +102,114 @@ class Trailthrough:
         except Exception as ex:
             Log.logger.critical(
                 f'init_section_connections_info: exception {ex}')
-    '''trail through detection using section status and point status'''
-    def detect_trail_through(self, section_json_data, point_data):        
+
+    def init_trail_through_sections(self, topology):
+        '''Sec views of the topology sections, numpy row arrays of the vectorized engine'''
+        for section_id in topology.section_ids:
+            tt_sec = Sec(self.yard_state, section_id)
+            Log.logger.info(
+                f'SECTION_ID: {section_id}, LEFT_SECTION: {tt_sec.left_normal}, RIGHT_SECTION: {tt_sec.right_normal}')
+            self.tt_sec_pos[tt_sec.row] = len(self.tt_sec_obj_list)
+            self.tt_sec_obj_list.append(tt_sec)
+            self.tt_sec_idx[section_id] = tt_sec
+
+            if topology.section_point(tt_sec.row) is not None:
+                Log.logger.info(
+                    f'SECTION_ID: {tt_sec.section_id}, POINT_ID: {tt_sec.point_id}')
+        self.total_pm_sec = len(self.tt_sec_obj_list)
+
+        if np is not None:
+            self.tt_rows = np.array([tt_sec.row for tt_sec in self.tt_sec_obj_list], dtype=np.intp)
+            for direction in NEIGHBOUR_DIRECTIONS:
+                self.tt_neighbour_rows[direction] = np.array(
+                    [topology.neighbour(tt_sec.row, direction) for tt_sec in self.tt_sec_obj_list], dtype=np.intp)
+
+    def apply_yard_config(self, snapshot):
+        '''rebuild the point sections from a reloaded yard configuration snapshot'''
         try:
-            sections_info = {}
-            sections_data = json.loads(section_json_data)
+            if not self.scc_api.apply_yard_config(snapshot):
+                return False
+            self.tt_sec_obj_list = []
+            self.tt_sec_idx = {}
+            self.tt_sec_pos = {}
+            self.tt_neighbour_rows = {}
+            self.init_trail_through_sections(self.yard_topology)
+            return True
+        except Exception as ex:
+            Log.logger.critical(f'trail through apply_yard_config: exception: {ex}')
+            return False
 
-            for json_idx in range(len(sections_data['sections'])):
-                sections_info[sections_data['sections'][json_idx]
-                             ['section_id']] = sections_data['sections'][json_idx]
+    def get_neighbour_id(self, tt_sec, direction):
+        '''neighbour section id of tt_sec, None for "NONE"/empty neighbours'''
+        row = self.yard_topology.neighbour(tt_sec.row, direction)
+        return self.yard_state.section_ids[row] if row != NO_ROW else None
+
+    def update_point_status(self, point_data):
+        '''update point status and point mode'''
+        for point in point_data:
+            for row in self.yard_topology.point_sections(point.point_id):
+                self.yard_state.set("point_status", row, point.point_status)
+                self.yard_state.set("point_mode", row, point.point_mode)
+
+    def neighbour_hit(self, neighbour_id, expected_direction):
+        '''neighbour occupied, moving in expected_direction, torpedo axle count changed.
+        State comes from the yard state table, a neighbour missing from the message keeps its last state.'''
+        row = self.yard_state.row_of(neighbour_id)
+        return self.yard_state.get("section_status", row) == "occupied" and \
+            self.yard_state.get("direction", row) == expected_direction and \
+            self.change_detector.axle_count_changed(neighbour_id)
+
+    def get_candidate_positions(self):
+        '''positions in tt_sec_obj_list of the sections next to a section whose torpedo axle count changed
+        in the snapshot last applied to the yard state, no other section can detect a trail through'''
+        rows = self.change_detector.affected_rows(self.change_detector.axle_count_changed_rows)
+        return sorted([self.tt_sec_pos[row] for row in rows if row in self.tt_sec_pos])
+
+    def detect_trail_through(self, section_json_data, point_data):
+        '''trail through detection with the configured engine'''
+        if self.engine == TRAIL_THROUGH_ENGINE_NUMPY:
+            return self.detect_trail_through_vectorized(section_json_data, point_data)
+        return self.detect_trail_through_reference(section_json_data, point_data)
+
+    '''trail through detection using section status and point status, reference per section loop'''
+    def detect_trail_through_reference(self, section_json_data, point_data):
+        try:
+            snapshot = to_section_snapshot(section_json_data)
                 
-            '''update point status and point mode'''
-            for point_idx in range(len(point_data)):
-                for sec_idx in range(self.total_pm_sec):
-                    if self.tt_sec_obj_list[sec_idx].point_id == point_data[point_idx].point_id:
-                        self.tt_sec_obj_list[sec_idx].point_status = point_data[point_idx].point_status
-                        self.tt_sec_obj_list[sec_idx].point_mode = point_data[point_idx].point_mode
+            self.update_point_status(point_data)
             
-            '''update section status having PM'''
-            for pm_sec_idx in range(self.total_pm_sec):
-                sec_idx = int(self.tt_sec_obj_list[pm_sec_idx].section_id.replace('S','')) - 1
-                if self.tt_sec_obj_list[pm_sec_idx].section_id == sections_data['sections'][sec_idx]['section_id']:
-                    self.tt_sec_obj_list[pm_sec_idx].section_status = sections_data['sections'][sec_idx]['section_status']
-                    self.tt_sec_obj_list[pm_sec_idx].direction = sections_data['sections'][sec_idx]['direction']
-                    self.tt_sec_obj_list[pm_sec_idx].torpedo_axle_count = sections_data['sections'][sec_idx]['torpedo_axle_count']
-                    self.tt_sec_obj_list[pm_sec_idx].error_code = sections_data['sections'][sec_idx]['error_code']
+            '''section status of sections having PM, no-op when the server already applied this snapshot'''
+            self.yard_state.update_from_snapshot(snapshot)
              
             tt_section_id = []
             
-            for pm_sec_idx in range(self.total_pm_sec):  
+            for pm_sec_idx in self.get_candidate_positions():
      
-                right_normal_sec_id = self.tt_sec_obj_list[pm_sec_idx].right_normal
-                left_normal_sec_id = self.tt_sec_obj_list[pm_sec_idx].left_normal
-                right_reverse_sec_id = self.tt_sec_obj_list[pm_sec_idx].right_reverse
-                left_reverse_sec_id = self.tt_sec_obj_list[pm_sec_idx].left_reverse
+                right_normal_sec_id = self.get_neighbour_id(self.tt_sec_obj_list[pm_sec_idx], RIGHT_NORMAL)
+                left_normal_sec_id = self.get_neighbour_id(self.tt_sec_obj_list[pm_sec_idx], LEFT_NORMAL)
+                right_reverse_sec_id = self.get_neighbour_id(self.tt_sec_obj_list[pm_sec_idx], RIGHT_REVERSE)
+                left_reverse_sec_id = self.get_neighbour_id(self.tt_sec_obj_list[pm_sec_idx], LEFT_REVERSE)
 
                 trail_through_flag = False
                 if self.tt_sec_obj_list[pm_sec_idx].section_status == "occupied" and\
-                        self.tt_sec_obj_list[pm_sec_idx].point_mode != "manual"\
-                        and len(self.prev_sections_info)!= 0:
-                    if left_normal_sec_id != '' and left_reverse_sec_id != '':
+                        self.tt_sec_obj_list[pm_sec_idx].point_mode != "manual":
+                    if left_normal_sec_id is not None and left_reverse_sec_id is not None:
                         if self.tt_sec_obj_list[pm_sec_idx].direction == "in" and\
                             self.tt_sec_obj_list[pm_sec_idx].point_status == "reverse":
-                            if sections_info[left_normal_sec_id]["section_status"] == "occupied" and\
-                                sections_info[left_normal_sec_id]["direction"] == "in" and\
-                                sections_info[left_normal_sec_id]["torpedo_axle_count"] != self.prev_sections_info[left_normal_sec_id]["torpedo_axle_count"]:
+                            if self.neighbour_hit(left_normal_sec_id, "in"):
                                     trail_through_flag = True
                         elif self.tt_sec_obj_list[pm_sec_idx].direction == "in" and\
                             self.tt_sec_obj_list[pm_sec_idx].point_status == "normal":
-                            if sections_info[left_reverse_sec_id]["section_status"] == "occupied" and\
-                                sections_info[left_reverse_sec_id]["direction"] == "in" and\
-                                sections_info[left_reverse_sec_id]["torpedo_axle_count"] != self.prev_sections_info[left_reverse_sec_id]["torpedo_axle_count"]:
+                            if self.neighbour_hit(left_reverse_sec_id, "in"):
                                     trail_through_flag = True
-                    elif right_normal_sec_id != '' and right_reverse_sec_id != '':
+                    elif right_normal_sec_id is not None and right_reverse_sec_id is not None:
                         if self.tt_sec_obj_list[pm_sec_idx].direction == "out" and\
                             self.tt_sec_obj_list[pm_sec_idx].point_status == "reverse":
-                            if sections_info[right_normal_sec_id]["section_status"] == "occupied" and\
-                                sections_info[right_normal_sec_id]["direction"] == "out" and\
-                                sections_info[right_normal_sec_id]["torpedo_axle_count"] != self.prev_sections_info[right_normal_sec_id]["torpedo_axle_count"]:
+                            if self.neighbour_hit(right_normal_sec_id, "out"):
                                    trail_through_flag = True    
                         elif self.tt_sec_obj_list[pm_sec_idx].direction == "out" and\
                             self.tt_sec_obj_list[pm_sec_idx].point_status == "normal":
-                            if sections_info[right_reverse_sec_id]["section_status"] == "occupied" and\
-                                sections_info[right_reverse_sec_id]["direction"] == "out" and\
-                                sections_info[right_reverse_sec_id]["torpedo_axle_count"] != self.prev_sections_info[right_reverse_sec_id]["torpedo_axle_count"]:
+                            if self.neighbour_hit(right_reverse_sec_id, "out"):
                                    trail_through_flag = True   
 
                 if(trail_through_flag):
@@ -173,9 +217,80 @@ class Trailthrough:
                     tt_section_id.append(self.tt_sec_obj_list[pm_sec_idx].section_id)                               
 
             Log.logger.info(f'return value: {tt_section_id}')
-            self.prev_sections_info = sections_info
             return tt_section_id
         except Exception as ex:
             Log.logger.critical(f'find trail through: exception: {ex}')
+            return []
+
+
 
+    '''trail through detection using section status and point status, numpy masks over the candidate sections'''
+    def detect_trail_through_vectorized(self, section_json_data, point_data):
+        '''same rules as detect_trail_through_reference, evaluated on the yard state columns'''
+        try:
+            snapshot = to_section_snapshot(section_json_data)
+
+            self.update_point_status(point_data)
+
+            '''section status of sections having PM, no-op when the server already applied this snapshot'''
+            self.yard_state.update_from_snapshot(snapshot)
+
+            tt_section_id = []
+            candidate_positions = self.get_candidate_positions()
+            if len(candidate_positions) == 0:
+                Log.logger.info(f'return value: {tt_section_id}')
+                return tt_section_id
+
+            '''column views are taken per message, a view must not outlive add_section'''
+            table = self.yard_state
+            section_status = table.as_numpy("section_status")
+            direction = table.as_numpy("direction")
+            point_status = table.as_numpy("point_status")
+            point_mode = table.as_numpy("point_mode")
+
+            occupied = table.code_of("section_status", "occupied")
+            dir_in = table.code_of("direction", "in")
+            dir_out = table.code_of("direction", "out")
+
+            axle_count_changed = np.zeros(len(table), dtype=bool)
+            axle_count_changed[list(self.change_detector.axle_count_changed_rows)] = True
 
+            positions = np.array(candidate_positions, dtype=np.intp)
+            rows = self.tt_rows[positions]
+            sec_direction = direction[rows]
+            sec_point_status = point_status[rows]
+            is_reverse = sec_point_status == table.code_of("point_status", "reverse")
+            is_normal = sec_point_status == table.code_of("point_status", "normal")
+            base = (section_status[rows] == occupied) & \
+                (point_mode[rows] != table.code_of("point_mode", "manual"))
+
+            neighbour_rows = {direction: self.tt_neighbour_rows[direction][positions]
+                              for direction in NEIGHBOUR_DIRECTIONS}
+            left_ok = (neighbour_rows[LEFT_NORMAL] >= 0) & (neighbour_rows[LEFT_REVERSE] >= 0)
+            right_ok = ~left_ok & (neighbour_rows[RIGHT_NORMAL] >= 0) & (neighbour_rows[RIGHT_REVERSE] >= 0)
+
+            def neighbour_hit(neighbour, expected_direction):
+                '''neighbour occupied, moving in expected_direction, torpedo axle count changed'''
+                safe = np.where(neighbour >= 0, neighbour, 0)
+                return (neighbour >= 0) & (section_status[safe] == occupied) & \
+                    (direction[safe] == expected_direction) & \
+                    axle_count_changed[safe]
+
+            sec_in = sec_direction == dir_in
+            sec_out = sec_direction == dir_out
+            trail_through_flag = base & (
+                (left_ok & sec_in & is_reverse & neighbour_hit(neighbour_rows[LEFT_NORMAL], dir_in)) |
+                (left_ok & sec_in & is_normal & neighbour_hit(neighbour_rows[LEFT_REVERSE], dir_in)) |
+                (right_ok & sec_out & is_reverse & neighbour_hit(neighbour_rows[RIGHT_NORMAL], dir_out)) |
+                (right_ok & sec_out & is_normal & neighbour_hit(neighbour_rows[RIGHT_REVERSE], dir_out)))
+
+            for pm_sec_idx in positions[trail_through_flag]:
+                section_id = self.tt_sec_obj_list[pm_sec_idx].section_id
+                Log.logger.info(f'trail-through detected in Section id:{section_id}')
+                tt_section_id.append(section_id)
+
+            Log.logger.info(f'return value: {tt_section_id}')
+            return tt_section_id
+        except Exception as ex:
+            Log.logger.critical(f'find trail through vectorized: exception: {ex}')
+            return []
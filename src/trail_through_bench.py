@@ -0,0 +1,128 @@
+'''
+*****************************************************************************
+*File : trail_through_bench.py
+*Module : SCC
+*Purpose : Trail through engine comparison on synthetic yards, reference loop against numpy engine
+*Author : Sumankumar Panchal
+*Copyright : Copyright 2021, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+'''Import packages '''
+import sys
+import time
+import random
+import logging
+
+sys.path.insert(1, "./common")
+from scc_log import *
+from scc_section_snapshot import *
+from scc_yard_state import *
+from scc_topology import *
+from trail_through import *
+
+
+class SyntheticRecord:
+    '''layout_section_connections / pms_config record of a synthetic yard'''
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class SyntheticPoint:
+    def __init__(self, point_id, point_status, point_mode):
+        self.point_id = point_id
+        self.point_status = point_status
+        self.point_mode = point_mode
+
+
+def synthetic_yard(total_sections, rnd):
+    '''random section connections and points of a yard with total_sections sections'''
+    section_ids = [f"S{i + 1}" for i in range(total_sections)]
+    section_records = []
+    for section_id in section_ids:
+        neighbours = {direction: (rnd.choice(section_ids) if rnd.random() < 0.6 else "NONE")
+                      for direction in NEIGHBOUR_DIRECTIONS}
+        section_records.append(SyntheticRecord(section_id=section_id, **neighbours))
+    point_records = [SyntheticRecord(section_id=section_id, point_id=f"P{i + 1}")
+                     for i, section_id in enumerate(rnd.sample(section_ids, max(1, total_sections // 3)))]
+    return section_ids, section_records, point_records
+
+
+def synthetic_section(section_id, rnd):
+    return {"section_id": section_id,
+            "section_status": rnd.choice(["occupied", "cleared", "none"]),
+            "direction": rnd.choice(["in", "out", "none"]),
+            "torpedo_axle_count": rnd.randint(0, 3),
+            "engine_axle_count": 0,
+            "speed": 1.0,
+            "torpedo_status": "none",
+            "first_axle": "none",
+            "error_code": 0}
+
+
+def synthetic_messages(section_ids, point_records, total_messages, rnd, activity=1.0, missing=0.0):
+    '''random section_info snapshots and point status of the synthetic yard,
+    activity is the fraction of sections getting new random state in each message,
+    missing the fraction of sections left out of each message'''
+    messages = []
+    sections = [synthetic_section(section_id, rnd) for section_id in section_ids]
+    for ts in range(total_messages):
+        sections = [synthetic_section(section["section_id"], rnd) if rnd.random() < activity else section
+                    for section in sections]
+        msg = {"ts": ts, "sections": [section for section in sections if rnd.random() >= missing]
+               if missing > 0 else sections}
+        points = [SyntheticPoint(point.point_id, rnd.choice(["normal", "reverse"]), rnd.choice(["auto", "manual"]))
+                  for point in point_records]
+        messages.append((SectionSnapshot(None, msg), points))
+    return messages
+
+
+def compare_trail_through_engines(section_counts=(14, 100, 500, 2000), total_messages=200, seed=1, activity=1.0,
+                                  missing=0.0):
+    '''run reference and vectorized engine on the same synthetic yards, check equal results, time both'''
+    results = []
+    for total_sections in section_counts:
+        rnd = random.Random(seed)
+        section_ids, section_records, point_records = synthetic_yard(total_sections, rnd)
+        messages = synthetic_messages(section_ids, point_records, total_messages, rnd, activity, missing)
+
+        engine_results = {}
+        engine_time = {}
+        for engine in [TRAIL_THROUGH_ENGINE_REFERENCE, TRAIL_THROUGH_ENGINE_NUMPY]:
+            tt = Trailthrough(None, YardStateTable(), engine)
+            tt.yard_topology.load(section_records, point_records)
+            tt.init_trail_through_sections(tt.yard_topology)
+            detected = []
+            start = time.perf_counter()
+            for snapshot, points in messages:
+                detected.append(tt.detect_trail_through(snapshot, points))
+            engine_time[tt.engine] = time.perf_counter() - start
+            engine_results[tt.engine] = detected
+
+        reference = engine_results[TRAIL_THROUGH_ENGINE_REFERENCE]
+        vectorized = engine_results.get(TRAIL_THROUGH_ENGINE_NUMPY)
+        results.append({"sections": total_sections,
+                        "messages": total_messages,
+                        "activity": activity,
+                        "missing": missing,
+                        "detected": sum(len(ids) for ids in reference),
+                        "equal": vectorized == reference,
+                        "reference_ms": round(engine_time[TRAIL_THROUGH_ENGINE_REFERENCE] * 1000, 2),
+                        "numpy_ms": round(engine_time[TRAIL_THROUGH_ENGINE_NUMPY] * 1000, 2)
+                        if TRAIL_THROUGH_ENGINE_NUMPY in engine_time else None})
+    return results
+
+
+if __name__ == '__main__':
+    if Log.logger is None:
+        my_log = Log()
+
+    '''trail through rules log every message, only warnings are kept while the engines run,
+    the last case leaves sections out of the messages'''
+    for activity, missing in [(1.0, 0.0), (0.05, 0.0), (1.0, 0.2)]:
+        Log.logger.setLevel(logging.WARNING)
+        results = compare_trail_through_engines(activity=activity, missing=missing)
+        Log.logger.setLevel(logging.INFO)
+        for result in results:
+            Log.logger.info(f'trail through engines: {result}')